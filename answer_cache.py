@@ -0,0 +1,207 @@
+"""
+AIVA - Answer Cache
+cache คำตอบจาก AI ร่วมกันทุก gunicorn worker ด้วย SQLite (WAL)
+
+- key = corpus version + คำถามที่ normalize แล้ว (ตัดช่องว่าง/เครื่องหมาย/คำลงท้าย ครับ ค่ะ คะ)
+  เครื่องหมายและช่องว่างระหว่างตัวเลข (3.5, 1-2, 10:30) คงไว้ เพราะเปลี่ยนความหมาย
+- จำกัดจำนวน entry แบบ LRU และหมดอายุตาม TTL
+- get() อ่านอย่างเดียว: เวลาใช้ล่าสุด (LRU) และสถิติ hit/miss สะสมในหน่วยความจำ
+  แล้วเขียนรวมทีเดียวทุก ACCESS_FLUSH_INTERVAL วินาที หรือตอน put()/stats()
+- เมื่อ data_files/ หรือ faq.json เปลี่ยน corpus version จะเปลี่ยน entry เก่าจึงไม่ถูกใช้และถูกลบทิ้ง
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("AIVA_CACHE_DIR", ".cache")
+
+# คำลงท้ายที่ไม่เปลี่ยนความหมายของคำถาม (ตัดเฉพาะท้ายประโยค เพราะ "คะ" อยู่ในคำอย่าง "คะแนน")
+# ไม่มี "นะ"/"ค่า"/"คับ" เดี่ยวๆ เพราะเป็นท้ายคำได้ ("ชนะ", "มีค่า", "บังคับ") ตัดได้เฉพาะแบบผสม เช่น "นะครับ"
+THAI_PARTICLES = (
+    "นะครับ", "นะคะ", "นะค่ะ", "ครับผม", "ครับ", "ค่ะ", "คะ",
+    "จ้า", "จ้ะ", "จ๊ะ", "ฮะ",
+)
+_PUNCT_RE = re.compile(r"[\?\!\.,;:'\"“”‘’\(\)\-~…/]")
+_SPACE_RE = re.compile(r"\s+")
+_DIGIT_RE = re.compile(r"[0-9]")
+_WORD_CHAR_RE = re.compile(r"[0-9a-z]")
+
+# เขียนเวลาใช้ล่าสุดและสถิติที่สะสมจาก get() ลง SQLite อย่างน้อยทุกกี่วินาที
+ACCESS_FLUSH_INTERVAL = float(os.environ.get("AIVA_ANSWER_CACHE_FLUSH", "30"))
+ACCESS_FLUSH_MAX = 200
+
+
+def _between(text: str, match, pattern) -> bool:
+    return (match.start() > 0 and match.end() < len(text)
+            and bool(pattern.match(text[match.start() - 1])) and bool(pattern.match(text[match.end()])))
+
+
+def normalize_question(question: str) -> str:
+    """normalize คำถามสำหรับใช้เป็น cache key"""
+    text = unicodedata.normalize("NFC", question).lower()
+    # เครื่องหมายระหว่างตัวเลขเป็นส่วนของค่า ("3.5" ไม่ใช่ "35") ที่เหลือถือเป็นตัวคั่น
+    text = _PUNCT_RE.sub(lambda m: m.group() if _between(text, m, _DIGIT_RE) else " ", text)
+    # ภาษาไทยไม่เว้นวรรคระหว่างคำ จึงตัดช่องว่างทิ้ง ยกเว้นระหว่างตัวเลข/อักษรละติน ("ห้อง 3 5" ไม่ใช่ "ห้อง 35")
+    text = text.strip()
+    text = _SPACE_RE.sub(lambda m: " " if _between(text, m, _WORD_CHAR_RE) else "", text)
+    # ตัดคำลงท้ายครั้งเดียว (ตัดซ้ำจะกินท้ายคำจริง)
+    for particle in THAI_PARTICLES:
+        if text.endswith(particle) and len(text) > len(particle):
+            return text[:-len(particle)]
+    return text
+
+
+class AnswerCache:
+    def __init__(self, path: str = None, max_entries: int = 5000, ttl: float = 24 * 3600,
+                 flush_interval: float = ACCESS_FLUSH_INTERVAL):
+        self.path = path or os.path.join(CACHE_DIR, "answers.sqlite3")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._pending_access = {}   # key -> เวลาใช้ล่าสุดที่ยังไม่ได้เขียน
+        self._pending_counts = {}   # ชื่อสถิติ -> จำนวนที่ยังไม่ได้เขียน
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                corpus_version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_access ON answers(last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connection ใช้ข้าม thread ไม่ได้ จึงแยกต่อ thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(question: str, corpus_version: str) -> str:
+        return hashlib.sha256(f"{corpus_version}\0{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _count(self, name: str):
+        with self._pending_lock:
+            self._pending_counts[name] = self._pending_counts.get(name, 0) + 1
+
+    def _write_pending(self, conn):
+        """เขียนเวลาใช้ล่าสุดและสถิติที่สะสมไว้ (เรียกภายใน transaction)"""
+        with self._pending_lock:
+            access, self._pending_access = self._pending_access, {}
+            counts, self._pending_counts = self._pending_counts, {}
+            self._last_flush = time.monotonic()
+        if access:
+            conn.executemany("UPDATE answers SET last_access = MAX(last_access, ?) WHERE key = ?",
+                             [(when, key) for key, when in access.items()])
+        for name, value in counts.items():
+            conn.execute("INSERT INTO stats(name, value) VALUES (?, ?) "
+                         "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+    def flush(self):
+        """เขียนข้อมูลที่ get() สะสมไว้ลง SQLite"""
+        try:
+            conn = self._conn()
+            with conn:
+                self._write_pending(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache access flush failed: {e}")
+
+    def _maybe_flush(self):
+        with self._pending_lock:
+            due = (len(self._pending_access) >= ACCESS_FLUSH_MAX
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def get(self, question: str, corpus_version: str, count_miss: bool = True):
+        """คืนคำตอบที่ cache ไว้ หรือ None (count_miss=False สำหรับการเช็คซ้ำที่นับ miss ไปแล้ว)"""
+        key = self.make_key(question, corpus_version)
+        now = time.time()
+        try:
+            row = self._conn().execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache read failed: {e}")
+            return None
+        if row and now - row[1] <= self.ttl:
+            with self._pending_lock:
+                self._pending_access[key] = now
+            self._count("hits")
+            self._maybe_flush()
+            return row[0]
+        if row:
+            try:
+                conn = self._conn()
+                with conn:
+                    conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logger.warning(f"Answer cache expiry failed: {e}")
+            self._count("expired")
+        if count_miss:
+            self._count("misses")
+        self._maybe_flush()
+        return None
+
+    def put(self, question: str, corpus_version: str, answer: str):
+        key = self.make_key(question, corpus_version)
+        now = time.time()
+        try:
+            conn = self._conn()
+            with conn:
+                # เวลาใช้ล่าสุดที่ค้างอยู่ต้องเขียนก่อนเลือก entry ที่จะลบแบบ LRU
+                self._write_pending(conn)
+                conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, corpus_version, question, answer, now, now))
+                (count,) = conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+                if count > self.max_entries:
+                    conn.execute("DELETE FROM answers WHERE key IN "
+                                 "(SELECT key FROM answers ORDER BY last_access LIMIT ?)",
+                                 (count - self.max_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache write failed: {e}")
+
+    def invalidate_other_versions(self, corpus_version: str):
+        """ลบคำตอบที่สร้างจาก corpus เวอร์ชันอื่น"""
+        try:
+            conn = self._conn()
+            with conn:
+                deleted = conn.execute("DELETE FROM answers WHERE corpus_version != ?",
+                                       (corpus_version,)).rowcount
+            if deleted:
+                logger.info(f"Answer cache: removed {deleted} entries from previous corpus versions")
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache invalidation failed: {e}")
+
+    def stats(self) -> dict:
+        self.flush()
+        try:
+            conn = self._conn()
+            result = {name: value for name, value in conn.execute("SELECT name, value FROM stats")}
+            (result["entries"],) = conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache stats failed: {e}")
+            return {}
+        for name in ("hits", "misses", "expired"):
+            result.setdefault(name, 0)
+        lookups = result["hits"] + result["misses"]
+        result["hit_ratio"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+        return result
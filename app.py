@@ -2,13 +2,29 @@
 AIVA - AI Vocational Assistant
 Flask Backend Server
 """
+import io
 import os
-import tempfile
+import contextvars
+import json
+import atexit
 import threading
+import time
 import datetime
 import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, jsonify, request, send_file
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from flask import Flask, render_template, jsonify, request, send_file, send_from_directory, abort, Response, \
+    stream_with_context, g, url_for
+from werkzeug.security import safe_join
+
+import metrics
+import log_pipeline
+from build_assets import DIST_NAME, load_manifest
+from faq_matcher import FaqMatcher
+from feedback_writer import FeedbackWriter
+from tts_cache import TTSCache, tts_key
+from tts_pipeline import split_sentences
 
 # ==============================================================================
 # Load .env file
@@ -29,37 +45,8 @@ load_env()
 # Logging Configuration
 # ==============================================================================
 def setup_logging():
-    """ตั้งค่าระบบ logging แบบหมุนเวียนไฟล์อัตโนมัติ"""
-    # สร้างโฟลเดอร์ logs ถ้ายังไม่มี
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-
-    # สร้าง RotatingFileHandler (หมุนเวียนเมื่อไฟล์ใหญ่ถึง 10MB, เก็บไว้ 5 ไฟล์)
-    log_file = os.path.join(log_dir, "aiva.log")
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5,
-        encoding='utf-8'
-    )
-
-    # กำหนด format สำหรับ log (plain text)
-    log_format = logging.Formatter(
-        '%(asctime)s - %(levelname)s - [%(name)s] - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(log_format)
-
-    # สร้าง console handler สำหรับแสดงผลใน terminal
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_format)
-
-    # ตั้งค่า root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)  # จับทุก level
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-
+    """ตั้งค่า logging ผ่านคิว (เขียนไฟล์หมุนเวียน/console ใน thread เบื้องหลัง ดู log_pipeline.py)"""
+    log_pipeline.setup_logging(log_dir="logs")
     return logging.getLogger(__name__)
 
 logger = setup_logging()
@@ -73,6 +60,19 @@ logger.info("=" * 60)
 API_KEY = os.environ.get("GROQ_API_KEY", "")
 PDF_FOLDER_PATH = "data_files"
 PORT = 5003
+TTS_CACHE_MAX_MB = int(os.environ.get("AIVA_TTS_CACHE_MB", "200"))
+TTS_MEMORY_MB = int(os.environ.get("AIVA_TTS_MEMORY_MB", "32"))  # LRU เสียงในหน่วยความจำต่อ worker
+TTS_MAX_AGE = 365 * 24 * 3600  # ไฟล์เสียงเป็น content-addressed เปลี่ยนไม่ได้ จึง cache ได้นาน
+ASSET_MAX_AGE = 365 * 24 * 3600  # ไฟล์ใน static/dist มี content hash ในชื่อ
+TTS_WORKERS = int(os.environ.get("AIVA_TTS_WORKERS", "3"))  # จำนวน gTTS ที่สังเคราะห์พร้อมกันต่อ worker
+BATCH_MAX_QUESTIONS = int(os.environ.get("AIVA_BATCH_MAX", "100"))  # จำนวนคำถามสูงสุดต่อ /ask_batch
+ADMIN_TOKEN = os.environ.get("AIVA_ADMIN_TOKEN", "")  # token ของ /admin/* (ว่าง = ปิด endpoint)
+
+GREETINGS = [
+    "สวัสดีค่ะ! ดิฉันชื่อไอว่า ยินดีต้อนรับเข้าสู่ระบบค่ะ มีอะไรให้ช่วยไหมคะ",
+    "สวัสดีค่ะ! ดิฉันไอว่า ผู้ช่วยอัจฉริยะของวิทยาลัยพณิชยการธนบุรี ยินดีให้บริการค่ะ",
+    "สวัสดีค่ะ! ดิฉันไอว่าค่ะ มีคำถามอะไรเกี่ยวกับการรับสมัคร หลักสูตร หรืออาชีพ สอบถามได้เลยนะคะ"
+]
 
 logger.info(f"Configuration loaded - PDF Folder: {PDF_FOLDER_PATH}, Port: {PORT}")
 
@@ -95,6 +95,16 @@ except Exception as e:
     logger.error(f"Firebase initialization error: {e}")
     pass
 
+# feedback เขียนลง Firestore เบื้องหลังเป็น batch (ไม่ให้ request รอ Firestore)
+feedback_writer = None
+if db:
+    feedback_writer = FeedbackWriter(
+        db,
+        batch_size=int(os.environ.get("AIVA_FEEDBACK_BATCH", "20")),
+        flush_interval=float(os.environ.get("AIVA_FEEDBACK_FLUSH", "2")),
+    ).start()
+    atexit.register(feedback_writer.close)
+
 # ==============================================================================
 # Module Imports
 # ==============================================================================
@@ -106,10 +116,11 @@ except ImportError:
     import json
 
     class PdfAIEngine:
-        def __init__(self, pdf_folder_path, api_key):
+        def __init__(self, pdf_folder_path, api_key, extract_workers=None):
             self.api_key = api_key
             self.knowledge_base = self._load_knowledge(pdf_folder_path)
             self.faq_data = self._load_faq()
+            self.faq_matcher = FaqMatcher(self.faq_data)
 
         def _load_knowledge(self, folder_path):
             """อ่านข้อมูลจาก PDF และ TXT"""
@@ -152,13 +163,7 @@ except ImportError:
 
         def _check_faq(self, question):
             """ตรวจสอบว่าคำถามตรงกับ FAQ หรือไม่"""
-            question_lower = question.lower().strip()
-            for faq in self.faq_data:
-                keywords = faq.get("keywords", [])
-                for keyword in keywords:
-                    if keyword.lower() in question_lower:
-                        return faq.get("answer", "")
-            return None
+            return self.faq_matcher.answer(question.strip())
 
         def _get_context(self, question, max_chars=6000):
             """เลือกข้อมูลที่เกี่ยวข้อง"""
@@ -238,9 +243,30 @@ logger.info(f"PDF folder created/verified: {PDF_FOLDER_PATH}")
 app = Flask(__name__, static_folder='static', template_folder='templates')
 logger.info("Flask app initialized")
 
-ai = PdfAIEngine(pdf_folder_path=PDF_FOLDER_PATH, api_key=API_KEY)
+# ไฟล์ static ที่ build แล้ว (python build_assets.py) ถ้ายังไม่ได้ build จะใช้ไฟล์เดิมใน static/
+asset_manifest = load_manifest(app.static_folder)
+if asset_manifest:
+    logger.info(f"Static asset manifest loaded ({len(asset_manifest)} files)")
+else:
+    logger.warning("Static assets not built - serving originals (run: python build_assets.py)")
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL ของไฟล์ static: ไฟล์ที่มี content hash ใน static/dist ถ้ามีใน manifest"""
+    return url_for("static", filename=asset_manifest.get(filename, filename))
+
+
+# python app.py: process ลูกของ pool ดึง PDF (spawn/forkserver) จะ import app.py ซ้ำทั้งไฟล์
+# จึงดึงใน process นี้ เว้นแต่ตั้ง AIVA_EXTRACT_WORKERS ไว้เอง
+EXTRACT_WORKERS = 1 if __name__ == "__main__" and not os.environ.get("AIVA_EXTRACT_WORKERS") else None
+ai = PdfAIEngine(pdf_folder_path=PDF_FOLDER_PATH, api_key=API_KEY, extract_workers=EXTRACT_WORKERS)
 logger.info("AI Engine initialized")
 
+tts_cache = TTSCache(max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024,
+                     memory_bytes=TTS_MEMORY_MB * 1024 * 1024) if TTS_AVAILABLE else None
+tts_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts") if TTS_AVAILABLE else None
+
 state = {"last_question": "", "last_answer": ""}
 state_lock = threading.Lock()
 
@@ -249,6 +275,14 @@ def update_state(key, value):
         state[key] = value
         logger.debug(f"State updated: {key} = {value[:50] if isinstance(value, str) else value}...")
 
+def warm_tts_cache():
+    """สร้างเสียงคำตอบ FAQ และคำทักทายไว้ล่วงหน้า (เรียกตอน deploy ผ่าน tts_cache.py warm)"""
+    if not tts_cache:
+        logger.warning("TTS warm-up skipped - gTTS not available")
+        return 0
+    texts = GREETINGS + [faq.get("answer", "") for faq in getattr(ai, "faq_data", [])]
+    return tts_cache.warm_up(texts)
+
 # ==============================================================================
 # Routes
 # ==============================================================================
@@ -262,13 +296,8 @@ def index():
 def greeting():
     """ส่งข้อความทักทายเริ่มต้น"""
     logger.info(f"Request: GET /greeting from {request.remote_addr}")
-    greetings = [
-        "สวัสดีค่ะ! ดิฉันชื่อไอว่า ยินดีต้อนรับเข้าสู่ระบบค่ะ มีอะไรให้ช่วยไหมคะ",
-        "สวัสดีค่ะ! ดิฉันไอว่า ผู้ช่วยอัจฉริยะของวิทยาลัยพณิชยการธนบุรี ยินดีให้บริการค่ะ",
-        "สวัสดีค่ะ! ดิฉันไอว่าค่ะ มีคำถามอะไรเกี่ยวกับการรับสมัคร หลักสูตร หรืออาชีพ สอบถามได้เลยนะคะ"
-    ]
     import random
-    message = random.choice(greetings)
+    message = random.choice(GREETINGS)
     logger.info(f"Response: /greeting - Sent greeting message")
     return jsonify({"ok": True, "message": message})
 
@@ -288,7 +317,7 @@ def ask():
 
         logger.debug(f"Sending question to AI engine: {text}")
         answer = ai.find_answer(text)
-        logger.info(f"AI Response: {answer[:100]}...")
+        logger.debug(f"AI Response: {answer[:100]}...")
 
         update_state("last_question", text)
         update_state("last_answer", answer)
@@ -296,9 +325,98 @@ def ask():
         return jsonify({"ok": True, "answer": answer})
     except Exception as e:
         logger.error(f"Error in /ask endpoint: {str(e)}", exc_info=True)
+        metrics.inc("aiva_errors_total", stage="ask")
         return jsonify({"ok": False, "answer": str(e)}), 500
 
 
+@app.route("/ask_batch", methods=["POST"])
+def ask_batch():
+    """ถามหลายคำถามในครั้งเดียว (เช่น ทดสอบคำถามชุดใหญ่ / เตรียมคำตอบล่วงหน้า)
+
+    body: {"questions": ["...", ...]} คืนผลลัพธ์ตามลำดับเดิม พร้อมเวลาที่ใช้ของแต่ละข้อ
+    """
+    try:
+        started = time.perf_counter()
+        data = request.json or {}
+        questions = data.get("questions")
+        logger.info(f"Request: POST /ask_batch from {request.remote_addr}")
+
+        if not isinstance(questions, list) or not questions:
+            logger.warning("Empty question batch received")
+            return jsonify({"ok": False, "error": "No questions"}), 400
+        if len(questions) > BATCH_MAX_QUESTIONS:
+            return jsonify({"ok": False, "error": f"Too many questions (max {BATCH_MAX_QUESTIONS})"}), 400
+        questions = [str(q).strip() for q in questions]
+        if not all(questions):
+            return jsonify({"ok": False, "error": "Empty question in batch"}), 400
+        logger.info(f"Batch received: {len(questions)} questions")
+
+        if hasattr(ai, "find_answers"):
+            results = ai.find_answers(questions)
+        else:
+            results = []
+            for question in questions:
+                item_started = time.perf_counter()
+                answer = ai.find_answer(question)
+                results.append({"question": question, "answer": answer, "source": "ai",
+                                "elapsed_ms": round((time.perf_counter() - item_started) * 1000, 1)})
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Batch answered: {len(results)} questions in {elapsed_ms}ms")
+        return jsonify({"ok": True, "results": results, "elapsed_ms": elapsed_ms})
+    except Exception as e:
+        logger.error(f"Error in /ask_batch endpoint: {str(e)}", exc_info=True)
+        metrics.inc("aiva_errors_total", stage="ask_batch")
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+
+def _sse(payload, event=None):
+    """จัดรูปแบบข้อมูล 1 event ของ Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.route("/ask_stream", methods=["POST"])
+def ask_stream():
+    """ถาม AI แบบ streaming (Server-Sent Events) ให้หน้าจอแสดงคำตอบตั้งแต่ token แรก"""
+    data = request.json or {}
+    text = data.get("question", "").strip()
+    logger.info(f"Request: POST /ask_stream from {request.remote_addr}")
+    logger.info(f"Question received: {text}")
+
+    if not text:
+        logger.warning("Empty question received")
+        return jsonify({"ok": False, "answer": "No question"}), 400
+
+    def generate():
+        parts = []
+        try:
+            if hasattr(ai, "stream_answer"):
+                deltas = ai.stream_answer(text)
+            else:
+                deltas = [ai.find_answer(text)]
+            for delta in deltas:
+                parts.append(delta)
+                yield _sse({"delta": delta})
+
+            answer = "".join(parts).strip()
+            logger.debug(f"AI Response: {answer[:100]}...")
+            update_state("last_question", text)
+            update_state("last_answer", answer)
+            yield _sse({"ok": True, "answer": answer}, event="done")
+        except Exception as e:
+            # รวมถึงโมเดลล้มเหลวกลางคำตอบ: ส่ง error ให้หน้าเว็บถาม /ask ใหม่ แทน done กับคำตอบที่ไม่ครบ
+            logger.error(f"Error in /ask_stream endpoint: {str(e)}", exc_info=True)
+            metrics.inc("aiva_errors_total", stage="ask_stream")
+            yield _sse({"ok": False, "answer": str(e)}, event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/tts_audio", methods=["POST"])
 def tts_audio():
     """สร้างไฟล์เสียงส่งให้ browser"""
@@ -317,26 +435,99 @@ def tts_audio():
             logger.warning("Empty TTS text received")
             return jsonify({"ok": False, "error": "No text"}), 400
 
-        logger.info("Generating TTS audio...")
-        tts_obj = gTTS(text=text, lang='th', slow=False)
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-        tmp_path = tmp_file.name
-        tmp_file.close()
-        tts_obj.save(tmp_path)
-        logger.info(f"TTS audio generated: {tmp_path}")
+        lang = data.get("lang", "th")
+        slow = bool(data.get("slow", False))
+        key, audio = tts_cache.get_or_create(text, lang=lang, slow=slow)
+        logger.info(f"TTS audio ready: {key[:12]} (cache hits {tts_cache.hits}, misses {tts_cache.misses})")
 
-        return send_file(tmp_path, mimetype='audio/mpeg')
+        # Content-Location ให้ browser ขอไฟล์เดิมซ้ำผ่าน GET ซึ่ง cache ได้
+        response = _audio_response(key, audio)
+        response.headers["Content-Location"] = f"/tts_audio/{key}.mp3"
+        return response
     except Exception as e:
         logger.error(f"Error in /tts_audio endpoint: {str(e)}", exc_info=True)
+        metrics.inc("aiva_errors_total", stage="tts")
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+def _audio_response(key, audio):
+    """ส่งเสียงจาก buffer ในหน่วยความจำ (รองรับ ETag/304 และ Range request ของ <audio>)"""
+    return send_file(io.BytesIO(audio), mimetype='audio/mpeg', etag=key, max_age=TTS_MAX_AGE,
+                     conditional=True)
+
+
+def _prefetch_tts(text, lang, slow):
+    try:
+        tts_cache.get_or_create(text, lang=lang, slow=slow)
+    except Exception as e:
+        logger.warning(f"TTS prefetch failed: {e}")
+        metrics.inc("aiva_errors_total", stage="tts")
+
+
+@app.route("/tts_plan", methods=["POST"])
+def tts_plan():
+    """แบ่งข้อความเป็นประโยคแล้วเริ่มสังเคราะห์ทุกส่วนพร้อมกันเบื้องหลัง
+
+    คืน URL ของแต่ละส่วนตามลำดับ ให้ browser เล่นส่วนแรกได้ทันทีที่พร้อม
+    ขณะที่ส่วนถัดไปยังสังเคราะห์อยู่
+    """
+    logger.info(f"Request: POST /tts_plan from {request.remote_addr}")
+
+    if not TTS_AVAILABLE:
+        logger.warning("TTS requested but not available")
+        return jsonify({"ok": False, "error": "TTS not available"}), 500
+
+    data = request.json or {}
+    text = data.get("text", "").strip()
+    if not text:
+        logger.warning("Empty TTS text received")
+        return jsonify({"ok": False, "error": "No text"}), 400
+
+    lang = data.get("lang", "th")
+    slow = bool(data.get("slow", False))
+    chunks = []
+    for chunk_text in split_sentences(text):
+        key = tts_key(chunk_text, lang, slow)
+        query = urlencode({"text": chunk_text, "lang": lang, "slow": int(slow)})
+        chunks.append({"text": chunk_text, "url": f"/tts_audio/{key}.mp3?{query}"})
+        tts_pool.submit(contextvars.copy_context().run, _prefetch_tts, chunk_text, lang, slow)
+    logger.info(f"TTS plan: {len(chunks)} chunks")
+    return jsonify({"ok": True, "chunks": chunks})
+
+
+@app.route("/tts_audio/<key>.mp3", methods=["GET"])
+def tts_audio_cached(key):
+    """ไฟล์เสียงตาม content hash (immutable)
+
+    ถ้ายังไม่มีใน cache และส่ง text/lang/slow ที่ hash ตรงกับ key มาด้วย จะสังเคราะห์ให้
+    (ถ้า prefetch ของ /tts_plan กำลังทำอยู่ จะรอผลเดียวกัน)
+    """
+    if not tts_cache or len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+        abort(404)
+    audio = tts_cache.lookup(key)
+    if audio is None:
+        text = request.args.get("text", "")
+        lang = request.args.get("lang", "th")
+        slow = request.args.get("slow", "0") == "1"
+        if not text or tts_key(text, lang, slow) != key:
+            abort(404)
+        try:
+            _, audio = tts_cache.get_or_create(text, lang=lang, slow=slow)
+        except Exception as e:
+            logger.error(f"Error synthesizing TTS chunk: {str(e)}", exc_info=True)
+            metrics.inc("aiva_errors_total", stage="tts")
+            return jsonify({"ok": False, "error": str(e)}), 500
+    response = _audio_response(key, audio)
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/submit_feedback', methods=['POST'])
 def submit_feedback():
     """บันทึกคะแนนดาว"""
     logger.info(f"Request: POST /submit_feedback from {request.remote_addr}")
 
-    if not db:
+    if not feedback_writer:
         logger.warning("Feedback received but Firebase not configured")
         return jsonify({"success": True, "message": "ขอบคุณสำหรับคำแนะนำค่ะ"})
 
@@ -346,23 +537,143 @@ def submit_feedback():
         feedback = data.get('feedback_text', '')
         logger.info(f"Feedback received - Rating: {rating}, Text: {feedback[:50] if feedback else 'N/A'}...")
 
-        db.collection('ratings').document().set({
+        feedback_writer.submit({
             'rating': rating,
             'feedback': feedback,
             'timestamp': datetime.datetime.now(datetime.timezone.utc)
         })
-        logger.info("Feedback saved to Firebase successfully")
+        logger.info("Feedback queued for Firebase")
 
         return jsonify({"success": True, "message": "ขอบคุณสำหรับคำแนะนำค่ะ"})
     except Exception as e:
         logger.error(f"Error in /submit_feedback endpoint: {str(e)}", exc_info=True)
+        metrics.inc("aiva_errors_total", stage="feedback")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/status", methods=["GET"])
+def status():
+    """สถานะระบบสำหรับ monitoring (corpus version, answer cache, สถานะโมเดล)"""
+    answer_cache = getattr(ai, "answer_cache", None)
+    router = getattr(ai, "router", None)
+    return jsonify({
+        "ok": True,
+        "corpus_version": getattr(ai, "corpus_version", None),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "models": router.snapshot() if router else None,
+        "hedging": dict(enabled=ai.hedging, **ai.hedge_budget.stats()) if hasattr(ai, "hedge_budget") else None,
+        "coalescing": ai.single_flight.stats() if getattr(ai, "single_flight", None) else None,
+        "feedback": feedback_writer.stats() if feedback_writer else None,
+        "tts_cache": tts_cache.stats() if tts_cache else None,
+        "logging": log_pipeline.stats(),
+    })
+
+
+@app.route("/model_status", methods=["GET"])
+def model_status():
+    """สถานะ circuit breaker ของแต่ละโมเดลใน worker นี้"""
+    router = getattr(ai, "router", None)
+    return jsonify({"ok": True, "pid": os.getpid(), "models": router.snapshot() if router else None})
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """build knowledge base ใหม่ (เฉพาะไฟล์ที่เปลี่ยน) แล้วสลับเข้าใช้งานใน worker นี้โดยไม่ต้อง restart
+
+    worker อื่นจะเห็นการเปลี่ยนแปลงเองผ่าน AIVA_RELOAD_INTERVAL
+    """
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        abort(403)
+    if not hasattr(ai, "reload"):
+        return jsonify({"ok": False, "error": "Reload not supported"}), 501
+    force = request.args.get("force") == "1"
+    try:
+        started = time.perf_counter()
+        reloaded = ai.reload(force=force)
+        return jsonify({
+            "ok": True,
+            "reloaded": reloaded,
+            "pid": os.getpid(),
+            "corpus_version": ai.corpus_version,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e:
+        logger.error(f"Error in /admin/reload: {e}", exc_info=True)
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """metrics ของทุก worker รวมกัน (Prometheus text format)"""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route(f"/static/{DIST_NAME}/<path:filename>", methods=["GET"])
+def dist_asset(filename):
+    """ไฟล์ใน static/dist (เปลี่ยนไม่ได้ จึงส่งแบบ immutable)
+
+    ส่งไฟล์ .br/.gz ที่บีบอัดไว้ตอน build แทนถ้า browser รับได้ ไม่ต้องบีบอัดใน worker
+    """
+    dist_dir = os.path.join(app.static_folder, DIST_NAME)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    served, encoding = filename, None
+    for suffix, name in ((".br", "br"), (".gz", "gzip")):
+        path = safe_join(dist_dir, filename + suffix)
+        if request.accept_encodings[name] and path and os.path.isfile(path):
+            served, encoding = filename + suffix, name
+            break
+    response = send_from_directory(dist_dir, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = log_pipeline.set_request_id(request.headers.get("X-Request-ID"))
+
+
+@app.teardown_request
+def clear_request_id(exc=None):
+    log_pipeline.clear_request_id()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    # ใช้ rule ของ route (ไม่ใช่ path จริง) เพื่อไม่ให้ label แตกตาม key ของไฟล์เสียง
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    if started is not None and endpoint != "/metrics":
+        metrics.observe("aiva_http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc("aiva_http_requests_total", endpoint=endpoint, status=response.status_code)
+        logger.info(f"Response: {request.method} {endpoint} {response.status_code}",
+                    extra={"stage": "request", "duration_ms": (time.perf_counter() - started) * 1000})
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+
+@app.after_request
+def add_corpus_version(response):
+    # ให้ client/monitoring รู้ว่าคำตอบมาจาก knowledge base เวอร์ชันไหน
+    version = getattr(ai, "corpus_version", None)
+    if version:
+        response.headers["X-Corpus-Version"] = version
+    return response
+
+
 # ==============================================================================
 # Main
 # ==============================================================================
 if __name__ == "__main__":
+    # ไม่มี gunicorn on_starting: ลบ metrics snapshot ที่ค้างจากรอบก่อนเอง
+    metrics.REGISTRY.reset_dir()
+    if hasattr(ai, "start_watcher"):
+        ai.start_watcher()  # เริ่มแล้วตอนสร้าง engine ถ้าไม่ได้ตั้ง AIVA_PRELOAD (เรียกซ้ำได้)
     logger.info(f"Starting AIVA Server on port {PORT}")
     logger.info("Server is ready to accept connections")
     try:
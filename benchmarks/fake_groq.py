@@ -0,0 +1,132 @@
+"""
+AIVA - Fake Groq Server (สำหรับ benchmarks)
+server จำลอง /chat/completions แบบ OpenAI-compatible ที่รันใน process เดียวกัน ไม่ต้องต่ออินเทอร์เน็ต
+
+- latency: เวลาก่อนส่ง token แรก (วินาที) + token_delay ต่อ token เมื่อ stream
+- rate_429: สัดส่วนของ request ที่ตอบ 429 พร้อม retry-after
+- ใช้กับ GROQ_BASE_URL=http://127.0.0.1:<port>/v1
+
+รันแยกได้: python benchmarks/fake_groq.py --port 8900 --latency 0.3
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_TOKENS = ["วิทยาลัย", "เปิด", "รับ", "สมัคร", "นักเรียน", "ใหม่", "ช่วง", "เดือน", "มีนาคม", "ค่ะ"]
+
+
+class FakeGroqServer:
+    def __init__(self, latency: float = 0.2, token_delay: float = 0.01, rate_429: float = 0.0,
+                 retry_after: float = 1.0, port: int = 0, seed: int = 0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-groq").start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _should_rate_limit(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            limited = self._random.random() < self.rate_429
+            if limited:
+                self.rate_limited += 1
+            return limited
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = request.get("model", "")
+                if fake._should_rate_limit():
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded",
+                                                    "code": "rate_limit_exceeded"}},
+                                    {"retry-after": str(fake.retry_after)})
+                    return
+
+                time.sleep(fake.latency)
+                if request.get("stream"):
+                    self._stream(model)
+                else:
+                    time.sleep(fake.token_delay * len(ANSWER_TOKENS))
+                    self._send_json(200, {
+                        "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(ANSWER_TOKENS)}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(ANSWER_TOKENS), "total_tokens": 0},
+                    })
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i, token in enumerate(ANSWER_TOKENS + [None]):
+                    chunk = {
+                        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token} if token else {},
+                                     "finish_reason": None if token else "stop"}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if token:
+                        time.sleep(fake.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Groq/OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeGroqServer(args.latency, args.token_delay, args.rate_429, port=args.port)
+    print(f"Fake Groq listening on {server.base_url}")
+    server._server.serve_forever()
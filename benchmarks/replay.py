@@ -0,0 +1,344 @@
+"""
+AIVA - Traffic Replay
+สร้าง workload จาก log จริง (logs/gunicorn_access.log + logs/aiva.log) แล้วยิงซ้ำตามจังหวะเวลาเดิม
+ไปที่ server ที่รันอยู่ (--target) หรือ app ใน process นี้กับ Groq/gTTS จำลอง (--stub)
+
+- access log ให้เวลา, method, path, status และ duration (%(D)s) ของทุก request
+- aiva.log ให้ข้อความคำถาม ("Question received: ...") ซึ่งจับคู่กับ POST /ask, /ask_stream ตามเวลา
+- --speed 1 = เร็วเท่าเดิม, 10 = เร่ง 10 เท่า, 0 = ยิงต่อเนื่องเร็วที่สุด
+- รายงาน latency p50/p95/p99, error rate ต่อ endpoint และ cache hit ratio (จาก /metrics ก่อน/หลัง replay)
+
+    python benchmarks/replay.py --access-log logs/gunicorn_access.log --aiva-log logs/aiva.log --stub --speed 10
+    python benchmarks/replay.py --aiva-log logs/aiva.log --target http://localhost:5002 --output replay.json
+"""
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+import datetime
+import threading
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import AI_QUESTIONS, TTS_TEXT, percentile, summarize  # noqa: E402
+
+# offset: วินาทีนับจาก request แรก, original_ms: duration เดิมจาก access log (None ถ้าไม่ทราบ)
+Event = namedtuple("Event", "offset method path body original_ms original_status")
+
+_AIVA_LINE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - \w+ - \[[^\]]*\] - (.*)$')
+_REQUEST_RE = re.compile(r'^Request: (GET|POST) (\S+)')
+_QUESTION_PREFIX = "Question received: "
+# %(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s
+_ACCESS_RE = re.compile(r'^\S+ \S+ \S+ \[([^\]]+)\] "(\S+) (\S+)[^"]*" (\d{3}) \S+ "[^"]*" "[^"]*" (\d+)')
+
+# endpoint ที่มีข้อความคำถามใน body
+QUESTION_ENDPOINTS = ("/ask", "/ask_stream")
+# endpoint ที่ replay ไม่ได้/ไม่ควร replay
+SKIP_PATHS = ("/metrics", "/status", "/model_status", "/admin/reload", "/static/")
+
+# จับคู่คำถามกับ access log เมื่อเวลาห่างกันไม่เกินนี้ (วินาที)
+MATCH_TOLERANCE = 5.0
+
+
+def _log_files(path: str) -> list:
+    """ไฟล์ log พร้อมไฟล์ที่หมุนเวียนแล้ว (aiva.log.3, .2, .1, aiva.log) เรียงจากเก่าไปใหม่"""
+    rotated = sorted(glob.glob(f"{path}.[0-9]*"), key=lambda p: -int(p.rsplit(".", 1)[1]))
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def parse_aiva_log(path: str) -> list:
+    """คืน [(datetime, endpoint, question)] จาก aiva.log"""
+    questions = []
+    last_endpoint = "/ask"
+    for file_path in _log_files(path):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _AIVA_LINE_RE.match(line.rstrip("\n"))
+                if not match:
+                    continue
+                timestamp, message = match.groups()
+                request = _REQUEST_RE.match(message)
+                if request:
+                    last_endpoint = request.group(2)
+                elif message.startswith(_QUESTION_PREFIX):
+                    endpoint = last_endpoint if last_endpoint in QUESTION_ENDPOINTS else "/ask"
+                    questions.append((datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S"),
+                                      endpoint, message[len(_QUESTION_PREFIX):]))
+    questions.sort(key=lambda q: q[0])
+    return questions
+
+
+def parse_access_log(path: str) -> list:
+    """คืน [(เวลาเริ่ม request, method, path, status, duration วินาที)] จาก gunicorn access log"""
+    requests_ = []
+    for file_path in _log_files(path):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _ACCESS_RE.match(line)
+                if not match:
+                    continue
+                timestamp, method, target, status, micros = match.groups()
+                # %(t)s เป็นเวลาตอนตอบเสร็จ (ตามเวลาท้องถิ่นเดียวกับ aiva.log) ลบ duration ออกให้เป็นเวลาเริ่ม
+                finished = datetime.datetime.strptime(timestamp.split()[0], "%d/%b/%Y:%H:%M:%S")
+                duration = int(micros) / 1_000_000
+                requests_.append((finished - datetime.timedelta(seconds=duration), method, target,
+                                  int(status), duration))
+    requests_.sort(key=lambda r: r[0])
+    return requests_
+
+
+def _body_for(path: str, question: str = None):
+    if path in QUESTION_ENDPOINTS:
+        return {"question": question or AI_QUESTIONS[0]}
+    if path in ("/tts_audio", "/tts_plan"):
+        return {"text": TTS_TEXT}
+    if path == "/submit_feedback":
+        return {"rating": 5, "feedback_text": ""}
+    return None
+
+
+def build_workload(access_log: str = None, aiva_log: str = None) -> list:
+    """รวม log ทั้งสองเป็น workload เรียงตามเวลา (list ของ Event)"""
+    questions = parse_aiva_log(aiva_log) if aiva_log else []
+    accesses = parse_access_log(access_log) if access_log else []
+
+    timed = []  # (datetime, method, path, body, original_ms, status)
+    if accesses:
+        pending = defaultdict(list)
+        for q in questions:
+            pending[q[1]].append(q)
+        fallback = 0
+        for started, method, target, status, duration in accesses:
+            path = urlsplit(target).path
+            if any(path.startswith(p) for p in SKIP_PATHS):
+                continue
+            question = None
+            if method == "POST" and path in QUESTION_ENDPOINTS:
+                queue = pending[path]
+                # ข้ามคำถามที่เก่ากว่า access นี้เกิน tolerance (request ที่ไม่มีใน access log)
+                while queue and (started - queue[0][0]).total_seconds() > MATCH_TOLERANCE:
+                    queue.pop(0)
+                if queue and abs((queue[0][0] - started).total_seconds()) <= MATCH_TOLERANCE:
+                    question = queue.pop(0)[2]
+                else:
+                    question = AI_QUESTIONS[fallback % len(AI_QUESTIONS)]
+                    fallback += 1
+            body = _body_for(path, question) if method == "POST" else None
+            timed.append((started, method, target, body, round(duration * 1000, 3), status))
+    else:
+        for timestamp, endpoint, question in questions:
+            timed.append((timestamp, "POST", endpoint, {"question": question}, None, None))
+
+    if not timed:
+        return []
+    first = timed[0][0]
+    return [Event((t - first).total_seconds(), method, path, body, original_ms, status)
+            for t, method, path, body, original_ms, status in timed]
+
+
+def route_of(path: str) -> str:
+    """รวม path ที่มี key เป็น route เดียว (เช่น /tts_audio/<key>.mp3)"""
+    path = urlsplit(path).path
+    if path.startswith("/tts_audio/") and path.endswith(".mp3"):
+        return "/tts_audio/<key>.mp3"
+    return path
+
+
+class HttpTarget:
+    """ยิง request ไปที่ server ที่รันอยู่"""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session ไม่ thread-safe ใช้แยกต่อ thread (ยังได้ keep-alive)
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, event: Event) -> int:
+        response = self.session.request(event.method, self.base_url + event.path, json=event.body,
+                                        timeout=self.timeout)
+        _ = response.content
+        return response.status_code
+
+    def metrics_text(self) -> str:
+        try:
+            return self.session.get(self.base_url + "/metrics", timeout=self.timeout).text
+        except Exception:
+            return ""
+
+
+class StubTarget:
+    """app ใน process นี้กับ Groq/gTTS จำลอง (ตัวเลือกเหมือน run_benchmarks)"""
+
+    def __init__(self, args):
+        import tempfile
+        from fake_groq import FakeGroqServer
+        from run_benchmarks import load_app
+        self.fake = FakeGroqServer(latency=args.llm_latency, rate_429=args.rate_429).start()
+        stub_args = argparse.Namespace(answer_cache=not args.no_answer_cache, tts_delay=args.tts_delay)
+        self.app = load_app(stub_args, self.fake.base_url, tempfile.mkdtemp(prefix="aiva-replay-"))
+
+    def send(self, event: Event) -> int:
+        client = self.app.app.test_client()
+        response = client.open(event.path, method=event.method, json=event.body)
+        response.get_data()
+        return response.status_code
+
+    def metrics_text(self) -> str:
+        return self.app.app.test_client().get("/metrics").get_data(as_text=True)
+
+
+_METRIC_LINE_RE = re.compile(r'^(\w+)\{([^}]*)\} (\S+)$')
+
+
+def parse_counters(text: str, name: str, label: str) -> dict:
+    """ค่า counter ตาม label เดียว เช่น aiva_answers_total by source"""
+    values = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE_RE.match(line)
+        if not match or match.group(1) != name:
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+        if label in labels:
+            values[labels[label]] = values.get(labels[label], 0) + float(match.group(3))
+    return values
+
+
+def _diff(after: dict, before: dict) -> dict:
+    return {k: after.get(k, 0) - before.get(k, 0) for k in after if after.get(k, 0) - before.get(k, 0)}
+
+
+def cache_ratios(before: str, after: str) -> dict:
+    answers = _diff(parse_counters(after, "aiva_answers_total", "source"),
+                    parse_counters(before, "aiva_answers_total", "source"))
+    tts = _diff(parse_counters(after, "aiva_tts_cache_total", "result"),
+                parse_counters(before, "aiva_tts_cache_total", "result"))
+    total_answers = sum(answers.values())
+    total_tts = sum(tts.values())
+    return {
+        "answers_by_source": answers,
+        "answer_without_ai_ratio": round(sum(answers.get(s, 0) for s in ("faq", "cache", "coalesced"))
+                                         / total_answers, 3) if total_answers else None,
+        "tts_cache_hit_ratio": round(tts.get("hit", 0) / total_tts, 3) if total_tts else None,
+    }
+
+
+def replay(workload: list, target, speed: float = 1.0, concurrency: int = 64) -> list:
+    """ยิง workload ตามเวลาเดิม (หาร speed) คืน [(event, latency วินาที, status หรือ None ถ้า error)]"""
+    results = []
+    lock = threading.Lock()
+
+    def send(event):
+        started = time.perf_counter()
+        try:
+            status = target.send(event)
+        except Exception:
+            status = None
+        with lock:
+            results.append((event, time.perf_counter() - started, status))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, event in enumerate(workload):
+            if speed > 0:
+                delay = started + event.offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, event)
+            if (i + 1) % 100 == 0:
+                print(f"  sent {i + 1}/{len(workload)} requests")
+    return results
+
+
+def report(results: list, elapsed: float) -> dict:
+    by_route = defaultdict(list)
+    for event, latency, status in results:
+        by_route[route_of(event.path)].append((event, latency, status))
+
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        summary = summarize([latency for _, latency, _ in rows], elapsed,
+                            errors=sum(1 for _, _, status in rows if status is None or status >= 500))
+        summary["error_rate"] = round(summary["errors"] / len(rows), 4)
+        original = [e.original_ms for e, _, _ in rows if e.original_ms is not None]
+        if original:
+            summary["original_p50_ms"] = percentile(original, 50)
+            summary["original_p95_ms"] = percentile(original, 95)
+        routes[route] = summary
+    return routes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay AIVA traffic from logs")
+    parser.add_argument("--access-log", help="logs/gunicorn_access.log")
+    parser.add_argument("--aiva-log", help="logs/aiva.log (ข้อความคำถาม)")
+    parser.add_argument("--target", help="URL ของ server ที่รันอยู่ เช่น http://localhost:5002")
+    parser.add_argument("--stub", action="store_true", help="replay กับ app ใน process นี้และ Groq จำลอง")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = เวลาจริง, 10 = เร่ง 10 เท่า, 0 = เร็วที่สุด")
+    parser.add_argument("--concurrency", type=int, default=64, help="จำนวน request ค้างพร้อมกันสูงสุด")
+    parser.add_argument("--limit", type=int, help="replay เฉพาะ N request แรก")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--tts-delay", type=float, default=0.3)
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--output", help="บันทึกรายงานเป็น JSON")
+    args = parser.parse_args(argv)
+
+    if not (args.access_log or args.aiva_log):
+        parser.error("ต้องระบุ --access-log หรือ --aiva-log อย่างน้อยหนึ่งไฟล์")
+    if bool(args.target) == args.stub:
+        parser.error("เลือก --target หรือ --stub อย่างใดอย่างหนึ่ง")
+
+    workload = build_workload(args.access_log, args.aiva_log)
+    if args.limit:
+        workload = workload[:args.limit]
+    if not workload:
+        print("No requests found in logs")
+        return 1
+    span = workload[-1].offset
+    print(f"Workload: {len(workload)} requests over {span:.0f}s "
+          f"(replaying in ~{span / args.speed if args.speed > 0 else 0:.0f}s)")
+
+    target = HttpTarget(args.target) if args.target else StubTarget(args)
+    before = target.metrics_text()
+    started = time.perf_counter()
+    results = replay(workload, target, args.speed, args.concurrency)
+    elapsed = time.perf_counter() - started
+    after = target.metrics_text()
+
+    routes = report(results, elapsed)
+    caches = cache_ratios(before, after)
+    print(f"\n{'route':<24} {'req':>6} {'err%':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'orig p95':>10}")
+    for route, r in routes.items():
+        print(f"{route:<24} {r['requests']:>6} {r['error_rate'] * 100:>6.1f}% {r['p50_ms']:>10} {r['p95_ms']:>10} "
+              f"{r['p99_ms']:>10} {r.get('original_p95_ms', '-'):>10}")
+    print(f"\nAnswers by source: {caches['answers_by_source']}")
+    print(f"Answered without AI: {caches['answer_without_ai_ratio']}, TTS cache hit ratio: {caches['tts_cache_hit_ratio']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {"requests": len(workload), "span_s": span, "speed": args.speed,
+                         "elapsed_s": round(elapsed, 3), "target": args.target or "stub"},
+                "routes": routes,
+                "caches": caches,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Saved report to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+AIVA - Benchmarks
+วัด throughput และ latency (p50/p95/p99) ของ /ask, /greeting, /tts_audio ภายใต้ concurrency
+โดยใช้ Groq จำลอง (fake_groq.py) และ gTTS จำลอง จึงรันได้โดยไม่ต้องต่ออินเทอร์เน็ต
+และ microbenchmarks ของ FAQ matching / retrieval ที่ขนาด corpus 1x, 10x, 100x
+
+ผลลัพธ์บันทึกเป็น JSON (--output) และเทียบกับผลครั้งก่อนได้ (--baseline) เพื่อดู regression
+
+    python benchmarks/run_benchmarks.py --requests 200 --concurrency 16 --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --fail-on-regression
+"""
+import os
+import sys
+import json
+import glob
+import time
+import types
+import random
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_groq import FakeGroqServer  # noqa: E402
+
+# คำถามที่ไม่ตรง FAQ (ต้องผ่าน retrieval + LLM)
+AI_QUESTIONS = [
+    "สาขาการตลาดเรียนเกี่ยวกับอะไรบ้าง",
+    "จบแล้วทำงานอะไรได้บ้าง",
+    "มีทุนการศึกษาให้นักเรียนไหม",
+    "หลักสูตรระบบทวิภาคีคืออะไร",
+    "ต้องใช้เอกสารอะไรในการสมัครเรียน",
+    "วิทยาลัยมีกิจกรรมชมรมอะไรบ้าง",
+    "การบัญชีเรียนกี่ปี",
+    "เรียนต่อปริญญาตรีได้ไหม",
+]
+
+TTS_TEXT = "สวัสดีค่ะ ดิฉันไอว่า ผู้ช่วยอัจฉริยะของวิทยาลัยพณิชยการธนบุรี"
+
+# ถือว่า regression เมื่อช้าลง/throughput ลดลงเกินสัดส่วนนี้
+REGRESSION_THRESHOLD = 0.10
+
+# metric ที่ค่ามากกว่าดีกว่า (นอกนั้นค่าน้อยกว่าดีกว่า)
+HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def percentile(values: list, pct: float) -> float:
+    """percentile แบบ nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: list, elapsed: float, errors: int = 0) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def install_fake_gtts(delay: float):
+    """แทน gTTS ด้วยตัวจำลองที่รอ delay วินาทีแล้วเขียน mp3 ปลอม (ต้องเรียกก่อน import app)"""
+    class FakeGTTS:
+        def __init__(self, text, lang="th", slow=False):
+            self.text = text
+
+        def write_to_fp(self, fp):
+            time.sleep(delay)
+            fp.write(b"ID3" + self.text.encode("utf-8") * 20)
+
+        def save(self, path):
+            with open(path, "wb") as f:
+                self.write_to_fp(f)
+
+    module = types.ModuleType("gtts")
+    module.gTTS = FakeGTTS
+    sys.modules["gtts"] = module
+
+
+def load_app(args, base_url: str, cache_dir: str):
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ["GROQ_API_KEY"] = "bench"
+    os.environ["AIVA_CACHE_DIR"] = cache_dir
+    os.environ["AIVA_ANSWER_CACHE"] = "1" if args.answer_cache else "0"
+    install_fake_gtts(args.tts_delay)
+
+    os.chdir(ROOT)
+    import app
+    import log_pipeline
+    # log ลงไฟล์ตามปกติ แต่ไม่ต้องพิมพ์ทุกบรรทัดออก console ระหว่างวัด
+    log_pipeline.setup_logging(console=False)
+    return app
+
+
+def drive(app, make_request, total: int, concurrency: int) -> dict:
+    """ยิง request จำนวน total ด้วย concurrency thread (test client แยกต่อ request)"""
+    def one(i):
+        client = app.app.test_client()
+        started = time.perf_counter()
+        response = make_request(client, i)
+        response.get_data()
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    return summarize([r[0] for r in results], elapsed, errors=sum(1 for r in results if r[1] != 200))
+
+
+def run_endpoints(args) -> dict:
+    fake = FakeGroqServer(latency=args.llm_latency, token_delay=args.token_delay,
+                          rate_429=args.rate_429, retry_after=args.retry_after).start()
+    cache_dir = tempfile.mkdtemp(prefix="aiva-bench-")
+    app = load_app(args, fake.base_url, cache_dir)
+    results = {}
+    try:
+        results["greeting"] = drive(app, lambda c, i: c.get("/greeting"), args.requests, args.concurrency)
+        results["ask"] = drive(
+            app,
+            lambda c, i: c.post("/ask", json={"question": f"{AI_QUESTIONS[i % len(AI_QUESTIONS)]} ({i})"}),
+            args.requests, args.concurrency)
+        # ข้อความไม่ซ้ำ (สังเคราะห์ใหม่ทุกครั้ง) และข้อความซ้ำ (อ่านจาก cache)
+        results["tts_audio_miss"] = drive(
+            app, lambda c, i: c.post("/tts_audio", json={"text": f"{TTS_TEXT} {i}"}), args.requests, args.concurrency)
+        results["tts_audio_hit"] = drive(
+            app, lambda c, i: c.post("/tts_audio", json={"text": TTS_TEXT}), args.requests, args.concurrency)
+        results["ask"]["llm_requests"] = fake.requests
+        results["ask"]["llm_rate_limited"] = fake.rate_limited
+    finally:
+        fake.stop()
+    return results
+
+
+def _timed(fn, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_micro(args) -> dict:
+    from faq_matcher import FaqMatcher
+    from retrieval import RetrievalIndex
+    from chunker import wrap_source
+
+    with open(os.path.join(ROOT, "faq.json"), "r", encoding="utf-8") as f:
+        faq_data = json.load(f)
+    texts = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, "data_files", "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            texts[os.path.basename(path)] = f.read()
+
+    rng = random.Random(0)
+    faq_questions = [kw for faq in faq_data for kw in faq.get("keywords", [])][:50] + AI_QUESTIONS
+    results = {}
+    for scale in args.scales:
+        # FAQ ขนาด scale เท่า (keyword ไม่ซ้ำกันเพื่อให้ automaton โตจริง)
+        scaled_faq = faq_data + [
+            {**faq, "keywords": [f"{kw}{copy}" for kw in faq.get("keywords", [])]}
+            for copy in range(1, scale) for faq in faq_data
+        ]
+        started = time.perf_counter()
+        matcher = FaqMatcher(scaled_faq)
+        build = time.perf_counter() - started
+        questions = [rng.choice(faq_questions) for _ in range(args.micro_repeat)]
+        latencies = []
+        for question in questions:
+            started = time.perf_counter()
+            matcher.match(question)
+            latencies.append(time.perf_counter() - started)
+        results[f"faq_match_{scale}x"] = dict(summarize(latencies, sum(latencies)),
+                                              build_ms=round(build * 1000, 3), entries=len(scaled_faq))
+
+        corpus = "".join(wrap_source(f"copy{copy}_{name}", text)
+                         for copy in range(scale) for name, text in texts.items())
+        started = time.perf_counter()
+        index = RetrievalIndex.build(corpus)
+        build = time.perf_counter() - started
+        latencies = []
+        for question in questions:
+            started = time.perf_counter()
+            index.search(question, top_k=12)
+            latencies.append(time.perf_counter() - started)
+        results[f"retrieval_search_{scale}x"] = dict(summarize(latencies, sum(latencies)),
+                                                     build_ms=round(build * 1000, 3), chunks=len(index),
+                                                     chars=index.n_chars)
+        batch = _timed(lambda: index.search_many(AI_QUESTIONS, top_k=12), max(1, args.micro_repeat // 50))
+        results[f"retrieval_search_many_{scale}x"] = dict(summarize(batch, sum(batch)),
+                                                          questions=len(AI_QUESTIONS))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """เทียบกับผลครั้งก่อน คืน list ของ (benchmark, metric, เดิม, ใหม่, สัดส่วนที่เปลี่ยน, regression?)"""
+    rows = []
+    for name, metrics in results.items():
+        old_metrics = baseline.get("results", {}).get(name)
+        if not old_metrics:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = old_metrics.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((name, metric, old, new, change, worse > threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AIVA offline benchmarks")
+    parser.add_argument("--requests", type=int, default=100, help="จำนวน request ต่อ endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="เวลาก่อน token แรกของ Groq จำลอง (วินาที)")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="สัดส่วน request ที่ Groq จำลองตอบ 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tts-delay", type=float, default=0.1, help="เวลาสังเคราะห์เสียงของ gTTS จำลอง")
+    parser.add_argument("--answer-cache", action="store_true", help="เปิด answer cache ระหว่างวัด /ask")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--micro-repeat", type=int, default=500)
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="บันทึกผลเป็น JSON")
+    parser.add_argument("--baseline", help="ไฟล์ JSON ผลครั้งก่อนสำหรับเทียบ")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = {}
+    if not args.skip_micro:
+        results.update(run_micro(args))
+    if not args.skip_endpoints:
+        results.update(run_endpoints(args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+
+    print(f"{'benchmark':<32} {'req':>6} {'rps':>9} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<32} {r['requests']:>6} {r['throughput_rps']:>9} {r['p50_ms']:>10} "
+              f"{r['p95_ms']:>10} {r['p99_ms']:>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.output}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} (commit {baseline.get('meta', {}).get('commit')})")
+        for name, metric, old, new, change, regressed in compare(results, baseline):
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<32} {metric:<15} {old:>10} -> {new:<10} {change:+.1%}{flag}")
+            if regressed:
+                regressions.append((name, metric))
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+AIVA - Static Asset Build
+สร้างไฟล์ใน static/dist/ ที่ชื่อมี content hash (เช่น pu.3f9a0c21b7.png) พร้อม manifest.json
+app ใช้ asset_url('pu.png') ใน template เพื่อได้ URL ของไฟล์ใน dist และส่งด้วย Cache-Control immutable
+browser ของ kiosk จึงไม่ต้อง revalidate รูปที่ไม่เปลี่ยนกับ gunicorn workers ทุกครั้งที่ reload หน้า
+
+- รูปที่ใหญ่เกินที่หน้าจอแสดงถูกย่อตาม MAX_WIDTH (ต้องมี Pillow ถ้าไม่มีจะใช้ไฟล์เดิม)
+- ไฟล์ text (css/js/svg/json) มี .gz และ .br (ถ้าติดตั้ง brotli) ไว้ส่งแทนโดยไม่ต้องบีบอัดตอน request
+- เก็บไฟล์ของ build ก่อนหน้าไว้หนึ่งรุ่น หน้าเว็บที่ยังไม่ reload จึงยังโหลดรูปเดิมได้
+- hash รวมค่าที่ใช้ build (MAX_WIDTH/quality/การบีบอัด) ด้วย เปลี่ยนค่าแล้ว build ใหม่ได้ไฟล์ใหม่แม้ต้นฉบับเดิม
+
+การใช้งาน (ตอน deploy ก่อนเริ่ม gunicorn):
+    python build_assets.py [static_dir]
+"""
+import io
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = "static"
+DIST_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# ความกว้างสูงสุด (px) ตามขนาดที่ aiva_portal.html แสดงจริง (เผื่อจอ high-DPI)
+DEFAULT_MAX_WIDTH = 1920
+MAX_WIDTH = {
+    "BG.jpg": 1440,       # background แบบ cover บนจอ kiosk แนวตั้ง
+    "logo01.png": 1000,   # max-width 500px
+    "pu.png": 256,        # ปุ่มไมค์ 80px
+}
+JPEG_QUALITY = 85
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+IMAGE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+COMPRESSIBLE = {".css", ".js", ".mjs", ".svg", ".json", ".txt", ".html", ".webmanifest", ".map"}
+HASH_LENGTH = 10
+
+
+def _build_params(path: str) -> str:
+    """ค่าที่มีผลต่อไฟล์ใน dist ของ path นี้ (รวมใน content hash)"""
+    ext = os.path.splitext(path)[1].lower()
+    params = []
+    if Image is not None and ext in IMAGE_FORMATS:
+        params.append(f"width={MAX_WIDTH.get(os.path.basename(path), DEFAULT_MAX_WIDTH)}")
+        params.append(f"quality={JPEG_QUALITY}")
+    if ext in COMPRESSIBLE:
+        params.append(f"gzip={GZIP_LEVEL}")
+        if brotli is not None:
+            params.append(f"brotli={BROTLI_QUALITY}")
+    return ";".join(params)
+
+
+def _optimize_image(path: str, data: bytes) -> bytes:
+    """ย่อรูปที่กว้างเกิน MAX_WIDTH แล้ว encode ใหม่ คืนไฟล์เดิมถ้าไม่เล็กลง"""
+    image_format = IMAGE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if Image is None or image_format is None:
+        return data
+    max_width = MAX_WIDTH.get(os.path.basename(path), DEFAULT_MAX_WIDTH)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        if image_format == "JPEG":
+            image.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            image.save(out, image_format, optimize=True)
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+
+def _compressed_variants(data: bytes) -> dict:
+    """{".gz": bytes, ".br": bytes} เฉพาะตัวที่เล็กกว่าไฟล์เดิม"""
+    variants = {".gz": gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def _write(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(static_dir: str = STATIC_DIR) -> dict:
+    """{"pu.png": "dist/pu.<hash>.png", ...} หรือ {} ถ้ายังไม่ได้ build"""
+    try:
+        with open(os.path.join(static_dir, DIST_NAME, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(static_dir: str = STATIC_DIR) -> dict:
+    """สร้าง static/dist และ manifest คืน manifest ใหม่"""
+    dist_dir = os.path.join(static_dir, DIST_NAME)
+    os.makedirs(dist_dir, exist_ok=True)
+    previous = load_manifest(static_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_NAME]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                original = f.read()
+            data = _optimize_image(source, original)
+
+            stem, ext = os.path.splitext(rel)
+            # ชื่อไฟล์เดิม = เนื้อหาและค่าที่ใช้ build เดิม จึงข้ามไฟล์ที่มีอยู่แล้วได้
+            digest = hashlib.sha256(_build_params(source).encode("utf-8") + b"\0" + data).hexdigest()[:HASH_LENGTH]
+            hashed = f"{stem}.{digest}{ext}"
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                _write(target, data)
+                if ext.lower() in COMPRESSIBLE:
+                    for suffix, body in _compressed_variants(data).items():
+                        _write(target + suffix, body)
+            manifest[rel] = f"{DIST_NAME}/{hashed}"
+            logger.info(f"{rel} -> {DIST_NAME}/{hashed} ({len(original)} -> {len(data)} bytes)")
+
+    # ลบไฟล์ที่ไม่อยู่ทั้งใน build นี้และ build ก่อนหน้า
+    keep = {path[len(DIST_NAME) + 1:] for path in list(manifest.values()) + list(previous.values())}
+    for root, _, files in os.walk(dist_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, "/")
+            base = rel[:-3] if rel.endswith((".gz", ".br")) else rel
+            if rel != MANIFEST_NAME and base not in keep:
+                os.remove(os.path.join(root, name))
+
+    _write(os.path.join(dist_dir, MANIFEST_NAME),
+           json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    if Image is None:
+        logger.warning("Pillow not installed - images are fingerprinted without resizing")
+    if brotli is None:
+        logger.warning("brotli not installed - only gzip variants are generated")
+    folder = sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR
+    print(f"Static assets built: {len(build(folder))} files in {os.path.join(folder, DIST_NAME)}")
@@ -0,0 +1,129 @@
+"""
+AIVA - Structure-aware Chunker
+แบ่ง knowledge base เป็น chunk ตามโครงสร้างของเอกสาร แทนการตัดทุก 1000 ตัวอักษร
+
+- ไม่ข้ามไฟล์: ใช้ marker "--- เริ่มต้นข้อมูลจากไฟล์: X ---" / "--- สิ้นสุดข้อมูลจากไฟล์: X ---"
+- ไม่ข้ามหน้า PDF: หน้าคั่นด้วย form feed (\\f)
+- รวมย่อหน้า (คั่นด้วยบรรทัดว่าง) ให้ได้ chunk ใกล้ max_chars โดยตัดที่ขอบบรรทัด
+- ถ้าจำเป็นต้องตัดกลางย่อหน้า chunk ถัดไปจะเริ่มซ้อนบรรทัดท้ายของ chunk ก่อน (overlap)
+"""
+import os
+import re
+from collections import namedtuple
+
+CHUNK_CHARS = int(os.environ.get("AIVA_CHUNK_CHARS", "1000"))
+CHUNK_OVERLAP = int(os.environ.get("AIVA_CHUNK_OVERLAP", "150"))
+
+_MARKER_RE = re.compile(r'^--- (เริ่มต้น|สิ้นสุด)ข้อมูลจากไฟล์: (.+?) ---[ \t]*\r?$', re.M)
+_WORD_RE = re.compile(r'\w')
+PAGE_BREAK = "\f"
+
+# char range [start, end) ใน text, ชื่อไฟล์ต้นทาง ("" ถ้าไม่ทราบ), หน้า (เริ่มที่ 1, 0 = ไม่ใช่ PDF)
+Chunk = namedtuple("Chunk", "start end source page")
+
+
+def source_marker(name: str) -> str:
+    return f"--- เริ่มต้นข้อมูลจากไฟล์: {name} ---"
+
+
+def end_marker(name: str) -> str:
+    return f"--- สิ้นสุดข้อมูลจากไฟล์: {name} ---"
+
+
+def wrap_source(name: str, text: str) -> str:
+    """ครอบข้อความของไฟล์ด้วย marker (ถ้าไฟล์มี marker อยู่แล้ว เช่น combined_knowledge.txt ใช้ตามเดิม)"""
+    if _MARKER_RE.search(text):
+        return text if text.endswith("\n") else text + "\n"
+    return f"{source_marker(name)}\n{text.rstrip()}\n{end_marker(name)}\n"
+
+
+def _sections(text: str):
+    """แบ่ง text ตาม marker ของไฟล์ คืน (start, end, source) โดยไม่รวมบรรทัด marker"""
+    pos = 0
+    source = ""
+    for m in _MARKER_RE.finditer(text):
+        yield pos, m.start(), source
+        source = m.group(2) if m.group(1) == "เริ่มต้น" else ""
+        pos = m.end()
+    yield pos, len(text), source
+
+
+def _pieces(text: str, start: int, end: int, max_chars: int):
+    """บรรทัดที่ไม่ว่างใน text[start:end] เป็น [start, end, is_paragraph_start]
+
+    บรรทัดที่ยาวเกิน max_chars จะถูกตัดที่ช่องว่างสุดท้าย (หรือตัดตามความยาวถ้าไม่มีช่องว่าง)
+    """
+    pieces = []
+    new_paragraph = True
+    pos = start
+    while pos < end:
+        nl = text.find("\n", pos, end)
+        line_end = end if nl < 0 else nl + 1
+        if not _WORD_RE.search(text, pos, line_end):
+            # บรรทัดว่างหรือเส้นคั่น (=====) ถือเป็นขอบย่อหน้า
+            new_paragraph = True
+            pos = line_end
+            continue
+        s = pos
+        while line_end - s > max_chars:
+            cut = text.rfind(" ", s + max_chars // 2, s + max_chars)
+            cut = cut + 1 if cut > 0 else s + max_chars
+            pieces.append((s, cut, new_paragraph))
+            new_paragraph = False
+            s = cut
+        if text[s:line_end].strip():
+            pieces.append((s, line_end, new_paragraph))
+        else:
+            # เหลือแค่ช่องว่าง/ขึ้นบรรทัดหลังตัดบรรทัดยาว รวมเข้ากับส่วนก่อนหน้า
+            pieces[-1] = (pieces[-1][0], line_end, pieces[-1][2])
+        new_paragraph = False
+        pos = line_end
+    return pieces
+
+
+def _pack(pieces: list, max_chars: int, overlap: int):
+    """รวมบรรทัดเป็น chunk ยาวไม่เกิน max_chars คืน list ของ (start, end)"""
+    spans = []
+    i = 0
+    while i < len(pieces):
+        start = pieces[i][0]
+        j = i
+        paragraph_cut = None
+        while j < len(pieces) and (j == i or pieces[j][1] - start <= max_chars):
+            if j > i and pieces[j][2]:
+                paragraph_cut = j
+            j += 1
+        # ตัดที่ขอบย่อหน้าล่าสุดได้ถ้า chunk ยังยาวอย่างน้อยครึ่งหนึ่ง
+        if j < len(pieces) and not pieces[j][2] and paragraph_cut is not None \
+                and pieces[paragraph_cut][0] - start >= max_chars // 2:
+            j = paragraph_cut
+        spans.append((start, pieces[j - 1][1]))
+        if j >= len(pieces):
+            break
+
+        next_i = j
+        if overlap > 0 and not pieces[j][2]:
+            # ตัดกลางย่อหน้า: เริ่ม chunk ถัดไปจากบรรทัดท้ายๆ ของ chunk นี้
+            while next_i - 1 > i and pieces[j - 1][1] - pieces[next_i - 1][0] <= overlap:
+                next_i -= 1
+        i = next_i
+    return spans
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list:
+    """แบ่ง text เป็น list ของ Chunk เรียงตามตำแหน่ง"""
+    chunks = []
+    for sec_start, sec_end, source in _sections(text):
+        is_pdf = source.lower().endswith(".pdf") or PAGE_BREAK in text[sec_start:sec_end]
+        page_start = sec_start
+        page = 1
+        while page_start <= sec_end:
+            brk = text.find(PAGE_BREAK, page_start, sec_end)
+            page_end = sec_end if brk < 0 else brk
+            for start, end in _pack(_pieces(text, page_start, page_end, max_chars), max_chars, overlap):
+                chunks.append(Chunk(start, end, source, page if is_pdf else 0))
+            if brk < 0:
+                break
+            page_start = brk + 1
+            page += 1
+    return chunks
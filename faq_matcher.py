@@ -0,0 +1,80 @@
+"""
+AIVA - FAQ Matcher
+จับคู่คำถามกับ keyword ของ FAQ ทั้งหมดในการอ่านข้อความรอบเดียว (Aho-Corasick automaton)
+
+- สร้าง automaton ครั้งเดียวจาก faq.json เวลาค้นหาไม่ขึ้นกับจำนวน FAQ
+- ถ้าเจอหลาย keyword: keyword ที่ยาวกว่า (เฉพาะเจาะจงกว่า) ชนะ
+  คูณด้วย "weight" ของ FAQ entry ได้ (ค่าเริ่มต้น 1.0) ถ้าเท่ากันใช้ entry ที่อยู่ก่อนใน faq.json
+"""
+from collections import deque
+
+
+class FaqMatcher:
+    def __init__(self, faq_data: list):
+        self.faq_data = faq_data or []
+        self._goto = [{}]       # node -> {char: node}
+        self._fail = [0]
+        self._best = [None]     # node -> (rank, entry_index, keyword) ที่ดีที่สุดที่จบที่ node นี้ (รวม fail chain)
+
+        for entry_index, faq in enumerate(self.faq_data):
+            weight = float(faq.get("weight", 1.0))
+            for keyword in faq.get("keywords", []):
+                pattern = keyword.lower()
+                if pattern:
+                    self._add(pattern, ((len(pattern) * weight, -entry_index), entry_index, keyword))
+        self._build_fail_links()
+
+    def _add(self, pattern: str, candidate):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = nxt
+        self._best[node] = self._better(self._best[node], candidate)
+
+    @staticmethod
+    def _better(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return a if a[0] >= b[0] else b
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # keyword ที่เป็น suffix ของ path นี้ก็ถือว่าเจอด้วย
+                self._best[child] = self._better(self._best[child], self._best[self._fail[child]])
+
+    def match(self, question: str):
+        """คืน (faq_entry, keyword) ที่ดีที่สุด หรือ None"""
+        node = 0
+        best = None
+        goto, fail = self._goto, self._fail
+        for ch in question.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if self._best[node] is not None:
+                best = self._better(best, self._best[node])
+        if best is None:
+            return None
+        return self.faq_data[best[1]], best[2]
+
+    def answer(self, question: str):
+        """คืนคำตอบของ FAQ ที่ตรงที่สุด หรือ None"""
+        found = self.match(question)
+        return found[0].get("answer", "") if found else None
@@ -0,0 +1,280 @@
+"""
+AIVA - Background Feedback Writer
+บันทึกคะแนน/ความเห็นจาก /submit_feedback ลง Firestore เบื้องหลัง แทนการรอ Firestore ใน request
+
+- submit() เขียนลง spool file (JSONL, fsync) แล้วใส่คิวในหน่วยความจำ คืนทันที
+- thread เบื้องหลังเขียนเป็น batch (WriteBatch) เมื่อครบ batch_size หรือครบ flush_interval วินาที
+- ถ้า Firestore ล้มเหลว/ออฟไลน์ เก็บไว้ในคิวและ spool แล้วลองใหม่แบบ backoff
+- spool ของ process ที่ตายไปแล้ว (crash) ถูกรับไปเขียนต่อตอนเริ่มทำงาน
+- แต่ละรายการมี id คงที่ (document id) เขียนซ้ำหลัง crash จึงไม่เกิดข้อมูลซ้ำ
+- close() เขียนที่ค้างอยู่ให้หมดตอน shutdown (ที่ยังเขียนไม่ได้ยังอยู่ใน spool)
+"""
+import os
+import json
+import glob
+import time
+import uuid
+import logging
+import datetime
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("AIVA_CACHE_DIR", ".cache")
+
+# WriteBatch ของ Firestore รับได้ไม่เกิน 500 operations
+MAX_BATCH = 500
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decode(obj: dict):
+    if set(obj) == {"__datetime__"}:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class FeedbackWriter:
+    def __init__(self, db, collection: str = "ratings", spool_dir: str = None,
+                 batch_size: int = 20, flush_interval: float = 2.0, max_retry_delay: float = 60.0):
+        self.db = db
+        self.collection = collection
+        self.spool_dir = spool_dir or os.path.join(CACHE_DIR, "feedback_spool")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.written = 0
+        self.failures = 0
+        self._pending = []       # [(id, data)] ตามลำดับที่รับเข้ามา
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+        self._pid = None
+
+    def _spool_path(self, pid: int = None) -> str:
+        return os.path.join(self.spool_dir, f"feedback-{pid or os.getpid()}.jsonl")
+
+    def start(self):
+        """เริ่ม thread เบื้องหลัง (ครั้งเดียวต่อ process เรียกซ้ำหลัง fork ได้)"""
+        with self._cond:
+            if self._pid == os.getpid():
+                return self
+            # หลัง fork: รายการที่ค้างเป็นของ process แม่ ไม่ใช่ของ worker นี้
+            self._pid = os.getpid()
+            self._pending = []
+            self._stop = False
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._recover_spools()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="feedback-writer")
+        self._thread.start()
+        return self
+
+    def _recover_spools(self):
+        """รับ spool ของ process ที่ไม่มีอยู่แล้วมาเขียนต่อ (รวมไฟล์ที่ process อื่นรับไปแล้ว crash ระหว่างรับ)"""
+        claimed_paths = []
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "feedback-*.jsonl*"))):
+            name = os.path.basename(path)
+            if ".claimed-" in name:
+                owner = name.rsplit("-", 1)[1]
+            elif name.endswith(".jsonl"):
+                owner = name[len("feedback-"):-len(".jsonl")]
+            else:
+                continue
+            if not owner.isdigit() or (int(owner) != os.getpid() and _pid_alive(int(owner))):
+                continue
+            # rename ก่อนอ่าน: ถ้า worker อื่นรับไฟล์เดียวกันพร้อมกัน จะมีแค่ตัวเดียวที่ rename สำเร็จ
+            claimed = f"{path.split('.claimed-')[0]}.claimed-{os.getpid()}"
+            try:
+                if path != claimed:
+                    os.rename(path, claimed)
+            except OSError:
+                continue
+            claimed_paths.append(claimed)
+
+        recovered = 0
+        for claimed in claimed_paths:
+            with open(claimed, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        continue  # บรรทัดสุดท้ายที่เขียนไม่ครบตอน crash
+                    self._pending.append((record["id"], record["data"]))
+                    recovered += 1
+        # เขียน spool ของ process นี้ให้เสร็จก่อนลบไฟล์ที่รับมา
+        self._rewrite_spool()
+        for claimed in claimed_paths:
+            os.remove(claimed)
+        if recovered:
+            logger.info(f"Recovered {recovered} unsent feedback records from spool")
+
+    def _rewrite_spool(self):
+        """เขียน spool ใหม่ให้เหลือเฉพาะรายการที่ยังไม่ได้บันทึก (เรียกขณะถือ _cond)"""
+        path = self._spool_path()
+        if not self._pending:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record_id, data in self._pending:
+                f.write(json.dumps({"id": record_id, "data": data}, ensure_ascii=False, default=_encode) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def submit(self, data: dict) -> str:
+        """รับ feedback เข้าคิว (บันทึกลง spool ก่อนคืนค่า) คืน document id"""
+        self.start()
+        record_id = uuid.uuid4().hex
+        line = json.dumps({"id": record_id, "data": data}, ensure_ascii=False, default=_encode) + "\n"
+        with self._cond:
+            with open(self._spool_path(), "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.append((record_id, data))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return record_id
+
+    def _run(self):
+        retry_delay = 0.0
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + max(self.flush_interval, retry_delay)
+                # หลังเขียนล้มเหลวรอครบ backoff ก่อน แม้คิวจะเต็ม batch แล้ว
+                while not self._stop and (retry_delay > 0 or len(self._pending) < self.batch_size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stop
+            if self.flush():
+                retry_delay = 0.0
+            else:
+                retry_delay = min(self.max_retry_delay, max(1.0, retry_delay * 2))
+            if stopping:
+                return
+
+    def flush(self) -> bool:
+        """เขียนรายการที่ค้างทั้งหมดลง Firestore คืน False ถ้าเขียนไม่สำเร็จ"""
+        with self._write_lock:
+            while True:
+                with self._cond:
+                    batch_records = self._pending[:MAX_BATCH]
+                if not batch_records:
+                    return True
+                try:
+                    with metrics.timer("aiva_stage_seconds", stage="feedback_write"):
+                        batch = self.db.batch()
+                        collection = self.db.collection(self.collection)
+                        for record_id, data in batch_records:
+                            batch.set(collection.document(record_id), data)
+                        batch.commit()
+                except Exception as e:
+                    self.failures += 1
+                    metrics.inc("aiva_errors_total", stage="feedback_write")
+                    logger.warning(f"Feedback batch write failed ({len(batch_records)} records kept in spool): {e}")
+                    return False
+                with self._cond:
+                    del self._pending[:len(batch_records)]
+                    self._rewrite_spool()
+                self.written += len(batch_records)
+                logger.info(f"Feedback batch written to Firestore ({len(batch_records)} records)")
+
+    def close(self, timeout: float = 10.0):
+        """หยุด thread หลังเขียนรายการที่ค้างอยู่ (เรียกตอน shutdown)"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._cond:
+            if self._pending:
+                logger.warning(f"{len(self._pending)} feedback records left in spool for next start")
+            self._pid = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "failures": self.failures}
+
+
+class FakeFirestoreClient:
+    """Firestore จำลองสำหรับทดสอบ/พัฒนาแบบออฟไลน์ (collection/document/set/batch/commit)
+
+    offline=True ทำให้ commit ล้มเหลวเหมือนต่อ Firestore ไม่ได้
+    """
+
+    def __init__(self, offline: bool = False, latency: float = 0.0):
+        self.documents = {}     # (collection, id) -> data
+        self.commits = 0
+        self.offline = offline
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def collection(self, name: str):
+        return _FakeCollection(self, name)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+    def _commit(self, writes: list):
+        time.sleep(self.latency)
+        if self.offline:
+            raise ConnectionError("Firestore unavailable")
+        with self._lock:
+            for key, data in writes:
+                self.documents[key] = dict(data)
+            self.commits += 1
+
+
+class _FakeCollection:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def document(self, doc_id: str = None):
+        return _FakeDocument(self._client, self._name, doc_id or uuid.uuid4().hex)
+
+
+class _FakeDocument:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.key = (collection, doc_id)
+        self.id = doc_id
+
+    def set(self, data: dict):
+        self._client._commit([(self.key, data)])
+
+
+class _FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, document, data: dict):
+        self._writes.append((document.key, data))
+
+    def commit(self):
+        self._client._commit(self._writes)
@@ -2,19 +2,50 @@
 Gunicorn Configuration for AIVA
 """
 import multiprocessing
+import os
+import sys
 
 # Server socket
 bind = "0.0.0.0:5002"
 backlog = 2048
 
 # Worker processes
-workers = 4
-worker_class = "sync"
-worker_connections = 1000
+# AIVA_WORKER_CLASS เลือกโหมดการรับ request:
+#   sync    - แบบเดิม 1 request ต่อ worker (คำถามที่รอ AI นานจะกัน worker ไว้ทั้งตัว)
+#   gthread - หลาย thread ต่อ worker (AIVA_THREADS) รอ Groq ได้พร้อมกันหลาย request
+#   gevent  - greenlet ต่อ request: socket ของ Groq client/gTTS และ time.sleep ถูก monkey-patch
+#             ให้ไม่ block จึงรับคำถามที่รอ AI พร้อมกันได้หลายร้อยต่อ worker (ต้องติดตั้ง gevent)
+# ถ้าเลือก gevent แต่ยังไม่ได้ติดตั้ง จะกลับไปใช้ sync ตามเดิม
+def _resolve_worker_class(name):
+    if name == "gevent":
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            print("[gunicorn_config] gevent not installed - falling back to sync workers")
+            return "sync"
+    if name not in ("sync", "gthread", "gevent"):
+        print(f"[gunicorn_config] Unknown AIVA_WORKER_CLASS '{name}' - using sync workers")
+        return "sync"
+    return name
+
+workers = int(os.environ.get("AIVA_WORKERS", "4"))
+worker_class = _resolve_worker_class(os.environ.get("AIVA_WORKER_CLASS", "sync"))
+threads = int(os.environ.get("AIVA_THREADS", "16")) if worker_class == "gthread" else 1
+worker_connections = int(os.environ.get("AIVA_WORKER_CONNECTIONS", "1000"))  # สำหรับ gevent
 timeout = 120  # 120 seconds to handle API rate limits and retries
 graceful_timeout = 30
 keepalive = 5
 
+# Shared knowledge base
+# AIVA_PRELOAD=1 โหลด app (และ knowledge base) ครั้งเดียวใน master แล้ว fork ให้ workers ใช้ร่วมกัน
+# ใช้คู่กับ AIVA_KB_STORE เพื่อให้ index อยู่ในไฟล์ mmap ที่ทุก worker map แบบ read-only
+preload_app = os.environ.get("AIVA_PRELOAD", "0") == "1"
+
+if worker_class == "gevent" and preload_app:
+    # app ถูก import ใน master ก่อน fork จึงต้อง patch ก่อน import ssl/socket ของ client ต่างๆ
+    from gevent import monkey
+    monkey.patch_all()
+
 # Logging
 accesslog = "logs/gunicorn_access.log"
 errorlog = "logs/gunicorn_error.log"
@@ -32,6 +63,39 @@ user = None
 group = None
 tmp_upload_dir = None
 
+
+def on_starting(server):
+    """ลบ metrics snapshot ของ workers รอบก่อน (ไม่ให้ /metrics รวมค่าของ process ที่ไม่มีแล้ว)"""
+    import metrics
+    metrics.REGISTRY.reset_dir()
+
+
+def post_fork(server, worker):
+    """สร้าง HTTP client ของ Groq ใหม่ใน worker (connection pool ไม่ควรแชร์ข้าม fork)
+    และเริ่ม thread เฝ้าไฟล์ข้อมูลของ worker เอง (thread ของ master ไม่ติดมาหลัง fork)"""
+    if preload_app:
+        import app
+        if hasattr(app.ai, "connect_client"):
+            app.ai.connect_client()
+        if hasattr(app.ai, "start_watcher"):
+            app.ai.start_watcher()
+        if getattr(app, "feedback_writer", None):
+            app.feedback_writer.start()
+
+
+def worker_exit(server, worker):
+    """เขียน feedback ที่ค้างในคิวลง Firestore ก่อน worker หยุด (ที่เขียนไม่ได้ยังอยู่ใน spool)
+    แล้วย้ายค่า metrics ของ worker นี้ไปรวมใน retired.json และเขียน log ที่ค้างในคิวให้หมด"""
+    app = sys.modules.get("app")
+    if app is not None and getattr(app, "feedback_writer", None):
+        app.feedback_writer.close()
+    metrics = sys.modules.get("metrics")
+    if metrics is not None:
+        metrics.shutdown()
+    log_pipeline = sys.modules.get("log_pipeline")
+    if log_pipeline is not None:
+        log_pipeline.shutdown()
+
 # SSL (uncomment if needed)
 # keyfile = None
 # certfile = None
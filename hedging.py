@@ -0,0 +1,161 @@
+"""
+AIVA - Hedged LLM Requests
+ถ้าโมเดลหลักยังไม่ส่ง token แรกภายในเวลาที่กำหนด (percentile ของเวลา token แรกที่ผ่านมา)
+ส่งคำถามเดียวกันไปโมเดลถัดไปพร้อมกัน โมเดลที่ส่ง token แรกก่อนชนะ อีกตัวถูกยกเลิก
+
+- จำนวน request ที่ hedge จำกัดด้วย HedgeBudget (ไม่เกินสัดส่วนของ request ทั้งหมด)
+- ถ้าโมเดลล้มเหลวก่อน token แรก เริ่มโมเดลถัดไปทันที (ไม่นับเป็น hedge)
+"""
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeBudget:
+    """token bucket: ทุก request ได้เครดิต ratio, hedge หนึ่งครั้งใช้ 1 เครดิต (สะสมได้ไม่เกิน burst)"""
+
+    def __init__(self, ratio: float = 0.1, burst: float = 3.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.requests = 0
+        self.hedges = 0
+        self._credits = burst
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.requests += 1
+            self._credits = min(self.burst, self._credits + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            self.hedges += 1
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_ratio": round(self.hedges / self.requests, 3) if self.requests else 0.0,
+            }
+
+
+def _delta(event):
+    return event.choices[0].delta.content if event.choices else None
+
+
+def hedged_stream(open_stream, models: list, hedge_delay, budget: HedgeBudget, router, on_failure):
+    """yield (model, delta) จากโมเดลที่ส่ง token แรกก่อน และ (model, None) เมื่อคำตอบครบ
+
+    open_stream(model) -> stream ของ chat completion (stream=True)
+    hedge_delay(model) -> วินาทีที่รอ token แรกก่อน hedge ไปโมเดลถัดไป
+    on_failure(model, exc) -> เรียกเมื่อโมเดลล้มเหลว (โมเดลที่ถูกยกเลิกไม่นับ)
+    ถ้าจบโดยไม่มี (model, None) แปลว่าไม่ได้คำตอบครบ
+    """
+    events = queue.Queue()
+    attempts = {}
+    pending = list(models)
+    budget.earn()
+
+    def run(model, attempt):
+        started = time.perf_counter()
+        first_token = None
+        try:
+            stream = open_stream(model)
+            attempt["stream"] = stream
+            for event in stream:
+                if attempt["cancel"].is_set():
+                    break
+                delta = _delta(event)
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    events.put((model, "delta", delta))
+        except Exception as e:
+            events.put((model, "cancelled" if attempt["cancel"].is_set() else "error", e))
+            return
+        if attempt["cancel"].is_set():
+            events.put((model, "cancelled", None))
+        else:
+            events.put((model, "done", (time.perf_counter() - started, first_token)))
+
+    def launch():
+        model = pending.pop(0)
+        attempt = {"cancel": threading.Event(), "stream": None}
+        attempts[model] = attempt
+        threading.Thread(target=run, args=(model, attempt), daemon=True, name=f"hedge-{model}").start()
+        return model
+
+    def cancel(model):
+        attempt = attempts[model]
+        attempt["cancel"].set()
+        close = getattr(attempt["stream"], "close", None)
+        if close:
+            try:
+                close()  # ปิด HTTP stream ของโมเดลที่แพ้ ไม่ต้องรอให้ตอบจบ
+            except Exception:
+                pass
+
+    if not pending:
+        return
+    primary = launch()
+    active = 1
+    hedge_at = time.monotonic() + hedge_delay(primary) if pending else None
+    winner = None
+    try:
+        while active:
+            timeout = None
+            if winner is None and hedge_at is not None:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            try:
+                model, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                hedge_at = None
+                if pending and budget.try_spend():
+                    logger.info(f"No first token from {primary} yet - hedging with {pending[0]}")
+                    launch()
+                    active += 1
+                continue
+
+            if kind != "delta":
+                active -= 1
+            if winner is not None and model != winner:
+                continue
+
+            if kind == "delta":
+                if winner is None:
+                    winner = model
+                    for other in attempts:
+                        if other != model:
+                            cancel(other)
+                    if len(attempts) > 1:
+                        logger.info(f"Hedged request won by {model}")
+                yield model, payload
+            elif kind == "done":
+                if winner is not None:
+                    latency, first_token = payload
+                    router.record_success(model, latency, first_token)
+                    yield model, None
+                    return
+                logger.warning(f"Model {model} returned an empty stream - trying next model")
+            elif kind == "error":
+                on_failure(model, payload)
+                if winner is not None:
+                    return
+
+            # ทุกโมเดลที่กำลังรอล้มเหลวก่อน token แรก: เริ่มโมเดลถัดไปทันที
+            if winner is None and active == 0 and pending:
+                primary = launch()
+                active += 1
+                hedge_at = time.monotonic() + hedge_delay(primary) if pending else None
+    finally:
+        for model in attempts:
+            cancel(model)
+            router.release_probe(model)
@@ -0,0 +1,190 @@
+"""
+AIVA - Shared Knowledge Base Store
+เก็บ knowledge base + retrieval index + FAQ ไว้ในไฟล์เดียวแบบ flat binary
+แล้วให้ทุก gunicorn worker map ไฟล์เดียวกันแบบ read-only (mmap)
+หน่วยความจำจึงใช้ page cache ร่วมกัน ไม่เพิ่มตามจำนวน worker
+
+รูปแบบไฟล์:
+    MAGIC (8 bytes) | header length (uint32) | header JSON | sections (align 8 bytes)
+
+การใช้งาน:
+    ตั้ง AIVA_KB_STORE=.cache/kb.bin แล้ว worker แรกที่เจอว่าไฟล์เก่า/ไม่มี จะ build ให้
+    หรือ build ล่วงหน้าตอน deploy: python kb_store.py build
+"""
+import os
+import sys
+import json
+import glob
+import mmap
+import struct
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from chunker import CHUNK_CHARS, CHUNK_OVERLAP
+from retrieval import RetrievalIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"AIVAKB01"
+FORMAT_VERSION = 2
+
+# (ชื่อ field ของ RetrievalIndex, typecode ของ array)
+_SECTIONS = [
+    ("text", "B"),
+    ("chunk_starts", "I"),
+    ("chunk_ends", "I"),
+    ("chunk_lens", "I"),
+    ("term_hashes", "Q"),
+    ("term_offsets", "I"),
+    ("post_chunks", "I"),
+    ("post_tfs", "I"),
+    ("chunk_char_starts", "I"),
+    ("chunk_sources", "I"),
+    ("chunk_pages", "I"),
+]
+
+
+def corpus_fingerprint(folder_path: str, faq_file: str = "faq.json") -> str:
+    """version ของ corpus จาก path/size/mtime ของไฟล์ข้อมูลและ faq.json (ใช้แค่ stat ไม่ต้องอ่านไฟล์)"""
+    paths = sorted(glob.glob(os.path.join(folder_path, '*.pdf')) + glob.glob(os.path.join(folder_path, '*.txt')))
+    paths.append(faq_file)
+    h = hashlib.sha256(f"format={FORMAT_VERSION}|chunk={CHUNK_CHARS},{CHUNK_OVERLAP}".encode())
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}\n".encode('utf-8'))
+        except OSError:
+            h.update(f"{os.path.abspath(path)}|missing\n".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_store(path: str, index: RetrievalIndex, faq_data: list, version: str):
+    """เขียน store แบบ atomic (worker ที่ map ไฟล์เก่าอยู่ยังใช้ต่อได้จนกว่าจะ reload)"""
+    blobs = []
+    sections = {}
+    offset = 0
+    for name, typecode in _SECTIONS:
+        value = getattr(index, name)
+        data = bytes(value) if typecode == "B" else value.tobytes()
+        sections[name] = [offset, len(data), typecode]
+        blobs.append(data)
+        offset = _align(offset + len(data))
+
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "version": version,
+        "byteorder": sys.byteorder,
+        "n_chars": index.n_chars,
+        "faq_data": faq_data,
+        "sources": index.sources,
+        "sections": sections,
+    }, ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + 4 + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for (name, _), blob in zip(_SECTIONS, blobs):
+            f.seek(data_start + sections[name][0])
+            f.write(blob)
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    logger.info(f"Knowledge base store written: {path} ({data_start + offset} bytes, version {version})")
+
+
+class KnowledgeStore:
+    """store ที่ map ไว้แบบ read-only: index ชี้เข้า mmap โดยตรง"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not an AIVA knowledge base store: {path}")
+        (header_len,) = struct.unpack('<I', view[len(MAGIC):len(MAGIC) + 4])
+        header_end = len(MAGIC) + 4 + header_len
+        header = json.loads(bytes(view[len(MAGIC) + 4:header_end]).decode('utf-8'))
+        if header.get("format") != FORMAT_VERSION or header.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Incompatible knowledge base store: {path}")
+
+        data_start = _align(header_end)
+        fields = {}
+        for name, (offset, length, typecode) in header["sections"].items():
+            section = view[data_start + offset:data_start + offset + length]
+            fields[name] = section if typecode == "B" else section.cast(typecode)
+
+        self.path = path
+        self.version = header["version"]
+        self.faq_data = header["faq_data"]
+        self.index = RetrievalIndex(n_chars=header["n_chars"], sources=header["sources"], **fields)
+
+
+@contextmanager
+def _build_lock(path: str):
+    """ให้ worker เดียว build store ส่วนตัวอื่นรอแล้วใช้ผลลัพธ์"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _open_if_current(path: str, version: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        store = KnowledgeStore(path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable knowledge base store {path}: {e}")
+        return None
+    return store if store.version == version else None
+
+
+def load_or_build(path: str, version: str, build_fn) -> KnowledgeStore:
+    """map store ที่ตรงกับ version ถ้ามี ไม่งั้นเรียก build_fn() -> (index, faq_data) แล้วเขียนใหม่"""
+    store = _open_if_current(path, version)
+    if store:
+        logger.info(f"Mapped shared knowledge base store: {path} (version {version})")
+        return store
+
+    with _build_lock(path):
+        # worker อื่นอาจ build เสร็จไปแล้วระหว่างรอ lock
+        store = _open_if_current(path, version)
+        if store is None:
+            logger.info(f"Building knowledge base store: {path} (version {version})")
+            index, faq_data = build_fn()
+            write_store(path, index, faq_data, version)
+            store = KnowledgeStore(path)
+    logger.info(f"Mapped shared knowledge base store: {path} (version {version})")
+    return store
+
+
+if __name__ == "__main__":
+    # python kb_store.py build [data_folder] [store_path]  (สำหรับ build ตอน deploy)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("Usage: python kb_store.py build [data_folder] [store_path]")
+        sys.exit(1)
+    from pdf_ai_engine import PdfAIEngine
+    folder = sys.argv[2] if len(sys.argv) > 2 else "data_files"
+    store_path = sys.argv[3] if len(sys.argv) > 3 else os.environ.get("AIVA_KB_STORE", os.path.join(".cache", "kb.bin"))
+    engine = PdfAIEngine(pdf_folder_path=folder, api_key="", kb_store_path=store_path)
+    print(f"Knowledge base store ready: {store_path} (version {engine.corpus_version})")
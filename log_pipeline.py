@@ -0,0 +1,275 @@
+"""
+AIVA - Logging Pipeline
+ย้ายการเขียน log ออกจาก request thread: logger ทุกตัวส่ง record เข้าคิว แล้ว thread เบื้องหลังเขียนไฟล์/console
+
+- QueueHandler ใส่คิวแบบไม่รอ (คิวเต็ม = ทิ้ง record และนับไว้) request จึงไม่ช้าลงเพราะ disk/console
+- ทุก record มี request_id (จาก X-Request-ID หรือสร้างใหม่) และ stage/duration_ms เมื่อส่งมาทาง extra
+- DEBUG ถูกสุ่มเก็บตาม AIVA_LOG_DEBUG_SAMPLE โดยเลือกเป็นราย request (request ที่ถูกเลือกได้ DEBUG ครบทุกบรรทัด)
+- หลาย worker เขียนไฟล์เดียวกันได้: หมุนไฟล์ภายใต้ flock และเปิดไฟล์ใหม่เมื่อ worker อื่นหมุนไปแล้ว
+- AIVA_LOG_FORMAT=json เขียนเป็น JSON ต่อบรรทัด ค่าเริ่มต้นเป็น text รูปแบบเดิม (+ request id ในวงเล็บชื่อ logger)
+- หลัง fork (gunicorn --preload) thread เขียน log เริ่มใหม่เองใน worker
+"""
+import os
+import json
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import zlib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows: หมุนไฟล์แบบเดิม (process เดียว)
+    fcntl = None
+
+LOG_LEVEL = os.environ.get("AIVA_LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.environ.get("AIVA_LOG_FORMAT", "text")
+DEBUG_SAMPLE = float(os.environ.get("AIVA_LOG_DEBUG_SAMPLE", "1"))
+QUEUE_SIZE = int(os.environ.get("AIVA_LOG_QUEUE", "10000"))
+MAX_BYTES = int(os.environ.get("AIVA_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUP_COUNT = int(os.environ.get("AIVA_LOG_BACKUPS", "5"))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(name)s%(context)s] - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_request_id = contextvars.ContextVar("aiva_request_id", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id: str = None) -> str:
+    """กำหนด request id ของ request ปัจจุบัน (ใช้ค่าที่ส่งมาหรือสร้างใหม่)"""
+    request_id = (request_id or "").strip()[:64] or new_request_id()
+    _request_id.set(request_id)
+    return request_id
+
+
+def clear_request_id():
+    """ลบ request id เมื่อจบ request (thread ของ server ถูกใช้ซ้ำกับ request ถัดไป)"""
+    _request_id.set(None)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class ContextFilter(logging.Filter):
+    """เติม request_id/stage/duration_ms และสุ่มเก็บ DEBUG (ทำงานบน thread ที่ log ก่อนเข้าคิว)"""
+
+    def __init__(self, debug_sample: float = DEBUG_SAMPLE):
+        super().__init__()
+        self.debug_sample = debug_sample
+
+    def _keep_debug(self, request_id) -> bool:
+        if self.debug_sample >= 1:
+            return True
+        if self.debug_sample <= 0:
+            return False
+        if request_id:
+            # ผลเดียวกันทุกบรรทัดของ request เดียวกัน
+            return (zlib.crc32(request_id.encode()) % 10000) < self.debug_sample * 10000
+        return random.random() < self.debug_sample
+
+    def filter(self, record) -> bool:
+        request_id = getattr(record, "request_id", None) or _request_id.get()
+        if record.levelno <= logging.DEBUG and not self._keep_debug(request_id):
+            return False
+        record.request_id = request_id
+        if not hasattr(record, "stage"):
+            record.stage = None
+        if not hasattr(record, "duration_ms"):
+            record.duration_ms = None
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """รูปแบบเดิม โดยเพิ่ม rid/stage/ms ไว้ในวงเล็บชื่อ logger (ข้อความเดิมไม่เปลี่ยน)"""
+
+    def format(self, record) -> str:
+        context = ""
+        if getattr(record, "request_id", None):
+            context += f" rid={record.request_id}"
+        if getattr(record, "stage", None):
+            context += f" stage={record.stage}"
+        if getattr(record, "duration_ms", None) is not None:
+            context += f" ms={record.duration_ms:.1f}"
+        record.context = context
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON หนึ่งบรรทัดต่อ record"""
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        for field in ("request_id", "stage", "duration_ms"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler ที่หลาย process เขียนไฟล์เดียวกันได้
+
+    ทุกการเขียนถือ flock บนไฟล์ .lock ร่วมกัน: การตรวจขนาด/หมุนไฟล์จึงเกิดทีละ process
+    และถ้า process อื่นหมุนไฟล์ไปแล้ว (inode เปลี่ยน) จะเปิด aiva.log ใหม่ก่อนเขียน
+    """
+
+    def __init__(self, filename, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        self._lock_path = f"{self.baseFilename}.lock"
+        self._lock_file = None
+        self._lock_pid = None
+
+    def _acquire_file_lock(self):
+        if fcntl is None:
+            return None
+        if self._lock_pid != os.getpid():
+            self._lock_file = open(self._lock_path, "a")
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        return self._lock_file
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = None  # FileHandler.emit เปิดไฟล์ใหม่ให้
+
+    def emit(self, record):
+        lock_file = self._acquire_file_lock()
+        try:
+            if lock_file:
+                self._reopen_if_rotated()
+            super().emit(record)
+        finally:
+            if lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        super().close()
+        if self._lock_file and self._lock_pid == os.getpid():
+            self._lock_file.close()
+        self._lock_file = None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """ใส่ record เข้าคิวโดยไม่รอ และเริ่ม thread เขียน log ใหม่เมื่ออยู่ใน process ลูก"""
+
+    def __init__(self, handlers, maxsize: int = QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.target_handlers = list(handlers)
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """เริ่ม thread เขียน log (ครั้งเดียวต่อ process เรียกซ้ำหลัง fork ได้)"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return self
+            # หลัง fork: คิวของ process แม่อาจมี record ค้างและไม่มี thread อ่านแล้ว
+            self.queue = queue.Queue(self.maxsize)
+            self.dropped = 0
+            self.listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+        return self
+
+    def stop(self):
+        """เขียน record ที่ค้างในคิวให้หมดแล้วหยุด thread (เรียกตอน shutdown)"""
+        with self._start_lock:
+            if self._pid != os.getpid() or self.listener is None:
+                return
+            self.listener.stop()
+            self._pid = None
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped}
+
+
+_handler = None
+
+
+def setup_logging(log_dir: str = "logs", level: str = LOG_LEVEL, fmt: str = LOG_FORMAT,
+                  debug_sample: float = DEBUG_SAMPLE, console: bool = True) -> NonBlockingQueueHandler:
+    """ตั้งค่า root logger ให้ส่งทุก record ผ่านคิว (เรียกซ้ำได้ จะแทนที่ handler เดิม)"""
+    global _handler
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    handlers = [SharedRotatingFileHandler(os.path.join(log_dir, "aiva.log"))]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root_logger = logging.getLogger()
+    if _handler is not None:
+        root_logger.removeHandler(_handler)
+        _handler.stop()
+        for handler in _handler.target_handlers:
+            handler.close()
+    _handler = NonBlockingQueueHandler(handlers)
+    _handler.addFilter(ContextFilter(debug_sample))
+    root_logger.setLevel(level)
+    root_logger.addHandler(_handler)
+    _handler.start()
+    return _handler
+
+
+def stats() -> dict:
+    return _handler.stats() if _handler else {"queued": 0, "dropped": 0}
+
+
+def shutdown():
+    """ถอด handler ออกจาก root logger แล้วเขียน record ที่ค้างให้หมด
+
+    record ที่ log ระหว่างปิด interpreter (เช่น __del__ ของ HTTP client) จะไม่เข้าคิวที่ไม่มีคนอ่านแล้ว
+    """
+    global _handler
+    handler, _handler = _handler, None
+    if handler is None:
+        return
+    logging.getLogger().removeHandler(handler)
+    handler.stop()
+    for target in handler.target_handlers:
+        try:
+            target.flush()
+        except Exception:
+            pass
+
+
+atexit.register(shutdown)
@@ -0,0 +1,357 @@
+"""
+AIVA - Metrics (Prometheus text format)
+วัดเวลาของแต่ละขั้น (FAQ, retrieval, โมเดลแต่ละตัว, TTS, Firestore) เป็น histogram และนับเหตุการณ์เป็น counter
+
+- ไม่ต้องติดตั้ง prometheus_client: เก็บค่าในหน่วยความจำ แล้วแสดงผลเป็น text format ของ Prometheus ที่ /metrics
+- รวมค่าข้าม gunicorn workers: แต่ละ worker เขียน snapshot ของตัวเองลง <METRICS_DIR>/<pid>.<token>.json
+  เป็นระยะ worker ที่ตอบ /metrics อ่านทุกไฟล์มารวมกัน (ค่าของ worker อื่นช้าได้ไม่เกิน FLUSH_INTERVAL)
+- ค่าที่เก็บก่อน fork (เช่น ตอน preload ใน master) ไม่ถูกนับซ้ำใน worker
+- worker ที่ออก (worker_exit/atexit) หรือตายไปแล้ว (pid ไม่มี หรือ snapshot ไม่ถูกเขียนใหม่นานเกิน STALE_SECONDS)
+  ถูกย้ายค่าไปรวมใน retired.json ภายใต้ flock counter จึงไม่ลดลงเมื่อ worker ถูก restart
+  (ค่ากลับเป็นศูนย์เฉพาะ reset_dir ตอนเริ่ม gunicorn/app ใหม่)
+"""
+import os
+import json
+import uuid
+import atexit
+import glob
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: ไม่มี gunicorn workers ไม่ต้อง lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("AIVA_METRICS", "1") == "1"
+METRICS_DIR = os.environ.get("AIVA_METRICS_DIR", os.path.join(os.environ.get("AIVA_CACHE_DIR", ".cache"), "metrics"))
+FLUSH_INTERVAL = float(os.environ.get("AIVA_METRICS_FLUSH", "5"))
+
+# snapshot ที่ไม่ถูกเขียนใหม่นานเกินนี้ถือว่า worker ออกไปแล้ว แม้ pid จะถูก process อื่นใช้ซ้ำ
+STALE_SECONDS = max(60.0, 10 * FLUSH_INTERVAL)
+RETIRED_NAME = "retired.json"
+RETIRED_KEEP = 1000  # จำชื่อ snapshot ที่รวมไปแล้ว (กันนับซ้ำถ้าไฟล์ถูกเขียนกลับมา)
+
+# ขอบบนของ bucket (วินาที) ครอบคลุมตั้งแต่ FAQ (ms) ถึงโมเดลที่ตอบช้า/timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "aiva_stage_seconds": "Time spent in each request stage",
+    "aiva_llm_seconds": "Duration of each model attempt by outcome",
+    "aiva_llm_first_token_seconds": "Time to first streamed token per model",
+    "aiva_http_request_seconds": "HTTP request duration until the response is returned",
+    "aiva_answers_total": "Answers by source",
+    "aiva_model_failures_total": "Failed model attempts by error kind",
+    "aiva_tts_cache_total": "TTS cache lookups by result",
+    "aiva_errors_total": "Errors by stage",
+    "aiva_http_requests_total": "HTTP requests by endpoint and status",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(counters: dict, histograms: dict, snap: dict):
+    for name, labels, value in snap["counters"]:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, hist in snap["histograms"]:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        merged = histograms.setdefault(key, [0] * len(hist))
+        for i, value in enumerate(hist):
+            merged[i] += value
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill บน Windows ปิด process จริง (และไม่มี gunicorn workers)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # มี process อยู่แต่ไม่มีสิทธิ์ส่ง signal
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self, metrics_dir: str = None, buckets=DEFAULT_BUCKETS, flush_interval: float = FLUSH_INTERVAL,
+                 stale_seconds: float = STALE_SECONDS):
+        self.metrics_dir = metrics_dir
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self.stale_seconds = stale_seconds
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [count ของแต่ละ bucket..., sum, count]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]  # ชื่อ snapshot ไม่ซ้ำกับ process เดิมที่เคยใช้ pid นี้
+        self._flusher_pid = None
+        self._closed_pid = None
+
+    def _check_fork(self):
+        # process ลูกเริ่มนับใหม่ ไม่อย่างนั้นค่าจาก master จะถูกนับซ้ำทุก worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._token = uuid.uuid4().hex[:8]
+            self._counters = {}
+            self._histograms = {}
+            self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self._check_fork()
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._start_flusher()
+
+    def observe(self, name: str, seconds: float, **labels):
+        self._check_fork()
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    hist[i] += 1
+                    break
+            hist[-2] += seconds
+            hist[-1] += 1
+        self._start_flusher()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """จับเวลาของ block (บันทึกแม้ block จะ raise)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict:
+        self._check_fork()
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, list(labels), list(hist)] for (name, labels), hist in self._histograms.items()],
+            }
+
+    def flush(self):
+        """เขียน snapshot ของ process นี้ลงไฟล์ (ให้ worker อื่นอ่านไปรวม)"""
+        if not self.metrics_dir or self._closed_pid == os.getpid():
+            return
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            path = os.path.join(self.metrics_dir, self._snapshot_name())
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+
+    def _start_flusher(self):
+        if not self.metrics_dir or self.flush_interval <= 0 or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        threading.Thread(target=run, daemon=True, name="metrics-flush").start()
+
+    def _snapshot_name(self) -> str:
+        self._check_fork()
+        return f"{os.getpid()}.{self._token}.json"
+
+    @contextmanager
+    def _dir_lock(self):
+        """lock ข้าม process ของ retired.json และการย้าย snapshot เข้าไปรวม"""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        with open(os.path.join(self.metrics_dir, "retired.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield  # ปิดไฟล์ = ปล่อย lock
+
+    def _retire(self, snapshots: dict):
+        """รวม {ชื่อไฟล์: snapshot} ของ worker ที่ออกไปแล้วเข้า retired.json แล้วลบไฟล์ (ต้องถือ _dir_lock)"""
+        path = os.path.join(self.metrics_dir, RETIRED_NAME)
+        retired = _read_json(path) or {"buckets": list(self.buckets), "counters": [], "histograms": [], "names": []}
+        counters = {}
+        histograms = {}
+        _merge(counters, histograms, retired)
+        names = retired.get("names", [])
+        for name, snap in snapshots.items():
+            # ชื่อที่รวมไปแล้ว (ไฟล์ถูกเขียนกลับมาโดย flush ที่ค้างอยู่) ไม่นับซ้ำ
+            if name not in names and snap and snap.get("buckets") == retired["buckets"]:
+                _merge(counters, histograms, snap)
+            names.append(name)
+        retired = {
+            "buckets": retired["buckets"],
+            "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+            "histograms": [[name, list(labels), hist] for (name, labels), hist in histograms.items()],
+            "names": list(dict.fromkeys(names))[-RETIRED_KEEP:],
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(retired, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        for name in snapshots:
+            try:
+                os.remove(os.path.join(self.metrics_dir, name))
+            except OSError:
+                pass
+
+    def close(self):
+        """ย้ายค่าของ process นี้เข้า retired.json และหยุดเขียน snapshot (เรียกตอน worker ออก)"""
+        if not self.metrics_dir or self._closed_pid == os.getpid():
+            return
+        self._closed_pid = os.getpid()
+        try:
+            with self._dir_lock():
+                self._retire({self._snapshot_name(): self.snapshot()})
+        except OSError as e:
+            logger.warning(f"Could not retire metrics snapshot: {e}")
+
+    def _is_retired(self, name: str, now: float) -> bool:
+        """snapshot ของ worker ที่ไม่อยู่แล้ว: pid ไม่มี หรือไม่ถูกเขียนใหม่นานเกิน stale_seconds (pid ถูกใช้ซ้ำ)"""
+        try:
+            pid = int(name.split(".", 1)[0])
+            age = now - os.path.getmtime(os.path.join(self.metrics_dir, name))
+        except (ValueError, OSError):
+            return False
+        if not _pid_alive(pid):
+            return True
+        return self.flush_interval > 0 and age > self.stale_seconds
+
+    def reset_dir(self):
+        """ลบ snapshot และ retired.json ของรอบก่อน (เรียกใน gunicorn master ก่อน fork workers หรือตอนเริ่ม python app.py)
+
+        เป็นที่เดียวที่ counter กลับเป็นศูนย์
+        """
+        if not self.metrics_dir:
+            return
+        for path in glob.glob(os.path.join(self.metrics_dir, "*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def collect(self):
+        """รวมค่าของทุก worker คืน (counters, histograms) แบบ {(name, labels): value}"""
+        snapshots = [self.snapshot()]
+        if self.metrics_dir:
+            self.flush()
+            own = self._snapshot_name()
+            try:
+                # อ่านทั้งหมดภายใต้ lock: worker ที่กำลังออกจะไม่ถูกนับทั้งสองที่หรือหายไปจากทั้งสองที่
+                with self._dir_lock():
+                    now = time.time()
+                    names = [os.path.basename(path) for path in glob.glob(os.path.join(self.metrics_dir, "*.json"))]
+                    names = [name for name in names if name != own and name.split(".", 1)[0].isdigit()]
+                    # worker ที่ถูก kill/ออกโดยไม่ได้เรียก close: ย้ายค่าเข้า retired.json (ไม่ทิ้ง)
+                    dead = [name for name in names if self._is_retired(name, now)]
+                    if dead:
+                        self._retire({name: _read_json(os.path.join(self.metrics_dir, name)) for name in dead})
+                    for name in [RETIRED_NAME] + [name for name in names if name not in dead]:
+                        snap = _read_json(os.path.join(self.metrics_dir, name))
+                        if snap:
+                            snapshots.append(snap)
+            except OSError as e:
+                logger.warning(f"Could not read metrics snapshots: {e}")
+
+        counters = {}
+        histograms = {}
+        for snap in snapshots:
+            if snap.get("buckets") == list(self.buckets):
+                _merge(counters, histograms, snap)
+        return counters, histograms
+
+    def render(self) -> str:
+        """ข้อความตาม Prometheus text exposition format (version 0.0.4)"""
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted({name for name, _ in histograms}):
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for upper, count in zip(self.buckets, hist):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(upper))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry(METRICS_DIR if METRICS_ENABLED else None)
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if METRICS_ENABLED:
+        REGISTRY.inc(name, amount, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    if METRICS_ENABLED:
+        REGISTRY.observe(name, seconds, **labels)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def shutdown():
+    """ย้ายค่าของ process นี้เข้า retired.json (worker_exit ของ gunicorn และ atexit)"""
+    REGISTRY.close()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,195 @@
+"""
+AIVA - Model Router (circuit breaker)
+จำสถานะของแต่ละโมเดลใน process นี้ เพื่อไม่ต้องเริ่มจากโมเดลหลักทุกคำถามในช่วงที่โดน rate limit
+
+- 429: ปิดโมเดลนั้นไว้ตาม retry-after ที่ Groq ส่งมา (หรือ cooldown ถ้าไม่มี)
+- timeout/error ติดกันหลายครั้ง: ปิดโมเดลนั้นชั่วคราว
+- ถ้าโมเดลถูกปิดซ้ำติดกัน cooldown จะเพิ่มเป็นสองเท่า (ไม่เกิน max_cooldown) สำเร็จครั้งเดียวรีเซ็ต
+- ถ้าทุกโมเดลถูกปิด (half-open): ให้คำขอเดียวลองโมเดลที่ถูกปิดนานที่สุด ถ้าล้มเหลวปิดต่อทันที
+- เก็บ latency เฉลี่ย (EWMA) ของแต่ละโมเดลไว้ดูใน /status
+"""
+import os
+import re
+import time
+import threading
+from collections import deque
+
+DEFAULT_COOLDOWN = float(os.environ.get("AIVA_MODEL_COOLDOWN", "20"))
+MAX_COOLDOWN = float(os.environ.get("AIVA_MODEL_MAX_COOLDOWN", "300"))
+
+# จำนวนครั้งที่ล้มเหลวติดกันก่อนปิดโมเดล (429 ปิดทันที)
+FAILURE_THRESHOLDS = {"rate_limit": 1, "timeout": 2, "error": 3}
+LATENCY_ALPHA = 0.2
+
+# เวลาที่คำขอ probe (half-open) ถือสิทธิ์ไว้ ก่อนให้คำขออื่นลองแทน (เท่ากับ timeout ของ Groq client)
+PROBE_TIMEOUT = 30.0
+
+# เก็บเวลาถึง token แรกล่าสุดไว้คำนวณ percentile (สำหรับ hedging)
+FIRST_TOKEN_SAMPLES = 200
+MIN_PERCENTILE_SAMPLES = 20
+
+_DURATION_RE = re.compile(r'([\d.]+)(ms|h|m|s)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str):
+    """แปลง "7.66s", "2m59.5s", "500ms" หรือ "12" เป็นวินาที"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def retry_after_seconds(exc):
+    """อ่านเวลาที่ควรรอจาก header ของ response (retry-after หรือ x-ratelimit-reset-*)"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            seconds = _parse_duration(value)
+            if seconds is not None:
+                return seconds
+    return None
+
+
+def classify_error(exc) -> str:
+    """rate_limit / timeout / error"""
+    message = str(exc).lower()
+    if getattr(exc, "status_code", None) == 429 or "429" in message or "rate_limit" in message:
+        return "rate_limit"
+    if "timeout" in type(exc).__name__.lower() or "timeout" in message or "timed out" in message:
+        return "timeout"
+    return "error"
+
+
+class _ModelState:
+    __slots__ = ("failures", "open_until", "opened", "opened_at", "probe_until", "last_error", "latency",
+                 "first_token", "first_token_samples", "successes", "errors")
+
+    def __init__(self):
+        self.failures = 0          # ล้มเหลวติดกัน
+        self.open_until = 0.0      # monotonic time ที่จะกลับมาใช้ได้
+        self.opened = 0            # จำนวนครั้งที่ถูกปิดติดกัน (สำหรับ backoff)
+        self.opened_at = 0.0       # monotonic time ที่ถูกปิดครั้งล่าสุด
+        self.probe_until = 0.0     # มีคำขอ probe (half-open) กำลังลองโมเดลนี้อยู่จนถึงเวลานี้
+        self.last_error = None
+        self.latency = None        # EWMA (วินาที) ของการเรียกที่สำเร็จ
+        self.first_token = None    # EWMA (วินาที) ของเวลาถึง token แรก (stream)
+        self.first_token_samples = deque(maxlen=FIRST_TOKEN_SAMPLES)
+        self.successes = 0
+        self.errors = 0
+
+
+class ModelRouter:
+    def __init__(self, models: list, cooldown: float = DEFAULT_COOLDOWN, max_cooldown: float = MAX_COOLDOWN,
+                 probe_timeout: float = PROBE_TIMEOUT):
+        self.models = list(models)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self._states = {m: _ModelState() for m in self.models}
+        self._lock = threading.Lock()
+
+    def candidates(self) -> list:
+        """โมเดลที่ใช้ได้ตอนนี้ ตามลำดับความต้องการ (ข้ามโมเดลที่ circuit เปิดอยู่)
+
+        ถ้าทุก circuit เปิด คืนโมเดลที่ถูกปิดนานที่สุดให้คำขอนี้ลอง (probe) ครั้งละหนึ่งคำขอ
+        คำขออื่นระหว่างนั้นได้ list ว่าง จนกว่า probe จะจบ (record_success/record_failure/release_probe)
+        หรือเกิน probe_timeout
+        """
+        now = time.monotonic()
+        with self._lock:
+            available = [m for m in self.models if self._states[m].open_until <= now]
+            if available or not self.models:
+                return available
+            if any(self._states[m].probe_until > now for m in self.models):
+                return []
+            model = min(self.models, key=lambda m: self._states[m].opened_at)
+            self._states[model].probe_until = now + self.probe_timeout
+            return [model]
+
+    def record_success(self, model: str, latency: float, first_token: float = None):
+        with self._lock:
+            state = self._states[model]
+            state.failures = 0
+            state.opened = 0
+            state.open_until = 0.0
+            state.probe_until = 0.0
+            state.successes += 1
+            state.latency = latency if state.latency is None else \
+                state.latency + LATENCY_ALPHA * (latency - state.latency)
+            if first_token is not None:
+                state.first_token_samples.append(first_token)
+                state.first_token = first_token if state.first_token is None else \
+                    state.first_token + LATENCY_ALPHA * (first_token - state.first_token)
+
+    def record_failure(self, model: str, exc) -> str:
+        """บันทึกความล้มเหลว คืนประเภทของ error (rate_limit / timeout / error)"""
+        kind = classify_error(exc)
+        retry_after = retry_after_seconds(exc) if kind == "rate_limit" else None
+        with self._lock:
+            now = time.monotonic()
+            state = self._states[model]
+            probing = state.probe_until > now
+            state.probe_until = 0.0
+            state.failures += 1
+            state.errors += 1
+            state.last_error = kind
+            # probe ที่ล้มเหลวปิด circuit ต่อทันทีโดยไม่รอให้ครบ threshold
+            if probing or state.failures >= FAILURE_THRESHOLDS[kind]:
+                if retry_after is not None:
+                    wait = min(retry_after, self.max_cooldown)
+                else:
+                    wait = min(self.cooldown * (2 ** state.opened), self.max_cooldown)
+                state.open_until = max(state.open_until, now + wait)  # probe ไม่ย่นเวลาปิดเดิม
+                state.opened_at = now
+                state.opened += 1
+                state.failures = 0
+        return kind
+
+    def release_probe(self, model: str):
+        """คืนสิทธิ์ probe ที่จบโดยไม่ได้รายงานผล (stream ว่าง, ผู้ใช้ตัดการเชื่อมต่อ) circuit ยังเปิดตามเดิม"""
+        with self._lock:
+            self._states[model].probe_until = 0.0
+
+    def first_token_percentile(self, model: str, percentile: float):
+        """percentile ของเวลาถึง token แรก (วินาที) หรือ None ถ้าตัวอย่างยังน้อยเกินไป"""
+        with self._lock:
+            samples = sorted(self._states[model].first_token_samples)
+        if len(samples) < MIN_PERCENTILE_SAMPLES:
+            return None
+        rank = min(len(samples) - 1, max(0, int(round(percentile / 100 * len(samples))) - 1))
+        return samples[rank]
+
+    def snapshot(self) -> dict:
+        """สถานะของทุกโมเดลสำหรับ monitoring"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for model in self.models:
+                state = self._states[model]
+                open_for = max(0.0, state.open_until - now)
+                if open_for <= 0:
+                    circuit = "closed"
+                else:
+                    circuit = "half_open" if state.probe_until > now else "open"
+                result[model] = {
+                    "state": circuit,
+                    "open_for_s": round(open_for, 1),
+                    "consecutive_failures": state.failures,
+                    "last_error": state.last_error,
+                    "latency_ms": round(state.latency * 1000) if state.latency is not None else None,
+                    "first_token_ms": round(state.first_token * 1000) if state.first_token is not None else None,
+                    "first_token_samples": len(state.first_token_samples),
+                    "successes": state.successes,
+                    "errors": state.errors,
+                }
+            return result
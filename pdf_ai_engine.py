@@ -1,43 +1,133 @@
-import pdfplumber
 import os
 import glob
 import time
 import json
 import logging
+import textwrap
+import threading
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 
+import metrics
+from answer_cache import AnswerCache, normalize_question
+from chunker import wrap_source
+from faq_matcher import FaqMatcher
+from hedging import HedgeBudget, hedged_stream
+from kb_store import corpus_fingerprint, load_or_build
+from model_router import ModelRouter
+from pdf_extractor import extract_pdfs, EXTRACT_WORKERS
+from prompt_builder import build_prompt
+from retrieval import RetrievalIndex
+from singleflight import SingleFlight, worker_lock
+from text_cache import ExtractedTextCache
+
 # สร้าง logger สำหรับ module นี้
 logger = logging.getLogger(__name__)
 
+FAQ_FILE = "faq.json"
+
+# รายชื่อโมเดลที่จะลองใช้ (ระบบ Auto-Switch แก้ Error 429)
+MODELS_TO_TRY = [
+    "llama-3.3-70b-versatile",   # ตัวหลัก (ฉลาดสุด)
+    "llama-3.1-8b-instant",      # ตัวรอง (เร็ว/โควต้าเยอะ)
+    "gemma2-9b-it"               # ตัวสำรองสุดท้าย
+]
+
+# จำนวน chunk ที่ดึงมาเป็นตัวเลือก (prompt builder เลือกเท่าที่พอดีงบ token ของโมเดล)
+RETRIEVE_TOP_K = 12
+
+# knowledge base ที่สั้นกว่านี้ (ตัวอักษร) ส่งทุก chunk เป็น context โดยไม่ต้องค้นหา
+FULL_CONTEXT_CHARS = int(os.environ.get("AIVA_FULL_CONTEXT_CHARS", "6000"))
+
+# ข้อความตอบกลับเมื่อไม่ได้คำตอบจาก AI (find_answers ติด source เป็น "error")
+NO_CLIENT_ANSWER = "ระบบ AI ขัดข้อง"
+ERROR_ANSWER = "ขออภัย ระบบขัดข้องชั่วคราว"
+BUSY_ANSWER = "ขออภัย ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณารอสักครู่แล้วลองใหม่"
+FALLBACK_ANSWERS = {NO_CLIENT_ANSWER, ERROR_ANSWER, BUSY_ANSWER}
+
+# Hedging: ถ้าโมเดลหลักยังไม่ส่ง token แรกภายใน percentile ที่กำหนด ส่งไปโมเดลถัดไปพร้อมกัน
+HEDGE_ENABLED = os.environ.get("AIVA_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("AIVA_HEDGE_PERCENTILE", "90"))
+HEDGE_BUDGET = float(os.environ.get("AIVA_HEDGE_BUDGET", "0.1"))  # hedge ได้ไม่เกิน 10% ของ request
+HEDGE_DEFAULT_DELAY = 2.0   # วินาที (ใช้จนกว่าจะมีสถิติ token แรกพอ)
+HEDGE_MIN_DELAY = 0.3
+
+# คำถามเดียวกันที่เข้ามาพร้อมกันเรียก AI ครั้งเดียว (ใน process / ข้าม workers ผ่าน lock file + answer cache)
+COALESCE_ENABLED = os.environ.get("AIVA_COALESCE", "1") == "1"
+COALESCE_WORKERS = os.environ.get("AIVA_COALESCE_WORKERS", "1") == "1"
+
+# จำนวนคำถามที่เรียก AI พร้อมกันใน find_answers (batch)
+BATCH_MAX_WORKERS = int(os.environ.get("AIVA_BATCH_WORKERS", "4"))
+
+# endpoint ของ Groq (เปลี่ยนเป็น server จำลองได้ตอนรัน benchmarks)
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+
+# ตรวจไฟล์ใน data_files/ และ faq.json ทุกกี่วินาที แล้ว reload เมื่อเปลี่ยน (0 = ไม่เฝ้าไฟล์)
+RELOAD_INTERVAL = float(os.environ.get("AIVA_RELOAD_INTERVAL", "0"))
+
+# gunicorn --preload (gunicorn_config.py): engine ถูกสร้างใน master watcher จึงเริ่มใน post_fork ของแต่ละ worker แทน
+PRELOAD = os.environ.get("AIVA_PRELOAD", "0") == "1"
+
+# เก็บข้อความ/term ของแต่ละไฟล์ไว้ใน memory เพื่อ reload เฉพาะไฟล์ที่เปลี่ยน
+# เฉพาะเมื่อมีทาง reload (watcher หรือ /admin/reload) ไม่อย่างนั้นทุก worker จะถือข้อมูลซ้ำกับ index ไว้เปล่าๆ
+KEEP_SEGMENTS = RELOAD_INTERVAL > 0 or bool(os.environ.get("AIVA_ADMIN_TOKEN"))
+
+# knowledge base ที่ใช้ตอบคำถาม สลับทั้งก้อนตอน reload (request ที่กำลังทำงานใช้ snapshot เดิมต่อได้)
+KnowledgeSnapshot = namedtuple("KnowledgeSnapshot", "index faq_data faq_matcher corpus_version")
+
+# ผลการค้นหาของคำถามหนึ่งข้อ ผูกกับ index/version ที่ใช้ค้นหา เพื่อไม่ให้ chunk id ปนกันถ้า reload ระหว่างตอบ
+Retrieved = namedtuple("Retrieved", "index hits corpus_version")
+
+
+class StreamInterrupted(Exception):
+    """โมเดลล้มเหลวหลังส่ง token ไปแล้ว ส่วนที่ส่งไปเป็นคำตอบที่ไม่ครบ"""
+
+
 class PdfAIEngine:
-    def __init__(self, pdf_folder_path: str, api_key: str):
+    def __init__(self, pdf_folder_path: str, api_key: str, kb_store_path: str = None, keep_segments: bool = None,
+                 extract_workers: int = None):
         logger.info("Initializing PdfAIEngine...")
-        self.knowledge_base = ""
+        self.knowledge = KnowledgeSnapshot(None, [], FaqMatcher([]), None)
         self.client = None
-        self.faq_data = []
+        self.pdf_folder_path = pdf_folder_path
+        self._segments = {}     # path -> (size/mtime, text, analyzed) ใช้ซ้ำตอน reload ถ้าไฟล์ไม่เปลี่ยน
+        self.keep_segments = KEEP_SEGMENTS if keep_segments is None else keep_segments
+        self.extract_workers = EXTRACT_WORKERS if extract_workers is None else extract_workers
+        self._reload_lock = threading.Lock()
+        self._reload_lock_pid = os.getpid()
+        self._watcher_pid = None
+        self._watcher_stop = None
+
+        # จำสถานะ 429/timeout/latency ของแต่ละโมเดล เพื่อข้ามโมเดลที่ใช้ไม่ได้ชั่วคราว
+        self.router = ModelRouter(MODELS_TO_TRY)
+        self.hedging = HEDGE_ENABLED
+        self.hedge_budget = HedgeBudget(HEDGE_BUDGET)
+        self.single_flight = SingleFlight() if COALESCE_ENABLED else None
 
         # ใช้ API Key จาก parameter หรือ environment variable
-        final_api_key = api_key or os.environ.get("GROQ_API_KEY", "")
+        self.api_key = api_key or os.environ.get("GROQ_API_KEY", "")
 
-        # โหลด FAQ
-        self._load_faq()
+        # ไฟล์ store ที่แชร์ระหว่าง workers (ถ้าไม่ตั้งค่า จะ build index ไว้ใน process นี้)
+        self.kb_store_path = kb_store_path or os.environ.get("AIVA_KB_STORE") or None
 
-        if not os.path.isdir(pdf_folder_path):
-            self.knowledge_base = "ไม่พบโฟลเดอร์ข้อมูล"
-            logger.error(f"PDF folder not found: {pdf_folder_path}")
-        else:
-            logger.info(f"Loading knowledge base from: {pdf_folder_path}")
-            self.knowledge_base = self._extract_text_from_folder(pdf_folder_path)
-            logger.info(f"Knowledge base loaded successfully ({len(self.knowledge_base)} characters)")
+        self.knowledge = self._load_knowledge(pdf_folder_path)
+        self._init_answer_cache()
+        self.connect_client()
+        if RELOAD_INTERVAL > 0 and not PRELOAD:
+            self.start_watcher(RELOAD_INTERVAL)
 
-        if not final_api_key:
+    def connect_client(self):
+        """สร้าง Groq client (เรียกซ้ำได้หลัง fork เมื่อใช้ gunicorn preload)"""
+        if not self.api_key:
             logger.error("GROQ_API_KEY not found")
             return
 
         try:
             self.client = OpenAI(
-                base_url="https://api.groq.com/openai/v1",
-                api_key=final_api_key,
+                base_url=GROQ_BASE_URL,
+                api_key=self.api_key,
                 max_retries=0,  # Disable automatic retries to prevent worker timeout
                 timeout=30.0    # Set request timeout to 30 seconds
             )
@@ -46,125 +136,296 @@ class PdfAIEngine:
             logger.error(f"Groq initialization error: {e}", exc_info=True)
             self.client = None
 
-    def _load_faq(self):
-        """โหลดข้อมูล FAQ จากไฟล์ faq.json"""
-        faq_file = "faq.json"
+    def _init_answer_cache(self):
+        """cache คำตอบจาก AI ที่แชร์ระหว่าง workers (ปิดได้ด้วย AIVA_ANSWER_CACHE=0)"""
+        self.answer_cache = None
+        if os.environ.get("AIVA_ANSWER_CACHE", "1") != "1":
+            return
         try:
-            if os.path.exists(faq_file):
-                with open(faq_file, 'r', encoding='utf-8') as f:
-                    self.faq_data = json.load(f)
-                logger.info(f"FAQ loaded successfully ({len(self.faq_data)} entries)")
-            else:
-                logger.warning(f"FAQ file not found: {faq_file}")
+            self.answer_cache = AnswerCache(
+                max_entries=int(os.environ.get("AIVA_ANSWER_CACHE_SIZE", "5000")),
+                ttl=float(os.environ.get("AIVA_ANSWER_CACHE_TTL", str(24 * 3600))),
+            )
+            self.answer_cache.invalidate_other_versions(self.corpus_version)
+            logger.info(f"Answer cache ready: {self.answer_cache.path}")
         except Exception as e:
-            logger.error(f"Error loading FAQ: {e}", exc_info=True)
-            self.faq_data = []
+            logger.error(f"Answer cache unavailable: {e}", exc_info=True)
+            self.answer_cache = None
 
-    def _check_faq(self, question: str) -> str:
-        """ตรวจสอบว่าคำถามตรงกับ FAQ หรือไม่"""
-        question_lower = question.lower().strip()
+    # ข้อมูลใน snapshot ปัจจุบัน (setter แทนที่ทั้ง snapshot)
+    @property
+    def index(self):
+        return self.knowledge.index
 
-        for faq in self.faq_data:
-            keywords = faq.get("keywords", [])
-            for keyword in keywords:
-                if keyword.lower() in question_lower:
-                    answer = faq.get("answer", "")
-                    logger.info(f"FAQ match found for keyword: '{keyword}'")
-                    logger.debug(f"FAQ answer: {answer[:100]}...")
-                    return answer
+    @index.setter
+    def index(self, value):
+        self.knowledge = self.knowledge._replace(index=value)
 
-        logger.debug("No FAQ match found")
-        return None
+    @property
+    def faq_data(self):
+        return self.knowledge.faq_data
 
-    def _extract_text_from_folder(self, folder_path: str) -> str:
-        all_text = ""
-        pdf_count = 0
-        txt_count = 0
+    @faq_data.setter
+    def faq_data(self, value):
+        self.knowledge = self.knowledge._replace(faq_data=value)
 
-        # 1. อ่าน PDF
-        pdf_files = glob.glob(os.path.join(folder_path, '*.pdf'))
-        logger.debug(f"Found {len(pdf_files)} PDF files")
-        for pdf_path in pdf_files:
-            try:
-                with pdfplumber.open(pdf_path) as pdf:
-                    for page in pdf.pages:
-                        t = page.extract_text()
-                        if t: all_text += t + "\n"
-                pdf_count += 1
-                logger.debug(f"Extracted text from PDF: {os.path.basename(pdf_path)}")
-            except Exception as e:
-                logger.warning(f"Failed to extract PDF {pdf_path}: {e}")
+    @property
+    def faq_matcher(self):
+        return self.knowledge.faq_matcher
+
+    @faq_matcher.setter
+    def faq_matcher(self, value):
+        self.knowledge = self.knowledge._replace(faq_matcher=value)
+
+    @property
+    def corpus_version(self):
+        return self.knowledge.corpus_version
 
-        # 2. อ่าน TXT
-        txt_files = glob.glob(os.path.join(folder_path, '*.txt'))
-        logger.debug(f"Found {len(txt_files)} TXT files")
-        for txt_path in txt_files:
+    @corpus_version.setter
+    def corpus_version(self, value):
+        self.knowledge = self.knowledge._replace(corpus_version=value)
+
+    @property
+    def knowledge_base(self) -> str:
+        return self.index.full_text() if self.index else ""
+
+    def _load_knowledge(self, pdf_folder_path: str) -> KnowledgeSnapshot:
+        """โหลด knowledge base + FAQ จาก shared store (mmap) หรือ build ใน process นี้"""
+        corpus_version = corpus_fingerprint(pdf_folder_path, FAQ_FILE)
+        index = None
+
+        if self.kb_store_path:
             try:
-                with open(txt_path, 'r', encoding='utf-8') as f:
-                    all_text += f.read() + "\n"
-                txt_count += 1
-                logger.debug(f"Extracted text from TXT: {os.path.basename(txt_path)}")
+                store = load_or_build(self.kb_store_path, corpus_version,
+                                      lambda: self._build_knowledge(pdf_folder_path))
+                index, faq_data = store.index, store.faq_data
+                logger.info(f"Knowledge base mapped from store ({index.n_chars} characters, "
+                            f"{len(faq_data)} FAQ entries)")
             except Exception as e:
-                logger.warning(f"Failed to extract TXT {txt_path}: {e}")
+                logger.error(f"Knowledge base store unavailable, building in-process: {e}", exc_info=True)
+                index = None
 
-        logger.info(f"Extracted {pdf_count} PDFs and {txt_count} TXT files")
-        return all_text if all_text else "ไม่มีข้อมูล"
+        if index is None:
+            index, faq_data = self._build_knowledge(pdf_folder_path)
 
-    def _get_relevant_context(self, question: str, max_chars=6000) -> str:
-        """ เลือกข้อมูลที่เกี่ยวข้อง เพื่อส่งให้ AI (ลดขนาดข้อมูลป้องกัน Error) """
-        full_text = self.knowledge_base
-        logger.debug(f"Full knowledge base size: {len(full_text)} chars")
+        # automaton ของ keyword FAQ สร้างครั้งเดียวต่อ snapshot
+        return KnowledgeSnapshot(index, faq_data, FaqMatcher(faq_data), corpus_version)
 
-        if len(full_text) < max_chars:
-            logger.debug("Using full knowledge base (smaller than max_chars)")
-            return full_text
-
-        chunk_size = 1000
-        chunks = [full_text[i:i+chunk_size] for i in range(0, len(full_text), chunk_size)]
-        logger.debug(f"Split knowledge base into {len(chunks)} chunks")
+    def _build_knowledge(self, pdf_folder_path: str):
+        # โหลด FAQ
+        faq_data = self._load_faq()
 
-        scored_chunks = []
-        for i, chunk in enumerate(chunks):
-            score = 0
-            if question in chunk: score += 10
+        if not os.path.isdir(pdf_folder_path):
+            parts = []
+            knowledge_base = "ไม่พบโฟลเดอร์ข้อมูล"
+            logger.error(f"PDF folder not found: {pdf_folder_path}")
+        else:
+            logger.info(f"Loading knowledge base from: {pdf_folder_path}")
+            parts = self._extract_segments(pdf_folder_path)
+            knowledge_base = "ไม่มีข้อมูล"
+            logger.info(f"Knowledge base loaded successfully ({sum(len(text) for text, _ in parts)} characters)")
 
-            keywords = question.split()
-            for k in keywords:
-                if len(k) > 2 and k in chunk:
-                    score += 1
+        if not parts:
+            parts = [(knowledge_base, RetrievalIndex.analyze(knowledge_base))]
+        # สร้าง retrieval index ครั้งเดียวตอนโหลด (ไม่ต้องหั่น chunk ใหม่ทุก request)
+        return RetrievalIndex.from_parts(parts), faq_data
 
-            if i == 0: score += 2
+    def _load_faq(self) -> list:
+        """โหลดข้อมูล FAQ จากไฟล์ faq.json"""
+        faq_file = FAQ_FILE
+        try:
+            if os.path.exists(faq_file):
+                with open(faq_file, 'r', encoding='utf-8') as f:
+                    faq_data = json.load(f)
+                logger.info(f"FAQ loaded successfully ({len(faq_data)} entries)")
+                return faq_data
+            logger.warning(f"FAQ file not found: {faq_file}")
+        except Exception as e:
+            logger.error(f"Error loading FAQ: {e}", exc_info=True)
+        return []
 
-            scored_chunks.append((score, i, chunk))
+    def _check_faq(self, question: str) -> str:
+        """ตรวจสอบว่าคำถามตรงกับ FAQ หรือไม่"""
+        found = self.faq_matcher.match(question.strip())
+        if found:
+            faq, keyword = found
+            answer = faq.get("answer", "")
+            logger.info(f"FAQ match found for keyword: '{keyword}'")
+            logger.debug(f"FAQ answer: {answer[:100]}...")
+            return answer
 
-        scored_chunks.sort(key=lambda x: x[0], reverse=True)
-        top_chunks = scored_chunks[:8]
-        top_chunks.sort(key=lambda x: x[1])
+        logger.debug("No FAQ match found")
+        return None
 
-        selected_text = "\n...\n".join([chunk for _, _, chunk in top_chunks])
-        logger.debug(f"Selected context size: {len(selected_text)} chars from {len(top_chunks)} chunks")
-        return selected_text
+    def _extract_segments(self, folder_path: str) -> list:
+        """อ่านไฟล์ PDF/TXT เป็นส่วนๆ ต่อไฟล์ [(text, analyzed), ...]
 
-    def find_answer(self, user_question: str) -> str:
-        logger.info(f"Processing question: {user_question}")
+        ไฟล์ที่ size/mtime ไม่เปลี่ยนตั้งแต่ครั้งก่อนใช้ผลเดิม (ไม่ต้องดึงข้อความ/ตัด token ใหม่)
+        ผลเดิมเก็บไว้เฉพาะเมื่อ keep_segments (มี watcher หรือ /admin/reload) ไม่อย่างนั้น reload จะตัด token ใหม่ทุกไฟล์
+        """
+        text_cache = ExtractedTextCache()
+        pdf_files = sorted(glob.glob(os.path.join(folder_path, '*.pdf')))
+        txt_files = sorted(glob.glob(os.path.join(folder_path, '*.txt')))
+        logger.debug(f"Found {len(pdf_files)} PDF files and {len(txt_files)} TXT files")
+
+        segments = {}
+        changed = []
+        for path in pdf_files + txt_files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stat_key = (st.st_size, st.st_mtime_ns)
+            cached = self._segments.get(path)
+            if cached and cached[0] == stat_key:
+                segments[path] = cached
+            else:
+                changed.append((path, stat_key))
+        reused = len(segments)
+
+        # PDF ที่ไม่มีใน text cache ดึงพร้อมกันด้วย process pool
+        pdf_texts = self._extract_pdfs([path for path, _ in changed if path.lower().endswith('.pdf')], text_cache)
+        for path, stat_key in changed:
+            if path.lower().endswith('.pdf'):
+                raw_text = pdf_texts.get(path)
+                if raw_text is None:
+                    continue
+            else:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        raw_text = f.read()
+                    logger.debug(f"Extracted text from TXT: {os.path.basename(path)}")
+                except Exception as e:
+                    logger.warning(f"Failed to extract {path}: {e}")
+                    continue
+            text = wrap_source(os.path.basename(path), raw_text)
+            segments[path] = (stat_key, text, RetrievalIndex.analyze(text))
+
+        text_cache.save()
+        if pdf_files:
+            logger.info(f"PDF text cache: {text_cache.hits} hits, {text_cache.misses} re-extracted")
+        # เรียงตามชื่อไฟล์เสมอ และไฟล์ที่ถูกลบจะหายไปจาก cache ด้วย
+        segments = {path: segments[path] for path in pdf_files + txt_files if path in segments}
+        self._segments = segments if self.keep_segments else {}
+        logger.info(f"Extracted {len(segments)} files ({reused} unchanged, {len(segments) - reused} re-indexed)")
+        return [(text, analyzed) for _, text, analyzed in segments.values()]
+
+    def _extract_pdfs(self, pdf_paths: list, text_cache: ExtractedTextCache) -> dict:
+        """ข้อความของ PDF แต่ละไฟล์ {path: text} (ใช้ข้อความจาก cache ถ้าไฟล์ไม่เปลี่ยน)"""
+        texts = {}
+        missing = []
+        for path in pdf_paths:
+            cached = text_cache.get(path)
+            if cached is None:
+                missing.append(path)
+            else:
+                logger.debug(f"Loaded cached text for PDF: {os.path.basename(path)}")
+                texts[path] = cached
 
-        # ตรวจสอบ FAQ ก่อน (ตอบเร็วกว่า ไม่ต้องเรียก AI)
-        faq_answer = self._check_faq(user_question)
-        if faq_answer:
-            logger.info("Answered from FAQ (no AI call needed)")
-            return faq_answer
+        for path, result in extract_pdfs(missing, workers=self.extract_workers).items():
+            # ไฟล์ที่มีหน้าดึงไม่สำเร็จไม่เก็บลง cache เพื่อให้ลองใหม่ครั้งหน้า
+            if not result.failed:
+                text_cache.put(path, result.text)
+            texts[path] = result.text
+        return texts
 
-        if not self.client:
-            logger.error("AI client not initialized")
-            return "ระบบ AI ขัดข้อง"
+    def reload(self, force: bool = False) -> bool:
+        """build knowledge base ใหม่ถ้าไฟล์เปลี่ยน แล้วสลับเข้าใช้งานทันที คืน True ถ้าสลับแล้ว
 
-        context = self._get_relevant_context(user_question)
-        logger.info(f"Calling AI with context ({len(context)} chars)...")
-        
+        ระหว่าง build request อื่นยังตอบด้วย snapshot เดิมได้ตามปกติ (ไม่มี lock บนเส้นทางของ request)
+        """
+        self._check_fork()
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info("Knowledge base reload already in progress")
+            return False
+        try:
+            corpus_version = corpus_fingerprint(self.pdf_folder_path, FAQ_FILE)
+            if corpus_version == self.corpus_version and not force:
+                return False
+            started = time.perf_counter()
+            old_version = self.corpus_version
+            knowledge = self._load_knowledge(self.pdf_folder_path)
+            self.knowledge = knowledge
+            if self.answer_cache:
+                self.answer_cache.invalidate_other_versions(knowledge.corpus_version)
+            logger.info(f"Knowledge base reloaded: {old_version} -> {knowledge.corpus_version} "
+                        f"in {time.perf_counter() - started:.2f}s")
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def _check_fork(self):
+        # lock ที่ติดมาจาก process แม่อาจถูกถือค้างโดย thread ที่ไม่มีใน process นี้ (reload ค้างตลอดไป)
+        if self._reload_lock_pid != os.getpid():
+            self._reload_lock = threading.Lock()
+            self._reload_lock_pid = os.getpid()
+
+    def start_watcher(self, interval: float = RELOAD_INTERVAL):
+        """เฝ้าดูไฟล์ข้อมูลและ faq.json (เช็คแค่ stat) แล้ว reload เมื่อมีการเปลี่ยนแปลง
+
+        thread ไม่ติดไปหลัง fork จึงเรียกซ้ำใน worker ได้ (เริ่มครั้งเดียวต่อ process)
+        """
+        self._check_fork()
+        if interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        self._watcher_stop = stop = threading.Event()
+        # reload ครั้งแรกยังตัด token ใหม่ทุกไฟล์ (ถ้าตอนโหลดไม่ได้เก็บไว้) ครั้งต่อไปใช้ผลเดิม
+        self.keep_segments = True
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Knowledge base reload failed: {e}", exc_info=True)
+
+        threading.Thread(target=watch, daemon=True, name="kb-watcher").start()
+        logger.info(f"Watching {self.pdf_folder_path} and {FAQ_FILE} for changes every {interval}s")
+
+    def stop_watcher(self):
+        """หยุด thread เฝ้าดูไฟล์ของ process นี้ (เรียก start_watcher ใหม่ได้)"""
+        if self._watcher_pid == os.getpid() and self._watcher_stop:
+            self._watcher_stop.set()
+        self._watcher_pid = None
+
+    def _get_relevant_context(self, question: str, max_chars=FULL_CONTEXT_CHARS) -> Retrieved:
+        """ เลือกข้อมูลที่เกี่ยวข้อง คืน [(score, chunk_id)] ให้ prompt builder เลือกตามงบ token """
+        with metrics.timer("aiva_stage_seconds", stage="retrieval"):
+            return self._retrieve(question, max_chars)
+
+    def _retrieve(self, question: str, max_chars: int) -> Retrieved:
+        knowledge = self.knowledge
+        index = knowledge.index
+        logger.debug(f"Full knowledge base size: {index.n_chars} chars")
+
+        if index.n_chars < max_chars:
+            logger.debug("Using full knowledge base (smaller than max_chars)")
+            return Retrieved(index, [(0.0, i) for i in range(len(index))], knowledge.corpus_version)
+
+        hits = self._fallback_hits(index, index.search(question, top_k=RETRIEVE_TOP_K))
+        return Retrieved(index, hits, knowledge.corpus_version)
+
+    def _fallback_hits(self, index, hits: list) -> list:
+        if not hits:
+            # ไม่มี term ตรงเลย ใช้ส่วนต้นของ knowledge base แทน
+            return [(0.0, i) for i in range(min(8, len(index)))]
+        logger.debug(f"Retrieved {len(hits)} of {len(index)} chunks from index")
+        return hits
+
+    def _prepare_prompt(self, user_question: str, retrieved: Retrieved, model: str) -> str:
+        """system prompt ของ model นี้ (context ตามงบ token ของโมเดล)"""
+        plan = build_prompt(retrieved.index, retrieved.hits, model,
+                            lambda context: self._build_system_prompt(context, user_question), user_question)
+        logger.info(f"Prompt for {model}: ~{plan.prompt_tokens} tokens (context ~{plan.context_tokens}, "
+                    f"{len(plan.chunk_ids)}/{len(retrieved.hits)} chunks, budget {plan.budget})")
+        return plan.system_prompt
+
+    def _build_system_prompt(self, context: str, user_question: str) -> str:
         # ==================================================================================
         # ⭐ PROMPT: บทบาทเจ้าหน้าที่ประชาสัมพันธ์วิทยาลัยพณิชยการธนบุรี
         # ==================================================================================
-        system_prompt = f"""
+        return textwrap.dedent("""
         บทบาท: คุณคือเจ้าหน้าที่ประชาสัมพันธ์หญิง ของ "วิทยาลัยพณิชยการธนบุรี"
         บุคลิก: พูดจาสุภาพ เป็นมิตร กระชับ และช่วยเหลือผู้คน
 
@@ -188,19 +449,91 @@ class PdfAIEngine:
         
         ผู้ใช้ถามว่า: {user_question}
         คำตอบของคุณ:
+        """).strip().format(context=context, user_question=user_question)
+
+    def _quick_answer(self, user_question: str):
+        """คำตอบที่ไม่ต้องเรียก AI: FAQ ก่อน แล้วจึง answer cache คืน (answer, source) หรือ (None, None)"""
+        # ตรวจสอบ FAQ ก่อน (ตอบเร็วกว่า ไม่ต้องเรียก AI)
+        with metrics.timer("aiva_stage_seconds", stage="faq"):
+            faq_answer = self._check_faq(user_question)
+        if faq_answer:
+            logger.info("Answered from FAQ (no AI call needed)")
+            metrics.inc("aiva_answers_total", source="faq")
+            return faq_answer, "faq"
+
+        # คำถามซ้ำ (ไม่ตรง FAQ) ที่เคยถาม AI แล้ว ใช้คำตอบเดิมจาก cache
+        if self.answer_cache:
+            with metrics.timer("aiva_stage_seconds", stage="answer_cache"):
+                cached_answer = self.answer_cache.get(user_question, self.corpus_version)
+            if cached_answer:
+                logger.info("Answered from answer cache (no AI call needed)")
+                metrics.inc("aiva_answers_total", source="cache")
+                return cached_answer, "cache"
+        return None, None
+
+    def find_answer(self, user_question: str) -> str:
+        logger.info(f"Processing question: {user_question}")
+
+        quick_answer, _ = self._quick_answer(user_question)
+        if quick_answer:
+            return quick_answer
+
+        if not self.client:
+            logger.error("AI client not initialized")
+            return NO_CLIENT_ANSWER
+
+        answer, _ = self._coalesced_answer(user_question, lambda: self._get_relevant_context(user_question))
+        return answer
+
+    def _coalesced_answer(self, user_question: str, get_hits) -> tuple:
+        """เรียก AI ครั้งเดียวสำหรับคำถามเดียวกันที่กำลังรอคำตอบอยู่ (get_hits -> Retrieved เรียกเฉพาะตอนต้องถาม AI จริง)
+
+        คืน (answer, source): "ai" ถ้า request นี้เรียก AI เอง, "coalesced" ถ้าได้คำตอบจาก request อื่น
         """
-        
-        # รายชื่อโมเดลที่จะลองใช้ (ระบบ Auto-Switch แก้ Error 429)
-        models_to_try = [
-            "llama-3.3-70b-versatile",   # ตัวหลัก (ฉลาดสุด)
-            "llama-3.1-8b-instant",      # ตัวรอง (เร็ว/โควต้าเยอะ)
-            "gemma2-9b-it"               # ตัวสำรองสุดท้าย
-        ]
-
-        retry_delay = 0.5  # Start with 0.5 seconds
-        for model_index, model in enumerate(models_to_try):
+        if self.single_flight is None:
+            return self._ask_models(user_question, get_hits()), "ai"
+        key = f"{self.corpus_version}\0{normalize_question(user_question) or user_question}"
+        (answer, source), shared = self.single_flight.do(
+            key, lambda: self._answer_across_workers(key, user_question, get_hits))
+        if shared:
+            logger.info("Answer shared with an in-flight request for the same question")
+            metrics.inc("aiva_answers_total", source="coalesced")
+            return answer, "coalesced"
+        return answer, source
+
+    def _answer_across_workers(self, key: str, user_question: str, get_hits) -> tuple:
+        if not (COALESCE_WORKERS and self.answer_cache):
+            return self._ask_models(user_question, get_hits()), "ai"
+        lock_dir = os.path.join(os.path.dirname(self.answer_cache.path), "inflight")
+        with worker_lock(lock_dir, key):
+            # worker อื่นอาจตอบคำถามนี้เสร็จระหว่างที่รอ lock
+            cached = self.answer_cache.get(user_question, self.corpus_version, count_miss=False)
+            if cached:
+                logger.info("Answered by another worker's in-flight request (no AI call needed)")
+                metrics.inc("aiva_answers_total", source="coalesced")
+                return cached, "coalesced"
+            return self._ask_models(user_question, get_hits()), "ai"
+
+    def _ask_models(self, user_question: str, retrieved: Retrieved) -> str:
+        """เรียก AI ตามลำดับ MODELS_TO_TRY จนกว่าจะได้คำตอบ (คำตอบที่ได้จะถูกเก็บใน answer cache)"""
+        logger.info(f"Calling AI with {len(retrieved.hits)} candidate chunks...")
+        if self.hedging:
+            try:
+                return "".join(self._hedged_deltas(user_question, retrieved)).strip()
+            except StreamInterrupted:
+                return ERROR_ANSWER
+
+        models_to_try = self.router.candidates()
+        if len(models_to_try) < len(MODELS_TO_TRY):
+            logger.info(f"Skipping models with open circuit; available: {models_to_try}")
+
+        last_error = None
+        for model in models_to_try:
+            started = time.perf_counter()
             try:
                 logger.info(f"Trying AI model: {model}")
+                system_prompt = self._prepare_prompt(user_question, retrieved, model)
+                started = time.perf_counter()
                 chat_completion = self.client.chat.completions.create(
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -211,29 +544,216 @@ class PdfAIEngine:
                     max_tokens=400,
                 )
                 answer = chat_completion.choices[0].message.content.strip()
-                logger.info(f"AI response received from {model} ({len(answer)} chars)")
+                self.router.record_success(model, time.perf_counter() - started)
+                metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome="ok")
+                metrics.inc("aiva_answers_total", source="ai")
+                logger.info(f"AI response received from {model} ({len(answer)} chars)",
+                            extra={"stage": "llm", "duration_ms": (time.perf_counter() - started) * 1000})
                 logger.debug(f"AI answer preview: {answer[:100]}...")
+                if self.answer_cache and answer:
+                    self.answer_cache.put(user_question, retrieved.corpus_version, answer)
                 return answer
 
             except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "rate_limit" in error_msg.lower():
-                    logger.warning(f"Model {model} quota exceeded (429) - switching to backup model")
-                    # Only sleep if there are more models to try
-                    if model_index < len(models_to_try) - 1:
-                        logger.info(f"Waiting {retry_delay}s before trying next model...")
-                        time.sleep(retry_delay)
-                        retry_delay = min(retry_delay * 2, 3)  # Exponential backoff, max 3s
-                    continue
-                elif "timeout" in error_msg.lower():
-                    logger.error(f"Timeout with model {model} - trying next model")
-                    continue
-                else:
-                    logger.error(f"API error with model {model}: {error_msg}", exc_info=True)
-                    # Try next model instead of returning immediately
-                    if model_index < len(models_to_try) - 1:
-                        continue
-                    return "ขออภัย ระบบขัดข้องชั่วคราว"
+                # ไม่ต้องรอ: โมเดลที่โดน 429 ถูกปิดไว้ใน router แล้ว ไปโมเดลถัดไปทันที
+                last_error = self._record_model_failure(model, e)
+                metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome=last_error)
 
+        metrics.inc("aiva_answers_total", source="unavailable")
+        if last_error == "error":
+            return ERROR_ANSWER
+        logger.error("All AI models exhausted - quota limit reached")
+        return BUSY_ANSWER
+
+    def _open_stream(self, user_question: str, retrieved: Retrieved, model: str):
+        system_prompt = self._prepare_prompt(user_question, retrieved, model)
+        return self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_question}
+            ],
+            model=model,
+            temperature=0.5,
+            max_tokens=400,
+            stream=True,
+        )
+
+    def _hedge_delay(self, model: str) -> float:
+        delay = self.router.first_token_percentile(model, HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT_DELAY if delay is None else max(HEDGE_MIN_DELAY, delay)
+
+    def _hedged_deltas(self, user_question: str, retrieved: Retrieved):
+        """yield token จากโมเดลที่ตอบก่อน (hedged) คำตอบที่ครบถูกเก็บใน answer cache"""
+        parts = []
+        started = time.perf_counter()
+        for model, delta in hedged_stream(lambda m: self._open_stream(user_question, retrieved, m),
+                                          self.router.candidates(), self._hedge_delay,
+                                          self.hedge_budget, self.router, self._record_model_failure):
+            if delta is None:
+                answer = "".join(parts).strip()
+                logger.info(f"AI stream completed from {model} ({len(answer)} chars)",
+                            extra={"stage": "llm", "duration_ms": (time.perf_counter() - started) * 1000})
+                metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome="ok")
+                metrics.inc("aiva_answers_total", source="ai")
+                if self.answer_cache and answer:
+                    self.answer_cache.put(user_question, retrieved.corpus_version, answer)
+                return
+            if not parts:
+                metrics.observe("aiva_llm_first_token_seconds", time.perf_counter() - started, model=model)
+            parts.append(delta)
+            yield delta
+
+        metrics.inc("aiva_answers_total", source="unavailable")
+        if parts:
+            # hedged_stream จบโดยไม่มีเครื่องหมายครบ: โมเดลที่ชนะล้มเหลวกลางคำตอบ (ไม่เก็บลง cache)
+            logger.error(f"Hedged stream failed after {len(parts)} deltas - answer is incomplete")
+            raise StreamInterrupted("model failed after the first token")
+        logger.error("All AI models exhausted - quota limit reached")
+        yield BUSY_ANSWER
+
+    def _record_model_failure(self, model: str, error: Exception) -> str:
+        kind = self.router.record_failure(model, error)
+        metrics.inc("aiva_model_failures_total", model=model, kind=kind)
+        if kind == "rate_limit":
+            logger.warning(f"Model {model} quota exceeded (429) - switching to backup model")
+        elif kind == "timeout":
+            logger.error(f"Timeout with model {model} - trying next model")
+        else:
+            logger.error(f"API error with model {model}: {error}", exc_info=True)
+        return kind
+
+    def find_answers(self, questions: list, max_workers: int = BATCH_MAX_WORKERS) -> list:
+        """ตอบคำถามหลายข้อในครั้งเดียว คืน list ของ dict ตามลำดับ questions
+
+        - คำถามที่ซ้ำกัน (หลัง normalize) ถามโมเดลครั้งเดียว
+        - คำถามที่ต้องเรียก AI ค้นหา context พร้อมกันด้วย index.search_many
+        - เรียก AI พร้อมกันไม่เกิน max_workers คำถาม
+        แต่ละผลลัพธ์: {"question", "answer", "source": faq/cache/ai/coalesced/error, "elapsed_ms"}
+        """
+        logger.info(f"Processing batch of {len(questions)} questions")
+        unique = {}    # normalized question -> index ใน questions ของคำถามแรก
+        owner = []     # index ใน questions -> index ของคำถามแรกที่ซ้ำกัน
+        for i, question in enumerate(questions):
+            owner.append(unique.setdefault(normalize_question(question) or question, i))
+
+        results = {}
+        pending = []
+        for i in sorted(set(owner)):
+            started = time.perf_counter()
+            answer, source = self._quick_answer(questions[i])
+            if answer:
+                results[i] = (answer, source, time.perf_counter() - started)
+            elif not self.client:
+                results[i] = (NO_CLIENT_ANSWER, "error", 0.0)
+            else:
+                pending.append(i)
+
+        if pending:
+            started = time.perf_counter()
+            pending_questions = [questions[i] for i in pending]
+            knowledge = self.knowledge
+            index = knowledge.index
+            if index.n_chars < FULL_CONTEXT_CHARS:
+                candidates = [self._get_relevant_context(q) for q in pending_questions]
+            else:
+                with metrics.timer("aiva_stage_seconds", stage="retrieval_batch"):
+                    candidates = [Retrieved(index, self._fallback_hits(index, hits), knowledge.corpus_version)
+                                  for hits in index.search_many(pending_questions, top_k=RETRIEVE_TOP_K)]
+            search_time = (time.perf_counter() - started) / len(pending)
+            logger.info(f"Batch retrieval for {len(pending)} questions took {search_time * len(pending):.3f}s")
+
+            def ask(args):
+                question, retrieved = args
+                started = time.perf_counter()
+                answer, source = self._coalesced_answer(question, lambda: retrieved)
+                return answer, source, time.perf_counter() - started + search_time
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+                # ส่ง context (request id ของ log) ของ request ไปกับงานทุกชิ้น
+                futures = [pool.submit(contextvars.copy_context().run, ask, args)
+                           for args in zip(pending_questions, candidates)]
+                for i, future in zip(pending, futures):
+                    answer, source, elapsed = future.result()
+                    # ข้อความ "ระบบขัดข้อง/ผู้ใช้งานจำนวนมาก" ไม่ใช่คำตอบจาก AI
+                    results[i] = (answer, "error" if answer in FALLBACK_ANSWERS else source, elapsed)
+
+        output = []
+        for i, question in enumerate(questions):
+            answer, source, elapsed = results[owner[i]]
+            output.append({
+                "question": question,
+                "answer": answer,
+                "source": source,
+                "elapsed_ms": round(elapsed * 1000, 1),
+            })
+        return output
+
+    def stream_answer(self, user_question: str):
+        """เหมือน find_answer แต่ yield คำตอบทีละส่วน (token streaming) เพื่อให้หน้าจอแสดงผลได้เร็ว
+
+        FAQ/cache ตอบทันทีเป็นก้อนเดียว ถ้าโมเดลล้มเหลวก่อนส่ง token แรกจะสลับไปโมเดลถัดไป
+        แต่ถ้าส่ง token ไปแล้ว จะ raise StreamInterrupted (ไม่สามารถเริ่มคำตอบใหม่ได้ ผู้เรียกต้องแจ้งว่าคำตอบไม่ครบ)
+        """
+        logger.info(f"Processing question (stream): {user_question}")
+
+        quick_answer, _ = self._quick_answer(user_question)
+        if quick_answer:
+            yield quick_answer
+            return
+
+        if not self.client:
+            logger.error("AI client not initialized")
+            yield NO_CLIENT_ANSWER
+            return
+
+        retrieved = self._get_relevant_context(user_question)
+        logger.info(f"Streaming AI answer with {len(retrieved.hits)} candidate chunks...")
+        if self.hedging:
+            yield from self._hedged_deltas(user_question, retrieved)
+            return
+
+        for model in self.router.candidates():
+            parts = []
+            first_token = None
+            started = time.perf_counter()
+            try:
+                logger.info(f"Trying AI model (stream): {model}")
+                stream = self._open_stream(user_question, retrieved, model)
+                for event in stream:
+                    delta = event.choices[0].delta.content if event.choices else None
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            metrics.observe("aiva_llm_first_token_seconds", first_token, model=model)
+                        parts.append(delta)
+                        yield delta
+
+                answer = "".join(parts).strip()
+                if answer:
+                    self.router.record_success(model, time.perf_counter() - started, first_token)
+                    metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome="ok")
+                    metrics.inc("aiva_answers_total", source="ai")
+                    logger.info(f"AI stream completed from {model} ({len(answer)} chars)",
+                                extra={"stage": "llm", "duration_ms": (time.perf_counter() - started) * 1000})
+                    if self.answer_cache:
+                        self.answer_cache.put(user_question, retrieved.corpus_version, answer)
+                    return
+                logger.warning(f"Model {model} returned an empty stream - trying next model")
+
+            except Exception as e:
+                if parts:
+                    kind = self.router.record_failure(model, e)
+                    metrics.inc("aiva_model_failures_total", model=model, kind=kind)
+                    metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome=kind)
+                    logger.error(f"Stream from {model} failed after first token: {e}", exc_info=True)
+                    metrics.inc("aiva_answers_total", source="unavailable")
+                    raise StreamInterrupted(f"{model} failed after the first token") from e
+                kind = self._record_model_failure(model, e)
+                metrics.observe("aiva_llm_seconds", time.perf_counter() - started, model=model, outcome=kind)
+            finally:
+                # stream ว่างหรือผู้ใช้ตัดการเชื่อมต่อ (GeneratorExit) ไม่ได้รายงานผล: อย่าถือสิทธิ์ probe ค้างไว้
+                self.router.release_probe(model)
+
+        metrics.inc("aiva_answers_total", source="unavailable")
         logger.error("All AI models exhausted - quota limit reached")
-        return "ขออภัย ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณารอสักครู่แล้วลองใหม่"
\ No newline at end of file
+        yield BUSY_ANSWER
@@ -0,0 +1,171 @@
+"""
+AIVA - Parallel PDF Extraction
+ดึงข้อความจาก PDF ด้วย process pool (pdfplumber ใช้ CPU ล้วน จึงแบ่งงานข้าม core แทน thread)
+
+- แบ่งงานเป็นช่วงหน้า (PAGES_PER_TASK หน้าต่องาน) ไฟล์ใหญ่ไฟล์เดียวก็กระจายได้ทุก core
+- หน้าที่ดึงไม่สำเร็จได้ข้อความว่าง (เลขหน้ายังตรง) ไม่ทำให้ทั้งไฟล์หาย
+- ผลลัพธ์เรียงตามไฟล์/หน้าเสมอ ไม่ขึ้นกับลำดับที่งานเสร็จ
+- log ความคืบหน้าทุกช่วงหน้าที่เสร็จ (debug) และสรุปต่อไฟล์ (info)
+- สร้าง process pool เฉพาะตอนมี PDF ที่ต้องดึงจริง (ไม่อยู่ใน text cache) และปิดทันทีเมื่อดึงเสร็จ
+- process ลูกเริ่มด้วย forkserver (หรือ spawn) ไม่ fork จาก worker ที่มี thread ทำงานอยู่แล้ว (log/metrics/watcher)
+  process ลูกจะ import __main__ ซ้ำ: script ที่เรียกต้อง import ได้โดยไม่เริ่มระบบ (app.py ที่รันตรงจึงดึงแบบ serial ถ้าไม่ได้ตั้ง AIVA_EXTRACT_WORKERS)
+- ถ้าใช้ process pool ไม่ได้ ดึงทีละไฟล์ใน process เดิม
+"""
+import os
+import time
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+
+from chunker import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+# ค่าเริ่มต้นไม่เกิน 4 process: ไม่แย่ง CPU/หน่วยความจำจาก gunicorn workers ที่กำลังเริ่ม
+DEFAULT_MAX_WORKERS = 4
+EXTRACT_WORKERS = int(os.environ.get("AIVA_EXTRACT_WORKERS", "0")) or min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+PAGES_PER_TASK = int(os.environ.get("AIVA_EXTRACT_PAGES_PER_TASK", "8"))
+
+# text: หน้าของ PDF คั่นด้วย PAGE_BREAK, failed: เลขหน้า (เริ่มที่ 1) ที่ดึงไม่สำเร็จ
+PdfText = namedtuple("PdfText", "text pages failed seconds")
+
+
+def page_count(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_pages(path: str, start: int, stop: int):
+    """ดึงข้อความหน้า [start, stop) คืน (list ของข้อความ, list ของเลขหน้าที่ล้มเหลว, วินาที)"""
+    started = time.perf_counter()
+    texts = []
+    failed = []
+    with pdfplumber.open(path) as pdf:
+        for page_no in range(start, stop):
+            try:
+                texts.append(pdf.pages[page_no].extract_text() or "")
+            except Exception:
+                texts.append("")
+                failed.append(page_no + 1)
+    return texts, failed, time.perf_counter() - started
+
+
+def _join_pages(texts: list) -> str:
+    # หน้าว่างก็เก็บไว้ให้เลขหน้าตรง
+    return PAGE_BREAK.join(text + "\n" for text in texts)
+
+
+def _extract_serial(counts: dict, pages_per_task: int) -> dict:
+    results = {}
+    done, total = 0, sum(counts.values())
+    for path, n in counts.items():
+        texts, failed, seconds = [], [], 0.0
+        try:
+            for start in range(0, n, pages_per_task):
+                stop = min(start + pages_per_task, n)
+                part, part_failed, part_seconds = _extract_pages(path, start, stop)
+                texts += part
+                failed += part_failed
+                seconds += part_seconds
+                done += stop - start
+                _log_progress(path, start, stop, done, total)
+        except Exception as e:
+            logger.warning(f"Failed to extract {path}: {e}")
+            done += n - len(texts)
+            continue
+        results[path] = PdfText(_join_pages(texts), len(texts), failed, seconds)
+        _log_file(path, results[path])
+    return results
+
+
+def _log_progress(path: str, start: int, stop: int, done: int, total: int):
+    # ความคืบหน้าต่อช่วงหน้า (debug) ส่วนสรุปต่อไฟล์อยู่ใน _log_file
+    logger.debug(f"Extracted pages {start + 1}-{stop} of {os.path.basename(path)} ({done}/{total} pages)")
+
+
+def _log_file(path: str, result: PdfText):
+    message = f"Extracted {os.path.basename(path)}: {result.pages} pages in {result.seconds:.2f}s"
+    if result.failed:
+        logger.warning(f"{message} (failed pages: {result.failed})")
+    else:
+        logger.info(message)
+
+
+def extract_pdfs(paths: list, workers: int = EXTRACT_WORKERS, pages_per_task: int = PAGES_PER_TASK) -> dict:
+    """ดึงข้อความจาก PDF หลายไฟล์พร้อมกัน คืน {path: PdfText} (ไฟล์ที่เปิดไม่ได้จะไม่อยู่ในผลลัพธ์)"""
+    if not paths:
+        return {}
+    started = time.perf_counter()
+
+    counts = {}
+    for path in paths:
+        try:
+            counts[path] = page_count(path)
+        except Exception as e:
+            logger.warning(f"Failed to open {path}: {e}")
+    tasks = [(path, start, min(start + pages_per_task, n))
+             for path, n in counts.items() for start in range(0, n, pages_per_task)]
+
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        results = _extract_serial(counts, pages_per_task)
+    else:
+        try:
+            results = _extract_parallel(counts, tasks, workers)
+        except Exception as e:
+            logger.warning(f"Process pool unavailable, extracting PDFs serially: {e}")
+            results = _extract_serial(counts, pages_per_task)
+
+    total_pages = sum(r.pages for r in results.values())
+    logger.info(f"Extracted {len(results)} PDFs ({total_pages} pages) in {time.perf_counter() - started:.2f}s "
+                f"with {max(1, workers)} worker(s)")
+    return results
+
+
+def _pool_context():
+    """forkserver (Linux/macOS) หรือ spawn (Windows) แทน fork"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["pdf_extractor"])  # import pdfplumber ครั้งเดียวใน forkserver
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _extract_parallel(counts: dict, tasks: list, workers: int) -> dict:
+    pages = {path: [None] * n for path, n in counts.items()}
+    failed = {path: [] for path in counts}
+    seconds = {path: 0.0 for path in counts}
+    remaining = {path: 0 for path in counts}
+    for path, _, _ in tasks:
+        remaining[path] += 1
+    done, total = 0, sum(counts.values())
+
+    results = {path: PdfText("", 0, [], 0.0) for path, n in counts.items() if n == 0}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        futures = {pool.submit(_extract_pages, *task): task for task in tasks}
+        for future in as_completed(futures):
+            path, start, stop = futures[future]
+            try:
+                texts, task_failed, task_seconds = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                # ทั้งช่วงหน้าล้มเหลว (เช่น เปิดไฟล์ใน worker ไม่ได้) นับเป็นหน้าที่ล้มเหลว
+                logger.debug(f"Pages {start + 1}-{stop} of {path} failed: {e}")
+                texts, task_failed, task_seconds = [""] * (stop - start), list(range(start + 1, stop + 1)), 0.0
+            pages[path][start:stop] = texts
+            failed[path].extend(task_failed)
+            seconds[path] += task_seconds
+            remaining[path] -= 1
+            done += stop - start
+            _log_progress(path, start, stop, done, total)
+            if remaining[path] == 0:
+                results[path] = PdfText(_join_pages(pages[path]), counts[path], sorted(failed[path]), seconds[path])
+                _log_file(path, results[path])
+
+    # เรียงตามลำดับไฟล์ที่ส่งเข้ามา
+    return {path: results[path] for path in counts if path in results}
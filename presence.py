@@ -0,0 +1,44 @@
+"""
+AIVA - Presence Debounce
+แปลงผลตรวจจับคนรายเฟรมของกล้อง (vision.HumanDetector) เป็นเหตุการณ์คนมา/คนไป
+แยกจาก vision.py เพื่อให้ใช้/ทดสอบได้โดยไม่ต้องมี OpenCV
+"""
+
+
+class PresenceTracker:
+    """แปลงผลตรวจจับรายเฟรมเป็นเหตุการณ์ enter/leave (debounce)
+
+    enter: ตรวจเจอติดกัน enter_frames ครั้ง
+    leave: ไม่เจอเลยนาน leave_seconds หลังจากเจอครั้งล่าสุด
+    """
+
+    def __init__(self, enter_frames=2, leave_seconds=5.0):
+        self.enter_frames = enter_frames
+        self.leave_seconds = leave_seconds
+        self.present = False
+        self._hits = 0
+        self._last_seen = 0.0
+
+    @property
+    def confirming(self):
+        """เจอแล้วแต่ยังไม่ครบ enter_frames"""
+        return not self.present and self._hits > 0
+
+    def update(self, detected, now):
+        """คืน "enter", "leave" หรือ None"""
+        if detected:
+            self._last_seen = now
+            self._hits += 1
+            if not self.present and self._hits >= self.enter_frames:
+                self.present = True
+                return "enter"
+        else:
+            self._hits = 0
+            if self.present and now - self._last_seen >= self.leave_seconds:
+                self.present = False
+                return "leave"
+        return None
+
+    def next_interval(self, idle_interval, active_interval):
+        """รอกี่วินาทีก่อนตรวจครั้งถัดไป: ถี่เฉพาะตอนมีคนหรือกำลังยืนยันว่ามีคน ที่เหลือพักนาน"""
+        return active_interval if (self.present or self.confirming) else idle_interval
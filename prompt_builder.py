@@ -0,0 +1,112 @@
+"""
+AIVA - Token-budgeted Prompt Builder
+ประกอบ prompt ให้พอดีกับงบ token ของแต่ละโมเดล แทนการใส่ 8 chunk เต็มทุกครั้ง
+
+- ประมาณจำนวน token จากจำนวนตัวอักษร (ภาษาไทยใช้ token ต่อตัวอักษรมากกว่าภาษาอังกฤษมาก)
+- เลือก chunk ตามคะแนนจากมากไปน้อยจนเต็มงบ ข้าม chunk ที่เนื้อหาเกือบซ้ำกับที่เลือกแล้ว
+- คืนจำนวน token ที่ใช้ไว้สำหรับ log/วัดผล
+"""
+import os
+import math
+import re
+from collections import namedtuple
+
+from retrieval import tokenize
+
+# ตัวอักษรต่อ token โดยประมาณ (ไทย, อื่นๆ) ของ tokenizer แต่ละตระกูล
+# Llama 3 (vocab 128k) ตัดภาษาไทยเป็น token สั้น, Gemma (vocab 256k) ครอบคลุมภาษาไทยดีกว่า
+_CHARS_PER_TOKEN = {
+    "llama": (2.0, 4.0),
+    "gemma": (3.0, 4.0),
+}
+_DEFAULT_CHARS_PER_TOKEN = (2.0, 4.0)
+
+# งบ token ของ prompt ขาเข้า (system + คำถาม) ต่อโมเดล
+PROMPT_TOKEN_BUDGETS = {
+    "llama-3.3-70b-versatile": 3000,
+    "llama-3.1-8b-instant": 2500,
+    "gemma2-9b-it": 2500,
+}
+DEFAULT_PROMPT_TOKENS = 2500
+_BUDGET_OVERRIDE = os.environ.get("AIVA_PROMPT_TOKENS")
+
+# chunk ที่มี bigram ซ้ำกับ chunk ที่เลือกแล้วเกินสัดส่วนนี้ถือว่าซ้ำ
+NEAR_DUPLICATE_RATIO = 0.8
+
+_THAI_RE = re.compile(r'[\u0E00-\u0E7F]')
+_SPACE_RE = re.compile(r'\s+')
+
+PromptPlan = namedtuple("PromptPlan", "system_prompt chunk_ids context_tokens prompt_tokens budget")
+
+
+def estimate_tokens(text: str, model: str = "") -> int:
+    """ประมาณจำนวน token ของ text สำหรับ model (ช่องว่างติดกันนับเป็นตัวเดียว)"""
+    if not text:
+        return 0
+    thai_cpt, other_cpt = next((v for k, v in _CHARS_PER_TOKEN.items() if k in model), _DEFAULT_CHARS_PER_TOKEN)
+    compact = _SPACE_RE.sub(" ", text)
+    thai = len(_THAI_RE.findall(compact))
+    return math.ceil(thai / thai_cpt + (len(compact) - thai) / other_cpt)
+
+
+def prompt_budget(model: str) -> int:
+    if _BUDGET_OVERRIDE:
+        return int(_BUDGET_OVERRIDE)
+    return PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKENS)
+
+
+def format_context(index, chunk_ids) -> str:
+    """รวม chunk ตามลำดับในเอกสาร (chunk ที่ซ้อนกันรวมเป็นช่วงเดียว) และบอกชื่อไฟล์ครั้งเดียวต่อกลุ่ม"""
+    parts = []
+    last_source = None
+    for source, text in index.context_blocks(chunk_ids):
+        if source and source != last_source:
+            text = f"[{source}]\n{text}"
+        last_source = source
+        parts.append(text)
+    return "\n...\n".join(parts)
+
+
+def _is_near_duplicate(terms: set, selected: list) -> bool:
+    if not terms:
+        return True
+    for other in selected:
+        if len(terms & other) >= NEAR_DUPLICATE_RATIO * min(len(terms), len(other)):
+            return True
+    return False
+
+
+def build_prompt(index, hits: list, model: str, render, user_question: str) -> PromptPlan:
+    """เลือก chunk จาก hits [(score, chunk_id)] ให้พอดีงบของ model
+
+    render(context) -> system prompt ที่มี context แทรกอยู่
+    """
+    budget = prompt_budget(model)
+    fixed_tokens = estimate_tokens(render(""), model) + estimate_tokens(user_question, model)
+    remaining = budget - fixed_tokens
+
+    chunk_ids = []
+    selected_terms = []
+    for _, chunk_id in sorted(hits, key=lambda h: -h[0]):
+        text = index.chunk_text(chunk_id)
+        # +2 สำหรับตัวคั่นระหว่างช่วง
+        cost = estimate_tokens(text, model) + 2
+        if cost > remaining:
+            continue
+        terms = set(tokenize(text))
+        if _is_near_duplicate(terms, selected_terms):
+            continue
+        chunk_ids.append(chunk_id)
+        selected_terms.append(terms)
+        remaining -= cost
+
+    while True:
+        context = format_context(index, chunk_ids)
+        system_prompt = render(context)
+        prompt_tokens = estimate_tokens(system_prompt, model) + estimate_tokens(user_question, model)
+        # ชื่อไฟล์ที่เพิ่มใน context อาจทำให้เกินงบเล็กน้อย ตัด chunk คะแนนต่ำสุดออก
+        if prompt_tokens <= budget or not chunk_ids:
+            break
+        chunk_ids.pop()
+    context_tokens = estimate_tokens(context, model)
+    return PromptPlan(system_prompt, chunk_ids, context_tokens, prompt_tokens, budget)
@@ -0,0 +1,291 @@
+"""
+AIVA - Retrieval Index
+ค้นหา context ที่เกี่ยวข้องกับคำถามด้วย BM25 บน inverted index
+
+- ภาษาไทยไม่มีการเว้นวรรคระหว่างคำ จึงตัดเป็น character bigram ในแต่ละช่วงอักษรไทย
+- ภาษาอังกฤษ/ตัวเลข ตัดเป็นคำตามปกติ (lowercase)
+- posting lists เก็บเป็น array แบบกะทัดรัด เรียงตาม hash ของ term เพื่อค้นหาด้วย binary search
+- chunk แบ่งตามไฟล์/หน้า/ย่อหน้า (chunker.py) และเก็บ metadata: ไฟล์ต้นทาง, หน้า, ช่วงตัวอักษร
+"""
+import re
+import math
+import bisect
+import hashlib
+import logging
+from array import array
+from collections import Counter
+
+from chunker import CHUNK_CHARS, CHUNK_OVERLAP, chunk_text
+
+try:
+    import numpy as np
+except ImportError:  # optional (requirements.txt): search_many ของ /ask_batch จะใช้ search() ทีละคำถามแทน
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# ช่วงอักษรไทย (U+0E00 - U+0E7F) หรือคำภาษาอังกฤษ/ตัวเลข
+_TOKEN_RE = re.compile(r'[\u0E00-\u0E7F]+|[a-z0-9]+')
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# term ที่พบในเกือบทุก chunk ให้คะแนนน้อยมาก ข้ามไปเพื่อไม่ต้องไล่ posting list ยาวๆ
+MAX_DF_RATIO = 0.6
+
+
+def tokenize(text: str) -> list:
+    """ตัดข้อความเป็น token: Thai -> character bigrams, Latin/ตัวเลข -> คำ"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        run = match.group()
+        if run[0] >= '\u0E00':
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1 or run.isdigit():
+            tokens.append(run)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    """hash 64-bit ที่คงที่ข้าม process (ไม่ใช้ hash() ของ Python เพราะสุ่ม seed)"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class RetrievalIndex:
+    """Inverted index + BM25 scoring สร้างครั้งเดียวตอนโหลด knowledge base
+
+    ทุก field เป็น buffer แบบ flat (bytes/array หรือ memoryview ของ mmap) เพื่อให้
+    kb_store แชร์ index เดียวกันระหว่าง gunicorn workers ได้โดยไม่ต้อง copy
+    """
+
+    def __init__(self, text, n_chars, chunk_starts, chunk_ends, chunk_lens,
+                 term_hashes, term_offsets, post_chunks, post_tfs,
+                 chunk_char_starts, chunk_sources, chunk_pages, sources):
+        self.text = text                    # UTF-8 bytes ของ knowledge base ทั้งหมด
+        self.n_chars = n_chars
+        self.chunk_starts = chunk_starts    # byte offset ใน text
+        self.chunk_ends = chunk_ends
+        self.chunk_char_starts = chunk_char_starts  # char offset ใน knowledge base
+        self.chunk_sources = chunk_sources  # index ใน sources
+        self.chunk_pages = chunk_pages      # หน้า PDF (0 = ไม่ใช่ PDF)
+        self.sources = sources              # ชื่อไฟล์ต้นทาง ("" = ไม่ทราบ)
+        self.chunk_lens = chunk_lens        # จำนวน token ต่อ chunk (สำหรับ BM25)
+        self.term_hashes = term_hashes      # sorted, 1 ค่าต่อ term
+        self.term_offsets = term_offsets    # len = terms + 1, ช่วงใน post_chunks/post_tfs
+        self.post_chunks = post_chunks
+        self.post_tfs = post_tfs
+
+        total = sum(chunk_lens)
+        self.avg_len = (total / len(chunk_lens)) if len(chunk_lens) else 0.0
+        self._chunk_norms = None
+
+    @staticmethod
+    def analyze(text: str, chunk_size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list:
+        """แบ่ง text (เช่น ไฟล์เดียว) เป็น chunk พร้อม term counts: [(Chunk, Counter), ...]
+
+        ส่วนนี้คือส่วนที่ใช้เวลาที่สุดของการสร้าง index จึงแยกออกมาให้ cache ต่อไฟล์ได้
+        """
+        return [(c, Counter(term_hash(t) for t in tokenize(text[c.start:c.end])))
+                for c in chunk_text(text, chunk_size, overlap)]
+
+    @classmethod
+    def build(cls, text: str, chunk_size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> "RetrievalIndex":
+        """แบ่ง text เป็น chunk แล้วสร้าง posting lists"""
+        return cls.from_parts([(text, cls.analyze(text, chunk_size, overlap))])
+
+    @classmethod
+    def from_parts(cls, parts: list) -> "RetrievalIndex":
+        """รวมผลของ analyze() หลายส่วน [(text, analyzed), ...] ตามลำดับ เป็น index เดียว"""
+        starts = array('I')
+        ends = array('I')
+        char_starts = array('I')
+        chunk_sources = array('I')
+        chunk_pages = array('I')
+        chunk_lens = array('I')
+        sources = []
+        source_ids = {}
+        postings = {}
+        char_base = byte_base = 0
+        chunk_id = 0
+        for text, analyzed in parts:
+            char_pos = byte_pos = 0   # chunk เรียงตามตำแหน่ง จึงนับ byte offset ต่อจากเดิมได้
+            for c, counts in analyzed:
+                byte_pos += len(text[char_pos:c.start].encode('utf-8'))
+                char_pos = c.start
+                starts.append(byte_base + byte_pos)
+                ends.append(byte_base + byte_pos + len(text[c.start:c.end].encode('utf-8')))
+                char_starts.append(char_base + c.start)
+                if c.source not in source_ids:
+                    source_ids[c.source] = len(sources)
+                    sources.append(c.source)
+                chunk_sources.append(source_ids[c.source])
+                chunk_pages.append(c.page)
+
+                chunk_lens.append(sum(counts.values()))
+                for h, tf in counts.items():
+                    postings.setdefault(h, []).append((chunk_id, tf))
+                chunk_id += 1
+            char_base += len(text)
+            byte_base += len(text.encode('utf-8'))
+
+        term_hashes = array('Q')
+        term_offsets = array('I', [0])
+        post_chunks = array('I')
+        post_tfs = array('I')
+        for h in sorted(postings):
+            term_hashes.append(h)
+            for chunk_id, tf in postings[h]:
+                post_chunks.append(chunk_id)
+                post_tfs.append(tf)
+            term_offsets.append(len(post_chunks))
+
+        full_text = "".join(text for text, _ in parts)
+        logger.info(f"Retrieval index built: {len(starts)} chunks from {len(sources)} sources, "
+                    f"{len(term_hashes)} terms, {len(post_chunks)} postings")
+        return cls(full_text.encode('utf-8'), len(full_text), starts, ends, chunk_lens,
+                   term_hashes, term_offsets, post_chunks, post_tfs,
+                   char_starts, chunk_sources, chunk_pages, sources)
+
+    def __len__(self):
+        return len(self.chunk_starts)
+
+    def chunk_text(self, chunk_id: int) -> str:
+        return bytes(self.text[self.chunk_starts[chunk_id]:self.chunk_ends[chunk_id]]).decode('utf-8')
+
+    def chunk_info(self, chunk_id: int) -> dict:
+        """metadata ของ chunk: ไฟล์ต้นทาง, หน้า และช่วงตัวอักษรใน knowledge base"""
+        char_start = self.chunk_char_starts[chunk_id]
+        return {
+            "source": self.sources[self.chunk_sources[chunk_id]],
+            "page": self.chunk_pages[chunk_id],
+            "char_start": char_start,
+            "char_end": char_start + len(self.chunk_text(chunk_id)),
+        }
+
+    def context_blocks(self, chunk_ids) -> list:
+        """รวม chunk ที่เลือกเป็นช่วงข้อความตามลำดับในเอกสาร คืน [(source, text), ...]
+
+        chunk ที่ซ้อนกัน (overlap) หรือติดกันในไฟล์เดียวกันจะถูกรวมเป็นช่วงเดียว
+        และข้อความที่ซ้ำกันทุกตัวอักษร (เช่น ไฟล์เดียวกันถูกรวมมาสองครั้ง) จะเหลือช่วงเดียว
+        """
+        spans = []
+        for i in sorted(set(chunk_ids), key=lambda i: self.chunk_starts[i]):
+            start, end, source = self.chunk_starts[i], self.chunk_ends[i], self.chunk_sources[i]
+            if spans and spans[-1][2] == source and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end, source])
+
+        blocks = []
+        seen = set()
+        for start, end, source in spans:
+            text = bytes(self.text[start:end]).decode('utf-8').strip()
+            if text and text not in seen:
+                seen.add(text)
+                blocks.append((self.sources[source], text))
+        return blocks
+
+    def full_text(self) -> str:
+        return bytes(self.text).decode('utf-8')
+
+    def _find_term(self, h: int) -> int:
+        i = bisect.bisect_left(self.term_hashes, h)
+        if i < len(self.term_hashes) and self.term_hashes[i] == h:
+            return i
+        return -1
+
+    def search(self, query: str, top_k: int = 8) -> list:
+        """คืนค่า [(score, chunk_id), ...] เรียงตามคะแนนมากไปน้อย (เฉพาะ chunk ที่มี term ตรง)"""
+        n_chunks = len(self.chunk_starts)
+        if not n_chunks:
+            return []
+
+        terms = []
+        for h in set(term_hash(t) for t in tokenize(query)):
+            idx = self._find_term(h)
+            if idx >= 0:
+                terms.append((self.term_offsets[idx], self.term_offsets[idx + 1]))
+        if not terms:
+            return []
+
+        # ไล่จาก term ที่หายากก่อน และข้าม term ที่พบแทบทุก chunk (ถ้ายังมี term อื่นให้ใช้)
+        terms.sort(key=lambda r: r[1] - r[0])
+        max_df = max(1, int(n_chunks * MAX_DF_RATIO))
+        selective = [r for r in terms if r[1] - r[0] <= max_df]
+        if selective:
+            terms = selective
+
+        k1, b = BM25_K1, BM25_B
+        avg_len = self.avg_len or 1.0
+        scores = {}
+        for start, end in terms:
+            df = end - start
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            for p in range(start, end):
+                chunk_id = self.post_chunks[p]
+                tf = self.post_tfs[p]
+                norm = k1 * (1 - b + b * self.chunk_lens[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        ranked = sorted(((s, c) for c, s in scores.items()), key=lambda x: (-x[0], x[1]))
+        return ranked[:top_k]
+
+    def _query_terms(self, query: str) -> list:
+        """index ของ term ในคำถามที่มีใน index (ตัด term ที่พบแทบทุก chunk ออกถ้ายังมี term อื่น)"""
+        found = set()
+        for h in set(term_hash(t) for t in tokenize(query)):
+            idx = self._find_term(h)
+            if idx >= 0:
+                found.add(idx)
+        max_df = max(1, int(len(self.chunk_starts) * MAX_DF_RATIO))
+        selective = [i for i in found if self.term_offsets[i + 1] - self.term_offsets[i] <= max_df]
+        return sorted(selective or found)
+
+    def search_many(self, queries: list, top_k: int = 8) -> list:
+        """ค้นหาหลายคำถามพร้อมกัน: คะแนน BM25 ของทุกคำถามกับทุก chunk ด้วย matrix multiplication ครั้งเดียว
+
+        คืน list ของผลลัพธ์แบบเดียวกับ search() ตามลำดับ queries
+        """
+        n_chunks = len(self.chunk_starts)
+        if np is None or not n_chunks or not queries:
+            return [self.search(q, top_k) for q in queries]
+
+        query_terms = [self._query_terms(q) for q in queries]
+        vocab = sorted(set(t for terms in query_terms for t in terms))
+        if not vocab:
+            return [[] for _ in queries]
+        column = {t: j for j, t in enumerate(vocab)}
+
+        if self._chunk_norms is None:
+            lens = np.frombuffer(self.chunk_lens, dtype=np.uint32).astype(np.float64)
+            self._chunk_norms = BM25_K1 * (1 - BM25_B + BM25_B * lens / (self.avg_len or 1.0))
+
+        # W[term, chunk] = น้ำหนัก BM25 ของ term ใน chunk (เฉพาะ term ที่อยู่ในคำถามชุดนี้)
+        post_chunks = np.frombuffer(self.post_chunks, dtype=np.uint32)
+        post_tfs = np.frombuffer(self.post_tfs, dtype=np.uint32)
+        weights = np.zeros((len(vocab), n_chunks), dtype=np.float64)
+        for j, t in enumerate(vocab):
+            start, end = self.term_offsets[t], self.term_offsets[t + 1]
+            df = end - start
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            chunks = post_chunks[start:end]
+            tf = post_tfs[start:end].astype(np.float64)
+            weights[j, chunks] = idf * tf * (BM25_K1 + 1) / (tf + self._chunk_norms[chunks])
+
+        q_matrix = np.zeros((len(queries), len(vocab)), dtype=np.float64)
+        for i, terms in enumerate(query_terms):
+            q_matrix[i, [column[t] for t in terms]] = 1.0
+
+        scores = q_matrix @ weights
+        results = []
+        for row in scores:
+            k = min(top_k, n_chunks)
+            # รวม chunk ที่คะแนนเท่ากับอันดับที่ k ด้วย แล้วเรียงแบบเดียวกับ search() (คะแนน, ตำแหน่ง)
+            kth = row[np.argpartition(-row, k - 1)[k - 1]]
+            top = np.nonzero((row >= kth) & (row > 0))[0]
+            ranked = sorted(((float(row[c]), int(c)) for c in top), key=lambda x: (-x[0], x[1]))
+            results.append(ranked[:top_k])
+        return results
@@ -48,6 +48,14 @@ if [ "$1" == "--production" ] || [ "$1" == "-p" ]; then
     echo "Mode: PRODUCTION (using gunicorn)"
     pip3 install gunicorn -q 2>/dev/null
 
+    # สร้างไฟล์ static ที่มี content hash/ย่อรูป/บีบอัดไว้ล่วงหน้า (browser cache ได้ถาวร)
+    echo "Building static assets..."
+    python3 build_assets.py || echo "[WARN] Static asset build failed - serving originals"
+
+    # สร้างเสียงคำตอบ FAQ และคำทักทายไว้ล่วงหน้า (ไม่ต้องรอ gTTS ตอนใช้งานจริง)
+    echo "Warming TTS audio cache..."
+    python3 tts_cache.py warm || echo "[WARN] TTS warm-up failed - audio will be generated on demand"
+
     # Use config file if exists, otherwise use command line args
     if [ -f "gunicorn_config.py" ]; then
         echo "Using gunicorn_config.py"
@@ -0,0 +1,107 @@
+"""
+AIVA - Single-flight Request Coalescing
+คำถามเดียวกัน (หลัง normalize) ที่เข้ามาพร้อมกันรอผลจากการเรียก AI ครั้งเดียว
+
+- ใน process: request แรกเป็น leader เรียก AI, request อื่นรอผลเดียวกัน
+- ข้าม gunicorn workers (ถ้าเปิด): leader ของแต่ละ worker แย่ง lock file ของคำถามนั้น
+  worker ที่ได้ lock ทีหลังจะเช็ค answer cache (SQLite ที่แชร์กัน) ก่อนเรียก AI เอง
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: ใช้ได้เฉพาะใน process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: str, fn):
+        """เรียก fn() ครั้งเดียวต่อ key ที่กำลังทำงานอยู่ คืน (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+@contextmanager
+def worker_lock(lock_dir: str, key: str, timeout: float = 35.0, poll: float = 0.05):
+    """lock ข้าม process ต่อ key (yield True ถ้าได้ lock, False ถ้ารอเกิน timeout หรือใช้ lock ไม่ได้)
+
+    ใช้ LOCK_NB + sleep แทนการ block เพื่อไม่ให้ gevent worker ค้างทั้ง process
+    """
+    if fcntl is None:
+        yield False
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    path = os.path.join(lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".lock")
+    deadline = time.monotonic() + timeout
+    with open(path, "a") as lock_file:
+        acquired = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Timed out waiting for in-flight lock {os.path.basename(path)}")
+                    break
+                time.sleep(poll)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                # ลบไฟล์ขณะยังถือ lock: worker ที่รออยู่จะได้ lock ของไฟล์เดิมแล้วเช็ค cache
+                # ส่วน worker ที่มาใหม่สร้างไฟล์ใหม่ (อย่างแย่ที่สุดคือเรียก AI ซ้ำ ไม่ผิดพลาด)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
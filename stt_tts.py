@@ -1,11 +1,12 @@
 import speech_recognition as sr
 from gtts import gTTS
 import threading
-import os
-import tempfile
+import io
 import pygame
 import time
 
+from tts_pipeline import split_sentences, pipelined
+
 # --- Setup Pygame Mixer ---
 try:
     # ตั้งค่า Mixer ควรทำเพียงครั้งเดียว
@@ -46,11 +47,21 @@ class STT:
             return ""
 
 class TTS:
-    def __init__(self, lang='th'):
+    def __init__(self, lang='th', max_workers=3):
         self.lang = lang
         self.lock = threading.Lock()
-        self.current_path = None
+        self.current_audio = None
         self.is_speaking = False
+        self.max_workers = max_workers  # จำนวนประโยคที่สังเคราะห์ล่วงหน้าพร้อมกัน
+
+    def _synthesize_chunk(self, text):
+        # ⭐️ slow=False เพื่อเพิ่มความเร็วในการพูด
+        # สังเคราะห์ลง buffer ในหน่วยความจำ ไม่ต้องเขียน/ลบไฟล์ชั่วคราว
+        tts = gTTS(text=text, lang=self.lang, slow=False)
+        buffer = io.BytesIO()
+        tts.write_to_fp(buffer)
+        buffer.seek(0)
+        return buffer
 
     def speak(self, text):
         # ⭐️ ตรวจสอบว่า mixer พร้อมทำงานหรือไม่ ถ้าไม่ ให้ init ใหม่
@@ -63,51 +74,44 @@ class TTS:
                 print(f"TTS Error: Could not re-initialize mixer: {e}")
                 return
 
-        path = None
         try:
             self.is_speaking = True
-            print(f"TTS: Generating speech for: {text[:30]}...")
-            
-            # 1. สร้างไฟล์เสียง
-            with self.lock:
-                # ⭐️⭐️⭐️ แก้ไขตรงนี้: เพิ่ม slow=False เพื่อเพิ่มความเร็วในการพูด ⭐️⭐️⭐️
-                tts = gTTS(text=text, lang=self.lang, slow=False) 
-                # ⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️⭐️
-                with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_file:
-                    path = tmp_file.name
-                tts.save(path)
-                self.current_path = path
-            
-            # 2. เล่นเสียงด้วย pygame
-            if pygame.mixer.get_init():
-                pygame.mixer.music.load(path)
-                pygame.mixer.music.play()
-                
-                # 3. รอจนกว่าจะเล่นจบ
-                while pygame.mixer.music.get_busy() and self.is_speaking:
-                    time.sleep(0.1)
-                
-                # สั่ง Unload ไฟล์ก่อนลบ (ถ้ายังไม่ถูกหยุด)
-                if self.is_speaking: # ถ้าเล่นจนจบเอง (ไม่ถูก stop)
-                    pygame.mixer.music.stop()
-                    pygame.mixer.music.unload()
-            else:
-                print("TTS Error: Pygame Mixer not initialized.")
-            
+            chunks = split_sentences(text)
+            print(f"TTS: Generating speech for: {text[:30]}... ({len(chunks)} parts)")
+
+            # 1. สังเคราะห์ทีละประโยค (ส่วนถัดไปทำเบื้องหลังระหว่างเล่นส่วนปัจจุบัน)
+            parts = pipelined(chunks, self._synthesize_chunk, max_workers=self.max_workers)
+            try:
+                for audio in parts:
+                    if not self.is_speaking:  # ถูกสั่งหยุดระหว่างรอสังเคราะห์
+                        break
+                    with self.lock:
+                        self.current_audio = audio
+
+                    # 2. เล่นเสียงด้วย pygame
+                    if not pygame.mixer.get_init():
+                        print("TTS Error: Pygame Mixer not initialized.")
+                        break
+                    # โหลดจาก buffer โดยตรง (namehint บอกชนิดไฟล์แทนนามสกุล)
+                    pygame.mixer.music.load(audio, "mp3")
+                    pygame.mixer.music.play()
+
+                    # 3. รอจนกว่าจะเล่นจบ
+                    while pygame.mixer.music.get_busy() and self.is_speaking:
+                        time.sleep(0.1)
+
+                    # สั่ง Unload ก่อนเล่นส่วนถัดไป (ถ้ายังไม่ถูกหยุด)
+                    if self.is_speaking: # ถ้าเล่นจนจบเอง (ไม่ถูก stop)
+                        pygame.mixer.music.stop()
+                        pygame.mixer.music.unload()
+            finally:
+                parts.close()  # ยกเลิกประโยคที่ยังไม่ได้สังเคราะห์
+
         except Exception as e:
             print(f"TTS speak error: {e}")
         finally:
             self.is_speaking = False
-            
-            # 4. ลบไฟล์ (cleanup)
-            if path and os.path.exists(path):
-                try:
-                    os.remove(path)
-                    # print(f"TTS cleanup: Removed {os.path.basename(path)}")
-                except Exception as e:
-                    # อาจจะยัง Unload ไม่เสร็จ
-                    print(f"TTS cleanup error: Could not remove {path}. {e}")
-            self.current_path = None
+            self.current_audio = None
 
     def stop_speaking(self):
         """เมธอดสำหรับสั่งหยุดการพูดทันที"""
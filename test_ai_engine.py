@@ -0,0 +1,247 @@
+"""
+ทดสอบ PdfAIEngine กับ Groq client จำลอง (ไม่เรียก API จริง)
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import log_pipeline
+from answer_cache import AnswerCache
+from faq_matcher import FaqMatcher
+from pdf_ai_engine import BUSY_ANSWER, MODELS_TO_TRY, PdfAIEngine, StreamInterrupted
+
+
+class FakeCompletions:
+    """จำลอง client.chat.completions: behaviors[model] = list ของ token หรือ Exception"""
+
+    def __init__(self, behaviors):
+        self.behaviors = behaviors
+        self.calls = []
+
+    def create(self, messages, model, stream=False, **kwargs):
+        self.calls.append(model)
+        behavior = self.behaviors[model]
+        if isinstance(behavior, Exception):
+            raise behavior
+        if not stream:
+            message = SimpleNamespace(content="".join(behavior))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream(behavior)
+
+    def _stream(self, tokens):
+        for token in tokens:
+            if isinstance(token, Exception):
+                raise token
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+
+def make_engine(tmp_path, monkeypatch, **kwargs):
+    monkeypatch.setenv("AIVA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("AIVA_ANSWER_CACHE", "0")
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "info.txt").write_text("วิทยาลัยเปิดรับสมัครนักเรียนเดือนมีนาคม", encoding="utf-8")
+    ai = PdfAIEngine(pdf_folder_path=str(data), api_key="", **kwargs)
+    ai.faq_matcher = FaqMatcher([])
+    return ai
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    return make_engine(tmp_path, monkeypatch)
+
+
+def use_fake_client(ai, behaviors):
+    completions = FakeCompletions(behaviors)
+    ai.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return completions
+
+
+def test_stream_falls_back_when_model_fails_before_first_token(engine, monkeypatch):
+    monkeypatch.setattr("pdf_ai_engine.time.sleep", lambda s: None)
+    completions = use_fake_client(engine, {
+        "llama-3.3-70b-versatile": Exception("Error code: 429 - rate_limit_exceeded"),
+        "llama-3.1-8b-instant": ["เปิดรับ", "สมัคร", "เดือนมีนาคมค่ะ"],
+    })
+
+    assert list(engine.stream_answer("รับสมัครเมื่อไหร่")) == ["เปิดรับ", "สมัคร", "เดือนมีนาคมค่ะ"]
+    assert completions.calls == ["llama-3.3-70b-versatile", "llama-3.1-8b-instant"]
+
+
+def test_stream_raises_when_model_fails_after_first_token(engine):
+    completions = use_fake_client(engine, {
+        "llama-3.3-70b-versatile": ["เปิดรับ", Exception("connection reset")],
+        "llama-3.1-8b-instant": ["ไม่ควรถูกเรียก"],
+    })
+
+    deltas = []
+    with pytest.raises(StreamInterrupted):
+        for delta in engine.stream_answer("รับสมัครเมื่อไหร่"):
+            deltas.append(delta)
+    assert deltas == ["เปิดรับ"]
+    assert completions.calls == ["llama-3.3-70b-versatile"]
+
+
+def test_empty_probe_stream_does_not_block_later_requests(engine):
+    use_fake_client(engine, {"llama-3.3-70b-versatile": [], "llama-3.1-8b-instant": []})
+    for model in MODELS_TO_TRY:
+        engine.router.record_failure(model, Exception("Error code: 429 - rate_limit_exceeded"))
+
+    assert list(engine.stream_answer("รับสมัครเมื่อไหร่")) == [BUSY_ANSWER]
+    # probe ที่ได้ stream ว่างคืนสิทธิ์แล้ว คำขอถัดไปได้ลอง probe เอง (ไม่ได้ list ว่างไปอีก 30 วินาที)
+    assert len(engine.router.candidates()) == 1
+
+
+def test_hedged_answer_cut_off_mid_stream_is_not_returned_or_cached(engine, tmp_path):
+    engine.hedging = True
+    engine.answer_cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    use_fake_client(engine, {
+        "llama-3.3-70b-versatile": ["เปิดรับ", Exception("connection reset")],
+        "llama-3.1-8b-instant": ["ไม่ควรถูกเรียก"],
+    })
+
+    assert engine.find_answer("รับสมัครเมื่อไหร่") == "ขออภัย ระบบขัดข้องชั่วคราว"
+    assert engine.answer_cache.get("รับสมัครเมื่อไหร่", engine.corpus_version) is None
+
+
+def test_find_answers_dedupes_and_keeps_input_order(engine):
+    engine.faq_matcher = FaqMatcher([{"keywords": ["ค่าเทอม"], "answer": "ประมาณ 5,000 บาทค่ะ"}])
+    completions = use_fake_client(engine, {"llama-3.3-70b-versatile": ["เปิดรับเดือนมีนาคมค่ะ"]})
+
+    results = engine.find_answers(["รับสมัครเมื่อไหร่", "ค่าเทอมเท่าไหร่", "รับสมัคร เมื่อไหร่ คะ"])
+
+    assert [r["question"] for r in results] == ["รับสมัครเมื่อไหร่", "ค่าเทอมเท่าไหร่", "รับสมัคร เมื่อไหร่ คะ"]
+    assert [r["source"] for r in results] == ["ai", "faq", "ai"]
+    assert results[0]["answer"] == results[2]["answer"] == "เปิดรับเดือนมีนาคมค่ะ"
+    assert completions.calls == ["llama-3.3-70b-versatile"]
+    assert all(r["elapsed_ms"] >= 0 for r in results)
+
+
+def test_find_answers_carries_request_id_into_pool_threads(engine):
+    use_fake_client(engine, {"llama-3.3-70b-versatile": ["เปิดรับเดือนมีนาคมค่ะ"]})
+    seen = []
+    answer = engine._coalesced_answer
+    engine._coalesced_answer = lambda *args: seen.append(log_pipeline.get_request_id()) or answer(*args)
+
+    log_pipeline.set_request_id("batch-1")
+    try:
+        engine.find_answers(["รับสมัครเมื่อไหร่", "เรียนกี่ปี"], max_workers=2)
+    finally:
+        log_pipeline.clear_request_id()
+    assert seen == ["batch-1", "batch-1"]
+
+
+def test_find_answers_tags_fallback_messages_as_errors(engine):
+    use_fake_client(engine, {model: Exception("Error code: 429 - rate_limit_exceeded") for model in MODELS_TO_TRY})
+
+    result, = engine.find_answers(["รับสมัครเมื่อไหร่"])
+
+    assert result["answer"] == BUSY_ANSWER
+    assert result["source"] == "error"
+
+
+def test_rate_limited_model_is_skipped_for_next_question(engine):
+    completions = use_fake_client(engine, {
+        "llama-3.3-70b-versatile": Exception("Error code: 429 - rate_limit_exceeded"),
+        "llama-3.1-8b-instant": ["เปิดรับเดือนมีนาคมค่ะ"],
+    })
+
+    assert engine.find_answer("รับสมัครเมื่อไหร่") == "เปิดรับเดือนมีนาคมค่ะ"
+    assert engine.find_answer("สมัครเรียนได้เมื่อไหร่") == "เปิดรับเดือนมีนาคมค่ะ"
+    assert completions.calls == ["llama-3.3-70b-versatile", "llama-3.1-8b-instant", "llama-3.1-8b-instant"]
+
+
+def test_hedging_mode_answers_through_streams(engine):
+    engine.hedging = True
+    completions = use_fake_client(engine, {
+        "llama-3.3-70b-versatile": Exception("Error code: 429 - rate_limit_exceeded"),
+        "llama-3.1-8b-instant": ["เปิดรับ", "เดือนมีนาคมค่ะ"],
+    })
+
+    assert engine.find_answer("รับสมัครเมื่อไหร่") == "เปิดรับเดือนมีนาคมค่ะ"
+    assert completions.calls == ["llama-3.3-70b-versatile", "llama-3.1-8b-instant"]
+
+
+def test_concurrent_identical_questions_call_ai_once(engine, monkeypatch, tmp_path):
+    use_fake_client(engine, {})
+    calls = []
+
+    def slow_ask(question, hits):
+        calls.append(question)
+        time.sleep(0.2)
+        return "เปิดรับเดือนมีนาคมค่ะ"
+    monkeypatch.setattr(engine, "_ask_models", slow_ask)
+
+    answers = []
+    threads = [threading.Thread(target=lambda q=q: answers.append(engine.find_answer(q)))
+               for q in ["รับสมัครเมื่อไหร่", "รับสมัคร เมื่อไหร่ ครับ", "รับสมัครเมื่อไหร่คะ"]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert answers == ["เปิดรับเดือนมีนาคมค่ะ"] * 3
+
+    # worker อื่นตอบเสร็จระหว่างรอ lock: ใช้คำตอบจาก answer cache แทนการเรียก AI
+    engine.answer_cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    engine.answer_cache.put("ค่าเทอมเท่าไหร่", engine.corpus_version, "ประมาณ 5,000 บาทค่ะ")
+    assert engine._answer_across_workers("k", "ค่าเทอมเท่าไหร่", lambda: []) == ("ประมาณ 5,000 บาทค่ะ", "coalesced")
+    assert engine._coalesced_answer("ค่าเทอมเท่าไหร่", lambda: []) == ("ประมาณ 5,000 บาทค่ะ", "coalesced")
+    assert len(calls) == 1
+
+
+def test_reload_reindexes_only_changed_files_and_swaps_snapshot(monkeypatch, tmp_path):
+    engine = make_engine(tmp_path, monkeypatch, keep_segments=True)
+    data = tmp_path / "data"
+    old = engine.knowledge
+    retrieved = engine._get_relevant_context("รับสมัคร")
+    assert engine.reload() is False
+
+    analyzed = []
+    analyze = engine.index.analyze
+    monkeypatch.setattr("pdf_ai_engine.RetrievalIndex.analyze", lambda text: analyzed.append(text) or analyze(text))
+    (data / "fees.txt").write_text("ค่าธรรมเนียมการศึกษาภาคเรียนละ 5,000 บาท", encoding="utf-8")
+
+    assert engine.reload() is True
+    assert engine.corpus_version != old.corpus_version
+    assert len(analyzed) == 1 and "fees.txt" in analyzed[0]
+    assert "5,000 บาท" in engine.knowledge_base
+    assert "เดือนมีนาคม" in engine.knowledge_base
+    # request ที่ค้นหาไปก่อน reload ยังใช้ index เดิมของตัวเอง
+    assert retrieved.index is old.index and retrieved.corpus_version == old.corpus_version
+
+    (data / "fees.txt").unlink()
+    assert engine.reload() is True
+    assert "5,000 บาท" not in engine.knowledge_base
+
+
+def test_preloaded_engine_leaves_watcher_to_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr("pdf_ai_engine.RELOAD_INTERVAL", 30)
+    monkeypatch.setattr("pdf_ai_engine.PRELOAD", True)
+    engine = make_engine(tmp_path, monkeypatch)
+    assert engine._watcher_pid is None
+
+    # fork ระหว่างที่ thread ของ master ถือ lock อยู่: worker ได้ lock ใหม่ของตัวเอง
+    engine._reload_lock.acquire()
+    engine._reload_lock_pid = -1
+    assert engine.reload(force=True) is True
+
+
+def test_segments_are_not_kept_without_a_reload_path(engine, tmp_path):
+    assert engine._segments == {}
+
+    (tmp_path / "data" / "fees.txt").write_text("ค่าธรรมเนียมการศึกษาภาคเรียนละ 5,000 บาท", encoding="utf-8")
+    assert engine.reload() is True
+    assert "5,000 บาท" in engine.knowledge_base
+    assert engine._segments == {}
+
+    engine.start_watcher(3600)
+    assert engine.keep_segments is True
+    watchers = [t for t in threading.enumerate() if t.name == "kb-watcher"]
+    engine.stop_watcher()
+    for thread in watchers:
+        thread.join(1)
+    assert watchers and not any(t.is_alive() for t in watchers)
@@ -0,0 +1,73 @@
+"""
+ทดสอบ answer cache (normalize คำถาม, LRU, TTL, corpus version)
+"""
+import time
+
+from answer_cache import AnswerCache, normalize_question
+
+
+def test_normalize_strips_spaces_punctuation_and_particles():
+    assert normalize_question("ค่าเทอม เท่าไหร่ ครับ?") == "ค่าเทอมเท่าไหร่"
+    assert normalize_question("ค่าเทอมเท่าไหร่คะ") == "ค่าเทอมเท่าไหร่"
+    assert normalize_question("ค่าเทอมเท่าไหร่นะคะ") == "ค่าเทอมเท่าไหร่"
+    # "คะ" ที่เป็นส่วนหนึ่งของคำต้องไม่ถูกตัด
+    assert normalize_question("ดูคะแนน") == "ดูคะแนน"
+
+
+def test_normalize_does_not_eat_word_endings_that_look_like_particles():
+    assert normalize_question("ใครชนะ") == "ใครชนะ"
+    assert normalize_question("มีค่า") == "มีค่า"
+    assert normalize_question("ต้องใส่ชุดนักศึกษาไหม บังคับ") == "ต้องใส่ชุดนักศึกษาไหมบังคับ"
+
+
+def test_normalize_keeps_punctuation_and_spaces_between_digits():
+    assert normalize_question("เกรด 3.5 ขึ้นไป") != normalize_question("เกรด 35 ขึ้นไป")
+    assert normalize_question("ชั้น 1-2") != normalize_question("ชั้น 12")
+    assert normalize_question("ห้อง 3 5") != normalize_question("ห้อง 35")
+    assert normalize_question("ค่าเทอม 5,000 บาทไหมคะ?") == normalize_question("ค่าเทอม 5,000 บาท ไหม")
+
+
+def test_hits_do_not_write_until_flushed(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), flush_interval=3600)
+    cache.put("ค่าเทอมเท่าไหร่", "v1", "ประมาณ 5,000 บาทค่ะ")
+    conn = cache._conn()
+    changes = conn.total_changes
+
+    for _ in range(5):
+        assert cache.get("ค่าเทอมเท่าไหร่", "v1") == "ประมาณ 5,000 บาทค่ะ"
+    assert conn.total_changes == changes
+
+    assert cache.stats()["hits"] == 5
+
+
+def test_hit_miss_and_version_invalidation(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    assert cache.get("ค่าเทอมเท่าไหร่", "v1") is None
+    cache.put("ค่าเทอมเท่าไหร่", "v1", "ประมาณ 5,000 บาทค่ะ")
+
+    assert cache.get("ค่าเทอม เท่าไหร่ครับ", "v1") == "ประมาณ 5,000 บาทค่ะ"
+    assert cache.get("ค่าเทอมเท่าไหร่", "v2") is None
+
+    cache.invalidate_other_versions("v2")
+    stats = cache.stats()
+    assert stats["entries"] == 0
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_lru_and_ttl_eviction(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), max_entries=2, ttl=60)
+    cache.put("คำถาม 1", "v1", "a1")
+    time.sleep(0.01)
+    cache.put("คำถาม 2", "v1", "a2")
+    time.sleep(0.01)
+    cache.get("คำถาม 1", "v1")
+    time.sleep(0.01)
+    cache.put("คำถาม 3", "v1", "a3")
+
+    assert cache.get("คำถาม 2", "v1") is None
+    assert cache.get("คำถาม 1", "v1") == "a1"
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get("คำถาม 3", "v1") is None
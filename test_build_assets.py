@@ -0,0 +1,90 @@
+"""
+ทดสอบ build_assets: ชื่อไฟล์ตาม content hash, manifest, ไฟล์ .gz และการย่อรูป
+"""
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import build_assets
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _make_static(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    (static / "app.css").write_text("body { margin: 0; }\n" * 200, encoding="utf-8")
+    Image.new("RGB", (1024, 512), (10, 20, 30)).save(static / "pu.png")
+    return static
+
+
+def test_build_fingerprints_compresses_and_resizes(tmp_path):
+    static = _make_static(tmp_path)
+    manifest = build_assets.build(str(static))
+
+    assert set(manifest) == {"app.css", "pu.png"}
+    css = static / manifest["app.css"]
+    assert css.name.startswith("app.") and css.name.endswith(".css")
+    assert gzip.decompress((static / (manifest["app.css"] + ".gz")).read_bytes()) == css.read_bytes()
+    with Image.open(static / manifest["pu.png"]) as image:
+        assert image.width == build_assets.MAX_WIDTH["pu.png"]
+    assert not (static / (manifest["pu.png"] + ".gz")).exists()  # รูปบีบอัดอยู่แล้ว
+    assert json.loads((static / "dist" / "manifest.json").read_text()) == manifest
+    assert build_assets.load_manifest(str(static)) == manifest
+
+
+def test_rebuild_keeps_one_previous_generation(tmp_path):
+    static = _make_static(tmp_path)
+    first = build_assets.build(str(static))["app.css"]
+    (static / "app.css").write_text("body { margin: 1px; }\n" * 200, encoding="utf-8")
+    second = build_assets.build(str(static))["app.css"]
+    (static / "app.css").write_text("body { margin: 2px; }\n" * 200, encoding="utf-8")
+    third = build_assets.build(str(static))["app.css"]
+
+    assert len({first, second, third}) == 3
+    assert not (static / first).exists()
+    assert (static / second).exists() and (static / third).exists()
+
+
+def test_changed_build_settings_produce_new_files(tmp_path, monkeypatch):
+    static = _make_static(tmp_path)
+    first = build_assets.build(str(static))
+
+    # ติดตั้ง brotli หลัง build แรก: ไฟล์ css เดิมต้องได้ .br ด้วย
+    fake_brotli = SimpleNamespace(compress=lambda data, quality: gzip.compress(data))
+    monkeypatch.setattr(build_assets, "brotli", fake_brotli)
+    monkeypatch.setitem(build_assets.MAX_WIDTH, "pu.png", 2048)  # ไม่ต้องย่อแล้ว (รูปกว้าง 1024)
+    second = build_assets.build(str(static))
+
+    assert second["app.css"] != first["app.css"]
+    assert (static / (second["app.css"] + ".br")).exists()
+    assert second["pu.png"] != first["pu.png"]
+    with Image.open(static / second["pu.png"]) as image:
+        assert image.width == 1024
+
+
+def test_dist_assets_are_immutable_and_precompressed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # logs/ และ data_files/ ของ app ไปอยู่ใน tmp_path
+    import app
+
+    static = _make_static(tmp_path)
+    manifest = build_assets.build(str(static))
+    monkeypatch.setattr(app.app, "static_folder", str(static))
+    monkeypatch.setattr(app, "asset_manifest", manifest)
+    client = app.app.test_client()
+
+    with app.app.test_request_context():
+        url = app.asset_url("app.css")
+    assert url == f"/static/{manifest['app.css']}"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"].startswith("text/css")
+    assert "immutable" in response.headers["Cache-Control"]
+    assert gzip.decompress(response.data) == (static / manifest["app.css"]).read_bytes()
+
+    plain = client.get(url)
+    assert "Content-Encoding" not in plain.headers
+    assert plain.data == (static / manifest["app.css"]).read_bytes()
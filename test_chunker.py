@@ -0,0 +1,34 @@
+"""
+ทดสอบการแบ่ง chunk ตามไฟล์/หน้า/ย่อหน้า
+"""
+from chunker import chunk_text, wrap_source
+
+
+def test_chunks_follow_file_markers_and_pdf_pages():
+    text = (wrap_source("a.txt", "ข้อมูลไฟล์ A\n\nย่อหน้าที่สอง")
+            + wrap_source("b.pdf", "หน้าแรก\n\fหน้าสอง\n"))
+    chunks = chunk_text(text, max_chars=1000, overlap=0)
+
+    assert [(c.source, c.page) for c in chunks] == [("a.txt", 0), ("b.pdf", 1), ("b.pdf", 2)]
+    assert text[chunks[0].start:chunks[0].end].strip() == "ข้อมูลไฟล์ A\n\nย่อหน้าที่สอง"
+    assert text[chunks[2].start:chunks[2].end].strip() == "หน้าสอง"
+    assert all("---" not in text[c.start:c.end] for c in chunks)
+
+
+def test_long_paragraph_is_cut_at_lines_with_overlap():
+    lines = [f"บรรทัดที่ {i} ".ljust(40) for i in range(10)]
+    text = "\n".join(lines) + "\n"
+    chunks = chunk_text(text, max_chars=200, overlap=50)
+
+    assert len(chunks) > 1
+    assert all(c.end - c.start <= 200 for c in chunks)
+    # chunk ถัดไปเริ่มที่ต้นบรรทัด และซ้อนกับ chunk ก่อนหน้า
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert text[cur.start - 1] == "\n"
+        assert cur.start < prev.end
+    assert chunks[-1].end == len(text)
+
+
+def test_wrap_source_keeps_existing_markers():
+    combined = wrap_source("x.txt", "เนื้อหา")
+    assert wrap_source("combined.txt", combined) == combined
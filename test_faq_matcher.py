@@ -0,0 +1,39 @@
+"""
+ทดสอบ FAQ matcher (Aho-Corasick, keyword ที่ยาวกว่าชนะ)
+"""
+import json
+
+from faq_matcher import FaqMatcher
+
+FAQ = [
+    {"keywords": ["hi", "สวัสดี", "ไง"], "answer": "greeting"},
+    {"keywords": ["ค่าเทอม", "ค่าธรรมเนียมการศึกษา"], "answer": "fee"},
+    {"keywords": ["this program"], "answer": "program"},
+]
+
+
+def test_longest_keyword_wins_over_earlier_short_keyword():
+    matcher = FaqMatcher(FAQ)
+    # "hi" อยู่ใน "this" แต่ "this program" ยาวกว่า
+    assert matcher.answer("Tell me about THIS PROGRAM") == "program"
+    assert matcher.answer("สวัสดีค่ะ ค่าธรรมเนียมการศึกษาเท่าไหร่") == "fee"
+    assert matcher.match("ค่าเทอมเท่าไหร่")[1] == "ค่าเทอม"
+    assert matcher.answer("อยากทราบเรื่องหอพัก") is None
+
+
+def test_weight_and_entry_order_break_ties():
+    faq = [
+        {"keywords": ["สมัคร"], "answer": "first"},
+        {"keywords": ["สมัคร"], "answer": "second"},
+        {"keywords": ["เรียน"], "answer": "weighted", "weight": 3},
+    ]
+    matcher = FaqMatcher(faq)
+    assert matcher.answer("สมัครได้ที่ไหน") == "first"
+    assert matcher.answer("สมัครเรียนได้ที่ไหน") == "weighted"
+
+
+def test_repo_faq_answers_greetings():
+    with open("faq.json", "r", encoding="utf-8") as f:
+        matcher = FaqMatcher(json.load(f))
+    for question in ["สวัสดี", "หวัดดีครับ", "Hello AIVA", "เธอชื่ออะไร", "ขอบคุณนะ", "บายบาย"]:
+        assert matcher.answer(question)
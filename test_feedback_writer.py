@@ -0,0 +1,55 @@
+"""
+ทดสอบการเขียน feedback เบื้องหลัง (batch, spool, drain ตอนปิด) กับ Firestore จำลอง
+"""
+import datetime
+import time
+
+from feedback_writer import FakeFirestoreClient, FeedbackWriter
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_batch_is_written_when_full(tmp_path):
+    db = FakeFirestoreClient()
+    writer = FeedbackWriter(db, spool_dir=str(tmp_path), batch_size=3, flush_interval=60).start()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ids = [writer.submit({"rating": i, "feedback": "", "timestamp": now}) for i in range(3)]
+
+    assert wait_until(lambda: len(db.documents) == 3)
+    assert db.commits == 1
+    assert db.documents[("ratings", ids[0])] == {"rating": 0, "feedback": "", "timestamp": now}
+    assert list(tmp_path.glob("*.jsonl")) == []
+    writer.close()
+
+
+def test_spool_survives_outage_and_is_recovered(tmp_path):
+    offline = FeedbackWriter(FakeFirestoreClient(offline=True), spool_dir=str(tmp_path),
+                             batch_size=100, flush_interval=60)
+    ids = [offline.submit({"rating": 5, "feedback": "ดีมาก"}), offline.submit({"rating": 4, "feedback": ""})]
+    assert offline.flush() is False
+    assert len(list(tmp_path.glob("*.jsonl"))) == 1
+    offline.close()
+
+    # จำลองการเริ่มระบบใหม่หลัง crash: writer ใหม่รับ spool ไปเขียนต่อ
+    db = FakeFirestoreClient()
+    writer = FeedbackWriter(db, spool_dir=str(tmp_path), batch_size=100, flush_interval=60).start()
+    assert writer.stats()["pending"] == 2
+    assert writer.flush() is True
+    assert set(db.documents) == {("ratings", i) for i in ids}
+    assert list(tmp_path.iterdir()) == []
+    writer.close()
+
+
+def test_close_drains_pending_feedback(tmp_path):
+    db = FakeFirestoreClient()
+    writer = FeedbackWriter(db, spool_dir=str(tmp_path), batch_size=100, flush_interval=60).start()
+    writer.submit({"rating": 3, "feedback": ""})
+    writer.close()
+
+    assert len(db.documents) == 1
+    assert writer.stats() == {"pending": 0, "written": 1, "failures": 0}
@@ -3,19 +3,17 @@
 """
 import json
 
+from faq_matcher import FaqMatcher
+
 # โหลด FAQ
 with open('faq.json', 'r', encoding='utf-8') as f:
     faq_data = json.load(f)
 
+faq_matcher = FaqMatcher(faq_data)
+
 def check_faq(question):
     """ตรวจสอบว่าคำถามตรงกับ FAQ หรือไม่"""
-    question_lower = question.lower().strip()
-    for faq in faq_data:
-        keywords = faq.get("keywords", [])
-        for keyword in keywords:
-            if keyword.lower() in question_lower:
-                return faq.get("answer", "")
-    return None
+    return faq_matcher.answer(question.strip())
 
 # ทดสอบคำทักทาย
 test_questions = [
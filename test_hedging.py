@@ -0,0 +1,68 @@
+"""
+ทดสอบ hedged requests (โมเดลที่ส่ง token แรกก่อนชนะ, จำกัดงบ hedge)
+"""
+import time
+from types import SimpleNamespace
+
+from hedging import HedgeBudget, hedged_stream
+from model_router import ModelRouter
+
+MODELS = ["main", "backup"]
+
+
+def fake_open(delays, failures=()):
+    opened = []
+
+    def open_stream(model):
+        opened.append(model)
+        if model in failures:
+            raise Exception("Error code: 429 - rate_limit_exceeded")
+
+        def events():
+            time.sleep(delays[model])
+            for token in (f"{model}-1", f"{model}-2"):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        return events()
+    return open_stream, opened
+
+
+def run(open_stream, budget, failures=None):
+    router = ModelRouter(MODELS)
+    failed = failures if failures is not None else []
+    out = list(hedged_stream(open_stream, MODELS, lambda m: 0.05, budget, router,
+                             lambda m, e: failed.append(m)))
+    return out, router
+
+
+def test_slow_primary_is_hedged_and_fast_model_wins():
+    open_stream, opened = fake_open({"main": 0.5, "backup": 0.0})
+    budget = HedgeBudget(ratio=0.1, burst=1)
+
+    out, router = run(open_stream, budget)
+
+    assert out == [("backup", "backup-1"), ("backup", "backup-2"), ("backup", None)]
+    assert opened == ["main", "backup"]
+    assert budget.stats()["hedges"] == 1
+    assert router.snapshot()["backup"]["successes"] == 1
+    assert router.snapshot()["main"]["errors"] == 0
+
+
+def test_no_hedge_when_budget_is_spent():
+    open_stream, opened = fake_open({"main": 0.2, "backup": 0.0})
+
+    out, _ = run(open_stream, HedgeBudget(ratio=0.1, burst=0))
+
+    assert [delta for _, delta in out] == ["main-1", "main-2", None]
+    assert opened == ["main"]
+
+
+def test_failure_before_first_token_falls_back_immediately():
+    open_stream, opened = fake_open({"main": 0.0, "backup": 0.0}, failures={"main"})
+    failed = []
+    budget = HedgeBudget(ratio=0.1, burst=0)
+
+    out, _ = run(open_stream, budget, failed)
+
+    assert out[-1] == ("backup", None)
+    assert failed == ["main"]
+    assert budget.stats()["hedges"] == 0
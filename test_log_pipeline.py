@@ -0,0 +1,84 @@
+"""
+ทดสอบ log pipeline: เขียนผ่านคิว, request id/stage ใน record, การสุ่มเก็บ DEBUG และการหมุนไฟล์ข้าม process
+"""
+import json
+import logging
+
+import log_pipeline
+from log_pipeline import ContextFilter, JsonFormatter, NonBlockingQueueHandler, SharedRotatingFileHandler
+
+
+def _pipeline_logger(name, handler, debug_sample=1.0):
+    queue_handler = NonBlockingQueueHandler([handler])
+    queue_handler.addFilter(ContextFilter(debug_sample))
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(queue_handler)
+    return logger, queue_handler
+
+
+def test_records_carry_request_id_and_stage(tmp_path):
+    handler = SharedRotatingFileHandler(str(tmp_path / "aiva.log"))
+    handler.setFormatter(JsonFormatter())
+    logger, queue_handler = _pipeline_logger("test_log_pipeline.json", handler)
+
+    log_pipeline.set_request_id("req-1")
+    logger.info("Response: POST /ask 200", extra={"stage": "request", "duration_ms": 12.5})
+    queue_handler.stop()  # รอให้ thread เบื้องหลังเขียนจนหมดคิว
+    handler.close()
+    log_pipeline.clear_request_id()  # teardown_request: request ถัดไปใน thread เดียวกันไม่ได้ id เดิม
+    assert log_pipeline.get_request_id() is None
+
+    entry = json.loads((tmp_path / "aiva.log").read_text(encoding="utf-8"))
+    assert entry["msg"] == "Response: POST /ask 200"
+    assert entry["request_id"] == "req-1"
+    assert entry["stage"] == "request"
+    assert entry["duration_ms"] == 12.5
+
+
+def test_debug_sampling_keeps_whole_requests():
+    sampler = ContextFilter(debug_sample=0.5)
+
+    def kept(request_id):
+        record = logging.LogRecord("x", logging.DEBUG, __file__, 1, "debug", None, None)
+        record.request_id = request_id
+        return sampler.filter(record)
+
+    decisions = {f"req-{i}": kept(f"req-{i}") for i in range(200)}
+    assert 40 < sum(decisions.values()) < 160
+    assert all(kept(rid) == keep for rid, keep in decisions.items())
+
+    info = logging.LogRecord("x", logging.INFO, __file__, 1, "info", None, None)
+    assert ContextFilter(debug_sample=0).filter(info)
+
+
+def test_rotation_by_one_writer_is_seen_by_others(tmp_path):
+    path = str(tmp_path / "aiva.log")
+    # สอง handler บนไฟล์เดียวกัน แทน worker สอง process
+    first = SharedRotatingFileHandler(path, maxBytes=200, backupCount=2)
+    second = SharedRotatingFileHandler(path, maxBytes=200, backupCount=2)
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "x" * 60, None, None)
+
+    second.emit(record)
+    for _ in range(4):
+        first.emit(record)  # หมุนไฟล์เมื่อเกิน 200 bytes
+    assert (tmp_path / "aiva.log.1").exists()
+
+    before = (tmp_path / "aiva.log").read_text(encoding="utf-8").count("x" * 60)
+    second.emit(record)
+    after = (tmp_path / "aiva.log").read_text(encoding="utf-8").count("x" * 60)
+    assert after == before + 1
+    first.close()
+    second.close()
+
+
+def test_shutdown_detaches_queue_handler_and_flushes(tmp_path):
+    handler = log_pipeline.setup_logging(log_dir=str(tmp_path), console=False)
+    logging.getLogger("test_log_pipeline.shutdown").warning("last record")
+
+    log_pipeline.shutdown()
+
+    assert handler not in logging.getLogger().handlers
+    assert "last record" in (tmp_path / "aiva.log").read_text(encoding="utf-8")
+    log_pipeline.shutdown()  # เรียกซ้ำได้ (atexit หลัง worker_exit)
@@ -0,0 +1,90 @@
+"""
+ทดสอบ metrics: histogram/counter ในรูปแบบ Prometheus และการรวมค่าข้าม workers
+"""
+import os
+import subprocess
+import sys
+import time
+
+from metrics import MetricsRegistry
+
+
+def test_render_histogram_and_counter():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.observe("aiva_stage_seconds", 0.05, stage="faq")
+    registry.observe("aiva_stage_seconds", 0.5, stage="faq")
+    registry.observe("aiva_stage_seconds", 3.0, stage="faq")
+    registry.inc("aiva_answers_total", source="faq")
+    registry.inc("aiva_answers_total", source="faq")
+
+    text = registry.render()
+    assert '# TYPE aiva_stage_seconds histogram' in text
+    assert 'aiva_stage_seconds_bucket{stage="faq",le="0.1"} 1' in text
+    assert 'aiva_stage_seconds_bucket{stage="faq",le="1.0"} 2' in text
+    assert 'aiva_stage_seconds_bucket{stage="faq",le="+Inf"} 3' in text
+    assert 'aiva_stage_seconds_count{stage="faq"} 3' in text
+    assert 'aiva_stage_seconds_sum{stage="faq"} 3.55' in text
+    assert 'aiva_answers_total{source="faq"} 2' in text
+
+
+def test_metrics_are_summed_across_workers(tmp_path):
+    # registry สองตัวใน process เดียวกันได้ไฟล์ snapshot คนละชื่อ แทน worker สองตัว
+    other = MetricsRegistry(str(tmp_path), buckets=(1.0,), flush_interval=0)
+    other.inc("aiva_answers_total", source="ai")
+    other.observe("aiva_llm_seconds", 0.5, model="m", outcome="ok")
+    other.flush()
+
+    registry = MetricsRegistry(str(tmp_path), buckets=(1.0,), flush_interval=0)
+    registry.inc("aiva_answers_total", source="ai")
+    registry.observe("aiva_llm_seconds", 2.0, model="m", outcome="ok")
+
+    text = registry.render()
+    assert 'aiva_answers_total{source="ai"} 2' in text
+    assert 'aiva_llm_seconds_bucket{model="m",outcome="ok",le="1.0"} 1' in text
+    assert 'aiva_llm_seconds_count{model="m",outcome="ok"} 2' in text
+
+    registry.reset_dir()
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_values_recorded_before_fork_are_not_inherited():
+    registry = MetricsRegistry()
+    registry.inc("aiva_answers_total", source="faq")
+    registry._pid = -1  # จำลองว่าอยู่ใน process ลูกหลัง fork
+    registry.inc("aiva_answers_total", source="cache")
+
+    text = registry.render()
+    assert "faq" not in text
+    assert 'aiva_answers_total{source="cache"} 1' in text
+
+
+def test_exited_dead_and_stale_workers_keep_their_counts(tmp_path):
+    def worker():
+        registry = MetricsRegistry(str(tmp_path), flush_interval=5, stale_seconds=60)
+        registry.inc("aiva_answers_total", source="ai")
+        registry.flush()
+        return registry
+
+    reader = worker()
+    exited = worker()
+    exited.close()  # worker_exit
+    exited.flush()  # thread flush ที่ยังค้างอยู่ไม่เขียนไฟล์กลับมา
+
+    # worker ที่ถูก kill (pid ไม่มีแล้ว)
+    killed = worker()
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    os.replace(tmp_path / killed._snapshot_name(), tmp_path / f"{child.pid}.dead0000.json")
+
+    # pid ถูกใช้ซ้ำโดย process อื่น แต่ snapshot ไม่ถูกเขียนใหม่นานแล้ว
+    reused = worker()
+    stale = tmp_path / reused._snapshot_name()
+    os.utime(stale, (time.time() - 120, time.time() - 120))
+
+    for _ in range(2):  # นับครั้งเดียว ไม่ลดลงและไม่ซ้ำในการอ่านครั้งต่อไป
+        assert 'aiva_answers_total{source="ai"} 4' in reader.render()
+    assert sorted(p.name for p in tmp_path.glob("*.json")) == sorted(["retired.json", reader._snapshot_name()])
+
+    reader.close()
+    # worker ใหม่หลัง restart: ค่าของทุก worker เดิมยังอยู่ (+1 ของตัวเอง)
+    assert 'aiva_answers_total{source="ai"} 5' in worker().render()
@@ -0,0 +1,101 @@
+"""
+ทดสอบ circuit breaker ของโมเดล (429, timeout, retry-after)
+"""
+from types import SimpleNamespace
+
+from model_router import ModelRouter, classify_error, retry_after_seconds
+
+MODELS = ["main", "backup"]
+
+
+class FakeRateLimit(Exception):
+    status_code = 429
+
+    def __init__(self, headers=None):
+        super().__init__("Error code: 429 - rate_limit_exceeded")
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def test_classify_and_parse_retry_after():
+    assert classify_error(FakeRateLimit()) == "rate_limit"
+    assert classify_error(Exception("Request timed out.")) == "timeout"
+    assert classify_error(Exception("500 internal")) == "error"
+    assert retry_after_seconds(FakeRateLimit({"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(FakeRateLimit({"x-ratelimit-reset-tokens": "1m2.5s"})) == 62.5
+    assert retry_after_seconds(FakeRateLimit()) is None
+
+
+def test_rate_limit_opens_circuit_until_retry_after(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("model_router.time.monotonic", lambda: now[0])
+    router = ModelRouter(MODELS, cooldown=20)
+
+    router.record_failure("main", FakeRateLimit({"retry-after": "5"}))
+    assert router.candidates() == ["backup"]
+    assert router.snapshot()["main"]["state"] == "open"
+
+    now[0] += 5
+    assert router.candidates() == MODELS
+
+
+def test_timeouts_open_after_threshold_with_backoff(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("model_router.time.monotonic", lambda: now[0])
+    router = ModelRouter(MODELS, cooldown=10)
+
+    router.record_failure("main", Exception("timeout"))
+    assert router.candidates() == MODELS
+    router.record_failure("main", Exception("timeout"))
+    assert router.candidates() == ["backup"]
+
+    # เปิดซ้ำติดกัน cooldown เพิ่มเป็นสองเท่า
+    now[0] += 10
+    router.record_failure("main", Exception("timeout"))
+    router.record_failure("main", Exception("timeout"))
+    now[0] += 10
+    assert router.candidates() == ["backup"]
+    now[0] += 10
+    router.record_success("main", 0.5)
+    assert router.candidates() == MODELS
+    assert router.snapshot()["main"]["latency_ms"] == 500
+
+
+def test_all_open_lets_one_probe_through_to_longest_open_circuit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("model_router.time.monotonic", lambda: now[0])
+    router = ModelRouter(MODELS, cooldown=10, probe_timeout=30)
+
+    router.record_failure("main", FakeRateLimit({"retry-after": "60"}))
+    now[0] += 1
+    router.record_failure("backup", FakeRateLimit({"retry-after": "60"}))
+
+    assert router.candidates() == ["main"]
+    assert router.snapshot()["main"]["state"] == "half_open"
+    assert router.candidates() == []  # probe กำลังลองอยู่ คำขออื่นไม่ส่งซ้ำ
+
+    # probe ล้มเหลว: ปิดต่อทันที (timeout ปกติต้องสองครั้ง) แล้ว probe ต่อไปไปที่ backup
+    now[0] += 1
+    router.record_failure("main", Exception("timeout"))
+    assert router.snapshot()["main"]["state"] == "open"
+    assert router.candidates() == ["backup"]
+
+    # probe ที่ไม่ได้รายงานผลหมดสิทธิ์หลัง probe_timeout
+    now[0] += 30
+    assert router.candidates() == ["backup"]
+    router.record_success("backup", 0.5)
+    assert router.candidates() == ["backup"]
+    assert router.snapshot()["backup"]["state"] == "closed"
+
+
+def test_released_probe_lets_next_request_probe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("model_router.time.monotonic", lambda: now[0])
+    router = ModelRouter(MODELS, cooldown=10, probe_timeout=30)
+    for model in MODELS:
+        router.record_failure(model, FakeRateLimit({"retry-after": "60"}))
+
+    assert router.candidates() == ["main"]
+    assert router.candidates() == []
+    router.release_probe("main")
+    assert router.snapshot()["main"]["state"] == "open"
+    assert router.candidates() == ["main"]
@@ -0,0 +1,75 @@
+"""
+ทดสอบการดึงข้อความจาก PDF แบบขนาน (ลำดับหน้า/ไฟล์ และไฟล์ที่เสีย)
+"""
+import pdf_extractor
+from pdf_extractor import extract_pdfs
+
+
+def write_pdf(path, pages):
+    """สร้าง PDF ง่ายๆ ที่แต่ละหน้ามีข้อความภาษาอังกฤษหนึ่งบรรทัด"""
+    n = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(n))}] /Count {n} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(out)
+
+
+def test_parallel_extraction_keeps_page_and_file_order(tmp_path):
+    a = tmp_path / "a.pdf"
+    b = tmp_path / "b.pdf"
+    write_pdf(a, [f"Page A{i}" for i in range(1, 6)])
+    write_pdf(b, ["Page B1", "Page B2"])
+
+    results = extract_pdfs([str(a), str(b)], workers=2, pages_per_task=2)
+
+    assert list(results) == [str(a), str(b)]
+    assert [p.strip() for p in results[str(a)].text.split("\f")] == [f"Page A{i}" for i in range(1, 6)]
+    assert results[str(a)].pages == 5 and results[str(a)].failed == []
+    serial = extract_pdfs([str(a), str(b)], workers=1)
+    assert [r.text for r in results.values()] == [r.text for r in serial.values()]
+
+
+def test_unreadable_file_does_not_stop_other_files(tmp_path):
+    good = tmp_path / "good.pdf"
+    bad = tmp_path / "bad.pdf"
+    write_pdf(good, ["Hello"])
+    bad.write_bytes(b"not a pdf")
+
+    results = extract_pdfs([str(bad), str(good)], workers=2)
+
+    assert list(results) == [str(good)]
+    assert results[str(good)].text.strip() == "Hello"
+
+
+def test_progress_is_logged_per_page_range(tmp_path, caplog):
+    a = tmp_path / "a.pdf"
+    write_pdf(a, [f"Page A{i}" for i in range(1, 6)])
+
+    with caplog.at_level("DEBUG", logger="pdf_extractor"):
+        extract_pdfs([str(a)], workers=1, pages_per_task=2)
+
+    progress = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Extracted pages")]
+    assert progress == ["Extracted pages 1-2 of a.pdf (2/5 pages)", "Extracted pages 3-4 of a.pdf (4/5 pages)",
+                        "Extracted pages 5-5 of a.pdf (5/5 pages)"]
+
+
+def test_pool_does_not_fork_the_calling_process():
+    # fork จาก worker ที่มี thread (log/metrics) อาจได้ lock ที่ค้างอยู่ติดไปใน process ลูก
+    assert pdf_extractor._pool_context().get_start_method() in ("forkserver", "spawn")
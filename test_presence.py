@@ -0,0 +1,35 @@
+"""
+ทดสอบ PresenceTracker: คนมา/ไปเป็นเหตุการณ์เดียว ไม่ใช่ทุกเฟรม และอัตราตรวจจับปรับตามสถานะ
+"""
+from presence import PresenceTracker
+
+
+def test_presence_events_are_debounced():
+    tracker = PresenceTracker(enter_frames=2, leave_seconds=3.0)
+
+    assert tracker.update(True, 0.0) is None      # เฟรมเดียวยังไม่นับว่ามีคน
+    assert tracker.confirming
+    assert tracker.update(True, 0.2) == "enter"
+    assert tracker.update(False, 1.0) is None     # หลุดไปชั่วคราว
+    assert tracker.update(True, 1.2) is None
+    assert tracker.update(False, 3.0) is None
+    assert tracker.update(False, 4.3) == "leave"
+    assert tracker.update(False, 10.0) is None    # ไม่เรียกซ้ำทุกเฟรมตอนไม่มีคน
+    assert not tracker.present
+
+
+def test_detection_rate_is_fast_only_while_someone_is_there():
+    tracker = PresenceTracker(enter_frames=2, leave_seconds=1.0)
+    assert tracker.next_interval(1.0, 0.2) == 1.0
+
+    tracker.update(True, 0.0)
+    assert tracker.next_interval(1.0, 0.2) == 0.2  # กำลังยืนยัน
+    tracker.update(False, 0.2)
+    assert tracker.next_interval(1.0, 0.2) == 1.0  # เจอครั้งเดียวแล้วหาย (false positive)
+
+    tracker.update(True, 1.0)
+    tracker.update(True, 1.2)
+    tracker.update(False, 1.5)
+    assert tracker.next_interval(1.0, 0.2) == 0.2  # ยังนับว่ามีคนจนครบ leave_seconds
+    tracker.update(False, 2.3)
+    assert tracker.next_interval(1.0, 0.2) == 1.0
@@ -0,0 +1,32 @@
+"""
+ทดสอบการประกอบ prompt ตามงบ token ของโมเดล
+"""
+from chunker import wrap_source
+from prompt_builder import build_prompt, estimate_tokens
+from retrieval import RetrievalIndex
+
+
+def _render(context):
+    return f"คำสั่ง\n[Context]\n{context}"
+
+
+def test_estimate_tokens_thai_costs_more_than_latin():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("สวัสดีค่ะ", "llama-3.1-8b-instant") > estimate_tokens("hello", "llama-3.1-8b-instant")
+    assert estimate_tokens("สวัสดีค่ะ" * 10, "gemma2-9b-it") < estimate_tokens("สวัสดีค่ะ" * 10, "llama-3.1-8b-instant")
+
+
+def test_fills_by_score_within_budget_and_skips_duplicates(monkeypatch):
+    monkeypatch.setattr("prompt_builder._BUDGET_OVERRIDE", "120")
+    paragraphs = ["สาขาการบัญชี เรียนบัญชีและภาษี", "สาขาการตลาด เรียนการขายออนไลน์",
+                  "ค่าเทอมประมาณห้าพันบาท", "สาขาการบัญชี เรียนบัญชีและภาษี"]
+    text = "".join(wrap_source(f"{i}.txt", p * 3) for i, p in enumerate(paragraphs))
+    index = RetrievalIndex.build(text, chunk_size=1000, overlap=0)
+    hits = [(4.0, 3), (3.0, 0), (2.0, 2), (1.0, 1)]
+
+    plan = build_prompt(index, hits, "llama-3.1-8b-instant", _render, "เรียนบัญชีไหม")
+
+    # chunk 0 ซ้ำกับ chunk 3 ที่คะแนนสูงกว่า, chunk 1 คะแนนต่ำสุดไม่พองบ
+    assert plan.chunk_ids == [3, 2]
+    assert plan.prompt_tokens <= plan.budget == 120
+    assert "[3.txt]" in plan.system_prompt and "[2.txt]" in plan.system_prompt
@@ -0,0 +1,68 @@
+"""
+ทดสอบ retrieval index (BM25 + Thai tokenization)
+"""
+from retrieval import RetrievalIndex, tokenize
+
+
+def test_tokenize_thai_bigrams_and_words():
+    assert tokenize("Hello AIVA") == ["hello", "aiva"]
+    assert tokenize("บัญชี") == ["บั", "ัญ", "ญช", "ชี"]
+    assert tokenize("ปี 2567") == ["ปี", "2567"]
+
+
+def test_search_ranks_matching_chunk_first():
+    segments = [
+        "ข้อมูลทั่วไปของวิทยาลัย ตั้งอยู่ที่กรุงเทพ",
+        "สาขาการบัญชี เรียนเกี่ยวกับบัญชีและภาษี",
+        "สาขาคอมพิวเตอร์ธุรกิจ เรียนเขียนโปรแกรม",
+    ]
+    text = "".join(seg.ljust(100) for seg in segments)
+    index = RetrievalIndex.build(text, chunk_size=100)
+
+    results = index.search("อยากเรียนบัญชี", top_k=2)
+    assert results[0][1] == 1
+    assert "บัญชี" in index.chunk_text(results[0][1])
+
+
+def test_search_without_matching_terms_returns_empty():
+    index = RetrievalIndex.build("สวัสดีค่ะ" * 50, chunk_size=100)
+    assert index.search("xyz") == []
+
+
+def test_search_many_matches_search():
+    segments = ["สาขาการบัญชี", "สาขาการตลาด", "ค่าเทอม 5000 บาท", "สาขาการบัญชี"] * 3
+    index = RetrievalIndex.build("".join(seg.ljust(100) for seg in segments), chunk_size=100)
+    queries = ["บัญชี", "ค่าเทอมเท่าไหร่", "xyz", "สาขาการตลาด"]
+
+    batched = index.search_many(queries, top_k=3)
+    for query, results in zip(queries, batched):
+        expected = index.search(query, top_k=3)
+        assert [c for _, c in results] == [c for _, c in expected]
+        assert all(abs(a[0] - b[0]) < 1e-9 for a, b in zip(results, expected))
+
+
+def test_context_blocks_merge_overlapping_chunks():
+    from chunker import wrap_source
+
+    body = "\n".join(f"บรรทัดที่ {i} ".ljust(40) for i in range(10)) + "\n"
+    index = RetrievalIndex.build(wrap_source("a.txt", body), chunk_size=200, overlap=50)
+    assert len(index) > 1
+    assert index.chunk_info(0)["source"] == "a.txt"
+
+    blocks = index.context_blocks(range(len(index)))
+    assert blocks == [("a.txt", body.strip())]
+
+
+def test_store_roundtrip_matches_in_memory_index(tmp_path):
+    from kb_store import KnowledgeStore, write_store
+
+    text = "".join(seg.ljust(100) for seg in ["สาขาการบัญชี", "สาขาการตลาด", "ค่าเทอม 5000 บาท"])
+    index = RetrievalIndex.build(text, chunk_size=100)
+    path = str(tmp_path / "kb.bin")
+    write_store(path, index, [{"keywords": ["สวัสดี"], "answer": "สวัสดีค่ะ"}], "v1")
+
+    store = KnowledgeStore(path)
+    assert store.version == "v1"
+    assert store.faq_data[0]["answer"] == "สวัสดีค่ะ"
+    assert store.index.full_text() == text
+    assert store.index.search("ค่าเทอม") == index.search("ค่าเทอม")
@@ -0,0 +1,79 @@
+"""
+ทดสอบการรวมคำถามเดียวกันที่เข้ามาพร้อมกัน (single-flight)
+"""
+import time
+import threading
+
+from singleflight import SingleFlight, worker_lock
+
+
+def _run_concurrently(n, target):
+    results = [None] * n
+    start = threading.Barrier(n)
+
+    def worker(i):
+        start.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+
+    def slow_answer():
+        calls.append(1)
+        time.sleep(0.2)
+        return "คำตอบ"
+
+    results = _run_concurrently(5, lambda: flight.do("ค่าเทอม", slow_answer))
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(answer == "คำตอบ" for answer, _ in results)
+    assert flight.stats() == {"leaders": 1, "shared": 4, "in_flight": 0}
+
+
+def test_error_is_raised_to_waiters_and_key_is_released():
+    flight = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError("upstream down")
+
+    results = _run_concurrently(3, lambda: flight.do("k", failing))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.do("k", lambda: "ok") == ("ok", False)
+
+
+def test_worker_lock_serializes_holders(tmp_path):
+    order = []
+
+    def holder(name, hold):
+        with worker_lock(str(tmp_path), "คำถาม") as acquired:
+            order.append((name, acquired, time.monotonic()))
+            time.sleep(hold)
+
+    first = threading.Thread(target=holder, args=("a", 0.2))
+    first.start()
+    time.sleep(0.05)
+    holder("b", 0)
+    first.join()
+
+    assert [(name, acquired) for name, acquired, _ in order] == [("a", True), ("b", True)]
+    assert order[1][2] - order[0][2] >= 0.15
+
+
+def test_worker_lock_gives_up_after_timeout(tmp_path):
+    with worker_lock(str(tmp_path), "k"):
+        with worker_lock(str(tmp_path), "k", timeout=0.1) as acquired:
+            assert acquired is False
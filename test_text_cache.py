@@ -0,0 +1,68 @@
+"""
+ทดสอบ cache ข้อความที่ดึงจาก PDF
+"""
+import os
+
+from text_cache import ExtractedTextCache, file_sha256
+
+
+def test_cache_hit_until_file_changes(tmp_path):
+    doc = tmp_path / "doc.pdf"
+    doc.write_bytes(b"%PDF-1.4 original")
+    cache_dir = str(tmp_path / "cache")
+
+    cache = ExtractedTextCache(cache_dir)
+    assert cache.get(str(doc)) is None
+    cache.put(str(doc), "ข้อความจาก PDF")
+    cache.save()
+
+    # worker ใหม่อ่าน index จากดิสก์
+    cache = ExtractedTextCache(cache_dir)
+    assert cache.get(str(doc)) == "ข้อความจาก PDF"
+    assert cache.hits == 1
+
+    doc.write_bytes(b"%PDF-1.4 changed content")
+    assert cache.get(str(doc)) is None
+
+
+def test_touched_file_with_same_content_is_hit(tmp_path):
+    doc = tmp_path / "doc.pdf"
+    doc.write_bytes(b"%PDF-1.4 same")
+    cache = ExtractedTextCache(str(tmp_path / "cache"))
+    cache.put(str(doc), "เนื้อหาเดิม")
+
+    st = os.stat(doc)
+    os.utime(doc, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+    assert cache.get(str(doc)) == "เนื้อหาเดิม"
+
+
+def test_put_reuses_hash_from_get_and_deleted_file_is_a_miss(tmp_path, monkeypatch):
+    doc = tmp_path / "doc.pdf"
+    doc.write_bytes(b"%PDF-1.4 new")
+    cache = ExtractedTextCache(str(tmp_path / "cache"))
+    hashed = []
+    monkeypatch.setattr("text_cache.file_sha256", lambda path: hashed.append(path) or file_sha256(path))
+
+    assert cache.get(str(doc)) is None
+    cache.put(str(doc), "ข้อความใหม่")
+    assert len(hashed) == 1
+    assert cache.get(str(doc)) == "ข้อความใหม่"
+
+    # ไฟล์ถูกลบระหว่าง scan: miss (ไม่ raise) และ put ไม่ทำให้การโหลดล้ม
+    gone = tmp_path / "gone.pdf"
+    assert cache.get(str(gone)) is None
+    cache.put(str(gone), "ไม่มีไฟล์แล้ว")
+    cache.save()
+    assert cache.get(str(doc)) == "ข้อความใหม่"
+
+
+def test_file_changed_during_extraction_is_not_cached(tmp_path):
+    doc = tmp_path / "doc.pdf"
+    doc.write_bytes(b"%PDF-1.4 before")
+    cache = ExtractedTextCache(str(tmp_path / "cache"))
+
+    assert cache.get(str(doc)) is None
+    doc.write_bytes(b"%PDF-1.4 replaced while extracting")
+    cache.put(str(doc), "ข้อความจากเนื้อหาเดิม")
+
+    assert cache.get(str(doc)) is None
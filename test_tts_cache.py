@@ -0,0 +1,116 @@
+"""
+ทดสอบ cache ไฟล์เสียง TTS (ไม่เรียก gTTS จริง)
+"""
+import threading
+import time
+
+import gtts
+
+from tts_cache import TTSCache, tts_key
+
+
+class FakeTTS:
+    calls = 0
+
+    def __init__(self, text, lang='th', slow=False):
+        self.text = text
+
+    def write_to_fp(self, fp):
+        FakeTTS.calls += 1
+        fp.write(self.text.encode('utf-8') * 100)
+
+
+def test_same_text_is_synthesized_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtts, "gTTS", FakeTTS)
+    FakeTTS.calls = 0
+    cache = TTSCache(str(tmp_path))
+
+    key, audio = cache.get_or_create("สวัสดีค่ะ")
+    assert key == tts_key("สวัสดีค่ะ", "th", False)
+    assert cache.get_or_create("สวัสดีค่ะ") == (key, audio)
+    assert FakeTTS.calls == 1
+    assert cache.hits == 1
+
+    cache.get_or_create("สวัสดีค่ะ", slow=True)
+    assert FakeTTS.calls == 2
+
+
+def test_worker_waits_for_clip_synthesized_by_another_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtts, "gTTS", FakeTTS)
+    FakeTTS.calls = 0
+    prefetching = TTSCache(str(tmp_path))  # worker ที่ตอบ /tts_plan
+    other = TTSCache(str(tmp_path))        # worker ที่ได้ GET ของ browser
+    key = tts_key("ประโยคแรกค่ะ")
+    started = threading.Event()
+
+    def prefetch():
+        with prefetching._disk_lock(key):
+            started.set()
+            time.sleep(0.2)  # gTTS กำลังสังเคราะห์
+            prefetching._write_disk(key, b"clip")
+
+    thread = threading.Thread(target=prefetch)
+    thread.start()
+    started.wait()
+    assert other.get_or_create("ประโยคแรกค่ะ") == (key, b"clip")
+    thread.join()
+    assert FakeTTS.calls == 0
+
+
+def test_eviction_keeps_cache_under_size_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtts, "gTTS", FakeTTS)
+    cache = TTSCache(str(tmp_path), max_bytes=8000)
+
+    assert cache.warm_up(["ข้อความหนึ่ง", "ข้อความสอง", "ข้อความสาม"]) == 3
+    sizes = [p.stat().st_size for p in (tmp_path / "tts").glob("*.mp3")]
+    assert sum(sizes) <= 8000
+    assert cache.lookup(tts_key("ข้อความสาม")) is not None
+
+
+def test_memory_only_cache_serves_ranges_without_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtts, "gTTS", FakeTTS)
+    monkeypatch.chdir(tmp_path)  # logs/ และ data_files/ ของ app ไปอยู่ใน tmp_path
+    import app
+
+    cache = TTSCache(str(tmp_path), memory_bytes=4000, disk=False)
+    monkeypatch.setattr(app, "tts_cache", cache)
+
+    key, audio = cache.get_or_create("ทดสอบ")
+    client = app.app.test_client()
+    response = client.get(f"/tts_audio/{key}.mp3", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.data == audio[:10]
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(audio)}"
+    assert client.get(f"/tts_audio/{key}.mp3", headers={"If-None-Match": f'"{key}"'}).status_code == 304
+    assert list(tmp_path.rglob("*.mp3")) == []
+
+    # LRU ในหน่วยความจำไม่เกิน memory_bytes
+    for i in range(5):
+        cache.get_or_create(f"ข้อความ {i}")
+    assert cache.stats()["memory_bytes"] <= 4000
+    assert cache.lookup(key) is None
+
+
+def test_split_sentences_keeps_text_and_starts_short():
+    from tts_pipeline import split_sentences
+
+    text = ("สวัสดีค่ะ ดิฉันชื่อไอว่า ยินดีต้อนรับเข้าสู่วิทยาลัยพณิชยการธนบุรีค่ะ "
+            "วิทยาลัยเปิดรับสมัครนักเรียนใหม่ทุกปี ในช่วงเดือนกุมภาพันธ์ถึงมีนาคม "
+            "สามารถสมัครได้ทั้งออนไลน์และที่วิทยาลัยค่ะ")
+    chunks = split_sentences(text, min_chars=20, max_chars=80)
+    assert len(chunks) > 2
+    assert len(chunks[0]) <= 40
+    assert all(len(c) <= 80 for c in chunks)
+    assert "".join(chunks).replace(" ", "") == text.replace(" ", "")
+
+
+def test_pipelined_yields_in_input_order():
+    import random
+    import time
+    from tts_pipeline import pipelined
+
+    def slow_upper(item):
+        time.sleep(random.uniform(0, 0.02))
+        return item * 2
+
+    assert list(pipelined(range(10), slow_upper, max_workers=3)) == [i * 2 for i in range(10)]
@@ -0,0 +1,129 @@
+"""
+AIVA - Extracted Text Cache
+เก็บข้อความที่ดึงจาก PDF ไว้บนดิสก์ เพื่อไม่ต้องรัน pdfplumber ใหม่ทุกครั้งที่ worker เริ่มทำงาน
+
+- index.json เก็บ path -> size, mtime, sha256 ของไฟล์ต้นฉบับ
+- ข้อความเก็บแยกไฟล์ตาม sha256 ของเนื้อหา PDF (content-addressed)
+- ถ้า size/mtime ตรงกัน ถือว่า hit ทันที, ถ้าไม่ตรงจะคำนวณ hash ใหม่ก่อนตัดสิน
+- hash ที่คำนวณตอน get() ที่ miss ถูกใช้ต่อใน put() (ไม่อ่านไฟล์ PDF ซ้ำ)
+  ถ้า size/mtime เปลี่ยนระหว่างดึงข้อความ put() จะไม่เก็บ (ข้อความอาจมาจากเนื้อหาเก่า/ครึ่งๆ กลางๆ)
+- ไฟล์ที่อ่าน/stat ไม่ได้ (เช่น ถูกลบระหว่าง scan) นับเป็น miss ให้ผู้เรียกดึงข้อความตามปกติ
+"""
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("AIVA_CACHE_DIR", ".cache")
+
+# เปลี่ยนเมื่อรูปแบบข้อความที่ดึงออกมาเปลี่ยน (2: หน้าของ PDF คั่นด้วย form feed)
+TEXT_FORMAT = 2
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _atomic_write(path: str, data: str):
+    """เขียนไฟล์แบบ atomic (หลาย worker อาจเขียนพร้อมกัน)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ExtractedTextCache:
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "extracted_text")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._entries = {}
+        self._pending = {}  # path -> size/mtime/sha256 ของไฟล์ที่ miss (รอ put)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load extracted text cache index: {e}")
+            self._entries = {}
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, f"{sha256}.v{TEXT_FORMAT}.txt")
+
+    def _read_blob(self, sha256: str):
+        try:
+            with open(self._blob_path(sha256), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, path: str):
+        """คืนข้อความที่ cache ไว้ หรือ None ถ้าไฟล์ใหม่/ถูกแก้ไข"""
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        try:
+            st = os.stat(path)
+            if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                text = self._read_blob(entry["sha256"])
+                if text is not None:
+                    self.hits += 1
+                    return text
+
+            # size/mtime เปลี่ยน (เช่น copy ไฟล์ใหม่ทับ) ตรวจด้วย hash ของเนื้อหาอีกครั้ง
+            sha256 = file_sha256(path)
+        except OSError as e:
+            logger.warning(f"Could not fingerprint {path}: {e}")
+            self.misses += 1
+            return None
+
+        fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+        text = self._read_blob(sha256)
+        if text is not None:
+            self._entries[key] = fingerprint
+            self._dirty = True
+            self.hits += 1
+            return text
+
+        self._pending[key] = fingerprint
+        self.misses += 1
+        return None
+
+    def put(self, path: str, text: str):
+        """เก็บข้อความของไฟล์ (ใช้ hash จาก get() ที่ miss ถ้ามี)"""
+        key = os.path.abspath(path)
+        try:
+            fingerprint = self._pending.pop(key, None)
+            st = os.stat(path)
+            if fingerprint is None:
+                fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(path)}
+            elif fingerprint["size"] != st.st_size or fingerprint["mtime_ns"] != st.st_mtime_ns:
+                logger.info(f"{path} changed during extraction - not caching its text")
+                return
+            _atomic_write(self._blob_path(fingerprint["sha256"]), text)
+            self._entries[key] = fingerprint
+            self._dirty = True
+        except OSError as e:
+            logger.warning(f"Could not write extracted text cache for {path}: {e}")
+
+    def save(self):
+        """บันทึก index ลงดิสก์ (ลบ entry ของไฟล์ที่ไม่มีอยู่แล้ว)"""
+        stale = [k for k in self._entries if not os.path.exists(k)]
+        for k in stale:
+            del self._entries[k]
+        if not (self._dirty or stale):
+            return
+        try:
+            _atomic_write(self.index_path, json.dumps(self._entries, ensure_ascii=False, indent=1))
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"Could not save extracted text cache index: {e}")
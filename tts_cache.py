@@ -0,0 +1,216 @@
+"""
+AIVA - TTS Audio Cache
+เก็บเสียงจาก gTTS แบบ content-addressed (key = hash ของ text, lang, speed)
+ข้อความที่พูดซ้ำ (คำตอบ FAQ, คำทักทาย) จึงไม่ต้องเรียก gTTS ทุกครั้ง
+
+- สังเคราะห์ลง buffer ในหน่วยความจำ (ไม่มีไฟล์ชั่วคราว) และเก็บไว้ใน LRU ในหน่วยความจำของ worker
+  request ที่ hit ใน LRU จึงไม่แตะดิสก์เลย
+- ชั้นดิสก์ (AIVA_TTS_DISK_CACHE=1) ใช้แชร์เสียงข้าม workers/รอบ deploy
+  จำกัดขนาดรวมและลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน (LRU ตาม mtime ลบเบื้องหลังหลังตอบ request แล้ว)
+- ข้อความเดียวกันสังเคราะห์ครั้งเดียวข้าม workers: worker ที่สังเคราะห์ถือ lock file ของ key จนเขียนลงดิสก์เสร็จ
+  worker อื่น (เช่น GET ของ browser ที่ไปตก worker อื่นระหว่าง prefetch ของ /tts_plan) รอแล้วอ่านจากดิสก์
+- warm-up ตอน deploy: python tts_cache.py warm  (สร้างเสียงคำตอบ FAQ และคำทักทายไว้ล่วงหน้า)
+"""
+import io
+import os
+import sys
+import glob
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import metrics
+from singleflight import worker_lock
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("AIVA_CACHE_DIR", ".cache")
+DISK_CACHE = os.environ.get("AIVA_TTS_DISK_CACHE", "1") == "1"
+SYNTHESIS_LOCK_TIMEOUT = 30.0  # รอ worker อื่นสังเคราะห์ได้นานสุด (วินาที) ก่อนสังเคราะห์เอง
+
+
+def tts_key(text: str, lang: str = 'th', slow: bool = False) -> str:
+    return hashlib.sha256(f"{lang}\0{int(slow)}\0{text}".encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, cache_dir: str = None, max_bytes: int = 200 * 1024 * 1024,
+                 memory_bytes: int = 32 * 1024 * 1024, disk: bool = DISK_CACHE):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "tts") if disk else None
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()   # key -> bytes (ท้ายสุด = ใช้ล่าสุด)
+        self._memory_size = 0
+        self._memory_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._memory_lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def lookup(self, key: str):
+        """คืนเสียง (bytes) ถ้ามีใน cache: หน่วยความจำก่อน แล้วจึงดิสก์ (อัปเดต mtime สำหรับ LRU)"""
+        with self._memory_lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if not self.cache_dir:
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def get_or_create(self, text: str, lang: str = 'th', slow: bool = False, wait_for_disk: bool = False):
+        """คืน (key, bytes) ของเสียง สร้างด้วย gTTS ถ้ายังไม่มี
+
+        wait_for_disk=True รอให้เขียนลงดิสก์เสร็จก่อนคืนค่า (ใช้ตอน warm-up ที่ process จะจบทันที)
+        """
+        key = tts_key(text, lang, slow)
+        data = self.lookup(key)
+        if data is not None:
+            self.hits += 1
+            metrics.inc("aiva_tts_cache_total", result="hit")
+            return key, data
+
+        # ข้อความเดียวกันที่กำลังสังเคราะห์อยู่ (เช่น prefetch) ให้รอผลแทนการเรียก gTTS ซ้ำ
+        # ใน process ด้วย lock ของ key และข้าม workers ด้วย lock file (ผลอยู่บนดิสก์เมื่อได้ lock)
+        with self._inflight_lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        try:
+            with key_lock, self._disk_lock(key):
+                data = self.lookup(key)
+                if data is not None:
+                    self.hits += 1
+                    metrics.inc("aiva_tts_cache_total", result="hit")
+                    return key, data
+                self.misses += 1
+                metrics.inc("aiva_tts_cache_total", result="miss")
+                with metrics.timer("aiva_stage_seconds", stage="tts_synthesis"):
+                    data = self._synthesize(text, lang, slow)
+                self._remember(key, data)
+                # เขียนก่อนปล่อย lock: worker ที่รออยู่จะอ่านจากดิสก์แทนการเรียก gTTS ซ้ำ
+                written = self._write_disk(key, data)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+        if written:
+            if wait_for_disk:
+                self.evict(keep=self.path_for(key))
+            else:
+                threading.Thread(target=self.evict, args=(self.path_for(key),), daemon=True,
+                                 name="tts-evict").start()
+        return key, data
+
+    def _disk_lock(self, key: str):
+        if not self.cache_dir:
+            return nullcontext(False)
+        return worker_lock(os.path.join(self.cache_dir, "inflight"), key, timeout=SYNTHESIS_LOCK_TIMEOUT)
+
+    def _synthesize(self, text: str, lang: str, slow: bool) -> bytes:
+        from gtts import gTTS
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=slow).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def _write_disk(self, key: str, data: bytes) -> bool:
+        """เขียนเสียงลงดิสก์ให้ worker อื่น/รอบถัดไปใช้ (เขียนไฟล์ .part แล้ว rename)"""
+        if not self.cache_dir:
+            return False
+        path = self.path_for(key)
+        part_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(part_path, 'wb') as f:
+                f.write(data)
+            os.replace(part_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not write TTS clip {key[:12]} to disk cache: {e}")
+            return False
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def evict(self, keep: str = None):
+        """ลบไฟล์เก่าที่สุดจนขนาดรวมไม่เกิน max_bytes (ยกเว้นไฟล์ keep ที่เพิ่งสร้าง)"""
+        if not self.cache_dir:
+            return
+        with self._evict_lock:
+            files = []
+            total = 0
+            for path in glob.glob(os.path.join(self.cache_dir, "*.mp3")):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            logger.info(f"TTS cache evicted to {total} bytes")
+
+    def stats(self) -> dict:
+        with self._memory_lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "memory_clips": len(self._memory), "memory_bytes": self._memory_size}
+
+    def warm_up(self, texts, lang: str = 'th', slow: bool = False) -> int:
+        """สร้างเสียงของข้อความที่ใช้บ่อยไว้ล่วงหน้า คืนจำนวนไฟล์ที่สร้างใหม่"""
+        created = 0
+        for text in texts:
+            if not text or self.lookup(tts_key(text, lang, slow)) is not None:
+                continue
+            try:
+                self.get_or_create(text, lang, slow, wait_for_disk=True)
+                created += 1
+            except Exception as e:
+                logger.warning(f"TTS warm-up failed for '{text[:30]}...': {e}")
+        logger.info(f"TTS warm-up complete: {created} new clips, {len(texts)} texts")
+        return created
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != "warm":
+        print("Usage: python tts_cache.py warm")
+        sys.exit(1)
+    import app
+    print(f"TTS cache warmed: {app.warm_tts_cache()} new clips")
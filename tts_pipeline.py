@@ -0,0 +1,66 @@
+"""
+AIVA - Pipelined TTS
+แบ่งคำตอบเป็นประโยค/วลี แล้วสังเคราะห์เสียงหลายส่วนพร้อมกัน (จำกัดจำนวน worker)
+โดยส่งผลลัพธ์ออกตามลำดับเดิม ทำให้เริ่มเล่นส่วนแรกได้ก่อนที่ส่วนหลังจะเสร็จ
+"""
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# จุดตัดประโยค: เครื่องหมายจบประโยค, ขึ้นบรรทัดใหม่, และช่องว่าง (ภาษาไทยใช้ช่องว่างคั่นประโยค/วลี)
+_BOUNDARY_RE = re.compile(r'(?<=[.!?。…])\s*|\n+|\s+')
+
+MIN_CHUNK_CHARS = 40
+MAX_CHUNK_CHARS = 200
+
+
+def split_sentences(text: str, min_chars: int = MIN_CHUNK_CHARS, max_chars: int = MAX_CHUNK_CHARS) -> list:
+    """แบ่งข้อความเป็นส่วนสำหรับ TTS
+
+    ส่วนแรกพยายามให้สั้น (ถึง min_chars ก็ตัด) เพื่อให้เริ่มพูดได้เร็ว
+    ส่วนถัดไปรวมวลีจนใกล้ max_chars เพื่อลดจำนวนครั้งที่เรียก gTTS และให้น้ำเสียงต่อเนื่อง
+    """
+    pieces = [p.strip() for p in _BOUNDARY_RE.split(text) if p and p.strip()]
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current} {piece}" if current else piece
+        limit = min_chars if not chunks else max_chars
+        if current and len(candidate) > limit:
+            chunks.append(current)
+            current = piece
+        else:
+            current = candidate
+        # วลีเดียวยาวเกิน max_chars (ไม่มีช่องว่างเลย) ตัดตามความยาว
+        while len(current) > max_chars:
+            chunks.append(current[:max_chars])
+            current = current[max_chars:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def pipelined(items, fn, max_workers: int = 3):
+    """เรียก fn(item) พร้อมกันไม่เกิน max_workers งาน แล้ว yield ผลลัพธ์ตามลำดับ items
+
+    ถ้าผู้เรียกหยุดอ่าน (เช่น สั่งหยุดพูด) งานที่ยังไม่เริ่มจะถูกยกเลิก
+    และรอเฉพาะงานที่กำลังทำอยู่ให้จบ (ไม่เกิน max_workers งาน)
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
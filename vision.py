@@ -1,11 +1,27 @@
 # vision.py
+import os
 import cv2
 import threading
 import time
 
+from presence import PresenceTracker
+
+# โหมดประหยัด CPU (ดู HumanDetector) เปิดด้วย AIVA_VISION_LOW_CPU=1 หรือ low_cpu=True
+LOW_CPU = os.environ.get("AIVA_VISION_LOW_CPU", "0") == "1"
+
+
 class HumanDetector:
-    def __init__(self, camera_index=0, cascade_path=None, detection_callback=None, idle_callback=None, detection_cooldown=3):
+    def __init__(self, camera_index=0, cascade_path=None, detection_callback=None, idle_callback=None, detection_cooldown=3,
+                 low_cpu=None, detect_width=320, roi=None, idle_interval=1.0, active_interval=0.2,
+                 enter_frames=2, leave_seconds=5.0):
         # cascade_path: path to haarcascade_frontalface_default.xml
+        # low_cpu=None: ใช้ค่า AIVA_VISION_LOW_CPU (ค่าเริ่มต้นปิด)
+        # low_cpu=True: ย่อภาพก่อนตรวจจับ, ตรวจช้าเมื่อไม่มีคน/เร็วเมื่อมีคน และเรียก callback เฉพาะตอนคนมา/ไป
+        #   detection_callback ถูกเรียกตอนคนมา (enter) idle_callback ถูกเรียกครั้งเดียวตอนคนไป (leave)
+        # low_cpu=False: ตรวจทุกเฟรมเต็มความละเอียดและเรียก idle_callback ทุกเฟรมที่ไม่เจอ (แบบเดิม)
+        # detect_width: ความกว้าง (px) ของภาพที่ใช้ตรวจจับ (None = ไม่ย่อ)
+        # roi: (x, y, w, h) เป็นสัดส่วน 0-1 ของภาพ เช่น (0.25, 0, 0.5, 1) = เฉพาะครึ่งกลาง
+        # idle_interval / active_interval: วินาทีระหว่างการตรวจจับเมื่อไม่มีคน / เมื่อมีคน
         if cascade_path is None:
             cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
         self.face_cascade = cv2.CascadeClassifier(cascade_path)
@@ -16,9 +32,19 @@ class HumanDetector:
         self.detection_cooldown = detection_cooldown
         self._last_detection_time = 0
 
+        self.low_cpu = LOW_CPU if low_cpu is None else low_cpu
+        self.detect_width = detect_width
+        self.roi = roi
+        self.idle_interval = idle_interval
+        self.active_interval = active_interval
+        self.presence = PresenceTracker(enter_frames, leave_seconds)
+        if self.low_cpu:
+            # เก็บเฟรมค้างใน buffer ให้น้อยที่สุด เฟรมที่อ่านหลังพักจึงเป็นภาพล่าสุด (บาง backend ไม่รองรับ)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
     def start(self):
         self.running = True
-        t = threading.Thread(target=self._loop, daemon=True)
+        t = threading.Thread(target=self._loop if self.low_cpu else self._loop_every_frame, daemon=True)
         t.start()
 
     def stop(self):
@@ -28,7 +54,49 @@ class HumanDetector:
         except:
             pass
 
+    def _prepare(self, frame):
+        """ตัดเฉพาะ roi แปลงเป็นขาวดำ แล้วย่อให้กว้าง detect_width คืน (ภาพ, อัตราส่วนที่ย่อ)"""
+        if self.roi:
+            height, width = frame.shape[:2]
+            x, y, w, h = self.roi
+            frame = frame[int(y * height):int((y + h) * height), int(x * width):int((x + w) * width)]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = 1.0
+        if self.detect_width and gray.shape[1] > self.detect_width:
+            scale = self.detect_width / gray.shape[1]
+            gray = cv2.resize(gray, (self.detect_width, int(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    def _detect(self, frame):
+        gray, scale = self._prepare(frame)
+        # minSize เดิม 60px ที่ความละเอียดเต็ม ย่อตามภาพ
+        min_size = max(20, int(60 * scale))
+        return self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+
+    def _call(self, callback, name):
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                print(f"{name} error:", e)
+
     def _loop(self):
+        while self.running:
+            started = time.time()
+            ret, frame = self.cap.read()
+            if ret:
+                faces = self._detect(frame)
+                now = time.time()
+                event = self.presence.update(len(faces) > 0, now)
+                if event == "enter" and now - self._last_detection_time > self.detection_cooldown:
+                    self._last_detection_time = now
+                    self._call(self.detection_callback, "detection_callback")
+                elif event == "leave":
+                    self._call(self.idle_callback, "idle_callback")
+            interval = self.presence.next_interval(self.idle_interval, self.active_interval)
+            time.sleep(max(0.0, interval - (time.time() - started)))
+
+    def _loop_every_frame(self):
         while self.running:
             ret, frame = self.cap.read()
             if not ret: